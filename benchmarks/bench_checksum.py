@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+""" Benchmark: local multipart checksum throughput (GiB/s) vs. number of workers.
+
+    python -m benchmarks.bench_checksum [--size-gib 4] [--workers 1,2,4,8]
+
+The generated file is sparse, so the numbers show hashing and syscall cost, not disk speed.
+"""
+
+import os, tempfile, time, click
+
+from oarepo_s3_cli.constants import MID_PART_SIZE
+from oarepo_s3_cli.utils import get_local_hash
+
+GIB = 1024 * 1024 * 1024
+
+
+@click.command()
+@click.option('--size-gib', default=4, show_default=True)
+@click.option('--part-size', default=MID_PART_SIZE, show_default=True)
+@click.option('--workers', default='1,2,4,8', show_default=True)
+@click.option('--dir', 'tmpdir', default=None, help='directory for generated file [default: system temp]')
+def main(size_gib, part_size, workers, tmpdir):
+    with tempfile.TemporaryDirectory(dir=tmpdir) as tmpdir:
+        file = os.path.join(tmpdir, 'sparse.dat')
+        with open(file, 'wb') as fh:
+            fh.truncate(size_gib * GIB)
+        click.echo(f"{size_gib} GiB sparse file, part size {part_size}, {os.cpu_count()} CPU(s)")
+        checksum = None
+        for parallel in map(int, workers.split(',')):
+            start = time.time()
+            local_hash = get_local_hash(file, part_size, parallel)
+            elapsed = time.time() - start
+            assert checksum is None or checksum == local_hash
+            checksum = local_hash
+            click.echo(f"  workers {parallel:3d}: {size_gib / elapsed:6.2f} GiB/s ({elapsed:.2f}s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+""" Benchmark: per-call requests.put vs. pooled keep-alive session for part PUTs.
+
+    python -m benchmarks.bench_connections [--parts 10240] [--parallel 8]
+"""
+
+import time, click, requests, urllib3
+from concurrent.futures import ThreadPoolExecutor
+
+from oarepo_s3_cli.utils import get_session, size_fmt
+from oarepo_s3_cli.standin import StandinServer
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+
+def run(server, put, parts, parallel, data):
+    init = requests.post(f'{server.base_url}/draft/records/1/files/?multipart=true',
+                         json={'key': 'bench.dat', 'size': parts * len(data)}, verify=False).json()
+    server.reset_stats()
+    start = time.time()
+    with ThreadPoolExecutor(parallel) as executor:
+        urls = [f"{server.base_url}/s3/{init['uploadId']}/{pn}" for pn in range(1, parts + 1)]
+        for resp in executor.map(lambda url: put(url, data=data, timeout=3600, verify=False), urls):
+            assert resp.status_code == 200
+    return time.time() - start, dict(server.stats)
+
+
+@click.command()
+@click.option('--parts', default=10240, show_default=True)
+@click.option('--parallel', default=8, show_default=True)
+@click.option('--part-bytes', default=1024, show_default=True, help='payload of each part PUT')
+@click.option('--tls/--no-tls', default=True, show_default=True)
+def main(parts, parallel, part_bytes, tls):
+    server = StandinServer(tls=tls).start()
+    data = b'x' * part_bytes
+    try:
+        click.echo(f"{parts} part PUTs of {size_fmt(part_bytes)}, {parallel} streams, {server.base_url}")
+        for name, put in (('requests.put', requests.put), ('pooled session', get_session(parallel).put)):
+            elapsed, stats = run(server, put, parts, parallel, data)
+            click.echo(f"  {name:16s} wall {elapsed:8.2f}s  handshakes {stats['connections']:6d}  "
+                       f"parts/s {parts / elapsed:8.0f}")
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
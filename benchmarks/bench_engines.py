@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+""" Benchmark: startup time and per-part overhead of process/thread/async upload engines.
+
+    python -m benchmarks.bench_engines [--parts 2000] [--parallel 8]
+
+Parts do no I/O - the worker only pops its presigned URL from the presign cache,
+so the numbers are the engine's own cost (pool start, pickling, presign cache access).
+"""
+
+import time, click, urllib3
+
+from oarepo_s3_cli.constants import *
+from oarepo_s3_cli.lib import OARepoS3Client
+from oarepo_s3_cli.parallels import Parallels
+from oarepo_s3_cli.utils import SharedList
+from oarepo_s3_cli.standin import StandinServer
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+
+class NoopClient(OARepoS3Client):
+    def upload_part(self, partNum, val):
+        part_s3_url = self.presigns.pop(partNum)
+        return dict(PartNumber=partNum, status=STATUS_OK, ETag=part_s3_url)
+
+
+def run(url, engine, parts, parallel):
+    client = NoopClient(url, 'token', parallel, quiet=True, key='bench.dat', engine=engine)
+    client.data_size, client.num_parts = parts * MIN_PART_SIZE, parts
+    client.init_upload()
+    parts_unfin = list(range(1, parts + 1))
+
+    start = time.time()
+    client.presigns = SharedList(client.presign_parts_upload, parts_unfin, BATCH_PRESIGNS, parts,
+                                 shared=engine == 'process')
+    parallels = Parallels(client.upload_part, client.presings_supply, parts, parts_unfin,
+                          parallel=parallel, quiet=True, engine=engine)
+    pool = parallels.make_pool()
+    startup = time.time() - start
+
+    client.presigns.prepare(parts)
+    done = []
+    start = time.time()
+    for pn in parts_unfin:
+        pool.apply_async(parallels.worker_wrapper, args=(pn, f"val-{pn}"), callback=done.append)
+    pool.close()
+    pool.join()
+    per_part = (time.time() - start) / parts
+    assert len(done) == parts
+    return startup, per_part
+
+
+@click.command()
+@click.option('--parts', default=2000, show_default=True)
+@click.option('--parallel', default=8, show_default=True)
+def main(parts, parallel):
+    server = StandinServer(tls=False).start()
+    try:
+        click.echo(f"{parts} no-op parts, {parallel} streams")
+        click.echo(f"  {'engine':8s} {'startup':>10s} {'per part':>10s}")
+        for engine in ENGINES:
+            startup, per_part = run(server.base_url, engine, parts, parallel)
+            click.echo(f"  {engine:8s} {startup * 1000:8.1f}ms {per_part * 1e6:8.0f}us")
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+""" Benchmark: peak RSS of one part PUT, whole part read into memory vs. streamed FileSlice.
+
+    python -m benchmarks.bench_memory [--sizes 5,25,100,250]
+"""
+
+import os, resource, tempfile, click, requests, urllib3
+import multiprocessing as mp
+
+from oarepo_s3_cli.utils import FileSlice, get_session, size_fmt
+from oarepo_s3_cli.standin import StandinServer
+
+MIB = 1024 * 1024
+
+
+def put_part(mode, file, size, url):
+    """ runs in a fresh process, returns its peak RSS in bytes """
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    session = get_session()
+    if mode == 'buffered':
+        with open(file, 'rb') as fh:
+            resp = session.put(url, data=fh.read(size), verify=False)
+    else:
+        with FileSlice(file, 0, size) as body:
+            resp = session.put(url, data=body, verify=False)
+    assert resp.status_code == 200
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@click.command()
+@click.option('--sizes', default='5,25,100,250', show_default=True, help='part sizes in MiB')
+@click.option('--tls/--no-tls', default=False, show_default=True)
+def main(sizes, tls):
+    sizes = [int(s) * MIB for s in sizes.split(',')]
+    server = StandinServer(tls=tls).start()
+    ctx = mp.get_context('spawn')
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            file = os.path.join(tmpdir, 'sparse.dat')
+            with open(file, 'wb') as fh:
+                fh.truncate(max(sizes))
+            init = requests.post(f'{server.base_url}/draft/records/1/files/?multipart=true',
+                                 json={'key': 'bench.dat', 'size': max(sizes)}, verify=False).json()
+            url = f"{server.base_url}/s3/{init['uploadId']}/1"
+            click.echo(f"peak RSS of a part upload process ({server.base_url})")
+            click.echo(f"  {'part size':>10s} {'buffered':>10s} {'streamed':>10s}")
+            for size in sizes:
+                rss = {}
+                for mode in ('buffered', 'streamed'):
+                    with ctx.Pool(1) as pool:
+                        rss[mode] = pool.apply(put_part, (mode, file, size, url))
+                click.echo(f"  {size_fmt(size):>10s} {size_fmt(rss['buffered']):>10s} "
+                           f"{size_fmt(rss['streamed']):>10s}")
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+""" Benchmark (simulation): achieved part rate vs. offered part rate, presign cache polled
+once per PRESIGN_REQ_SLEEP with SLOWDOWN_SLEEP on miss vs. PresignPrefetcher.
+
+    python -m benchmarks.bench_presign [--rates 50,200,800,2000] [--parallel 8]
+
+Nothing is sent - presign requests take --latency ms (+0.1 ms per URL) and a part upload
+takes parallel/rate seconds, so the offered part rate is the upper bound.
+"""
+
+import threading, time, click
+from multiprocessing.pool import ThreadPool
+
+from oarepo_s3_cli.constants import *
+from oarepo_s3_cli.utils import PresignPrefetcher, SharedList
+
+
+def run(mode, parts, rate, parallel, latency):
+    def presign(pnums):
+        time.sleep(latency + 0.0001 * len(pnums))
+        return {pn: f"https://s3.example.org/{pn}?X-Amz-Expires=3600" for pn in pnums}
+
+    unfin = list(range(1, parts + 1))
+    part_secs = parallel / rate
+    stop = threading.Event()
+    if mode == 'polling':
+        presigns = SharedList(presign, unfin, BATCH_PRESIGNS, MAX_PRESIGNS, shared=False)
+
+        def upload_part(pn):
+            if not presigns.has_key(pn):
+                time.sleep(SLOWDOWN_SLEEP)
+            url = presigns.pop(pn)
+            if url is None:
+                url = presign([pn])[pn]
+            time.sleep(part_secs)
+
+        def idle():
+            while not stop.is_set():
+                presigns.supply(MAX_PRESIGNS, MAX_PRESIGNS)
+                stop.wait(PRESIGN_REQ_SLEEP)
+    else:
+        presigns = PresignPrefetcher(presign, unfin, BATCH_PRESIGNS, MAX_PRESIGNS)
+
+        def upload_part(pn):
+            url = presigns.pop(pn)
+            if url is None:
+                url = presign([pn])[pn]
+            time.sleep(part_secs)
+
+        def idle():
+            presigns.supply()
+
+    start = time.time()
+    presigns.supply(MAX_PRESIGNS, MAX_PRESIGNS)
+    idler = threading.Thread(target=idle, daemon=True)
+    idler.start()
+    with ThreadPool(parallel) as pool:
+        pool.map(upload_part, unfin, chunksize=1)
+    elapsed = time.time() - start
+    stop.set()
+    presigns.close()
+    return parts / elapsed
+
+
+@click.command()
+@click.option('--rates', default='50,200,800,2000', show_default=True, help='offered part rates [parts/s]')
+@click.option('--seconds', default=3, show_default=True, help='simulated upload length at offered rate')
+@click.option('--parallel', default=8, show_default=True)
+@click.option('--latency', default=30, show_default=True, help='presign request latency [ms]')
+def main(rates, seconds, parallel, latency):
+    click.echo(f"{parallel} streams, presign latency {latency}ms")
+    click.echo(f"  {'offered':>10s} {'polling':>10s} {'prefetch':>10s}  [parts/s]")
+    for rate in map(int, rates.split(',')):
+        parts = max(rate * seconds, BATCH_PRESIGNS)
+        achieved = {mode: run(mode, parts, rate, parallel, latency / 1000) for mode in ('polling', 'prefetch')}
+        click.echo(f"  {rate:10d} {achieved['polling']:10.0f} {achieved['prefetch']:10.0f}")
+
+
+if __name__ == '__main__':
+    main()
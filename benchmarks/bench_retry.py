@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+""" Benchmark: upload completion time against throttled stand-in server (503 SlowDown above
+--throttle part PUTs per second), previous linear retries vs. RetryPolicy.
+
+    python -m benchmarks.bench_retry [--size-mib 400] [--parallel 16] [--throttle 8] [--runs 5]
+
+Median of --runs uploads is shown (jittered backoff varies from run to run).
+"""
+
+import os, statistics, tempfile, time, click, urllib3
+
+from oarepo_s3_cli.constants import *
+from oarepo_s3_cli.lib import OARepoS3Client
+from oarepo_s3_cli.retry import *
+from oarepo_s3_cli.standin import StandinServer
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+MIB = 1024 * 1024
+
+
+class LinearRetryPolicy(RetryPolicy):
+    """ retries before RetryPolicy: every failure retried after RETRY_SLEEP * attempt, no budget """
+    def classify(self, resp=None, exc=None, idempotent=True, presigned=False):
+        return RETRY_OK if exc is None and resp.status_code < 400 else RETRY
+
+    def allow(self, attempt, action=RETRY):
+        return attempt < MAX_RETRIES
+
+    def delay(self, attempt, resp=None):
+        return RETRY_SLEEP * (attempt + 1)
+
+
+def run(server, policy, file, parallel):
+    client = OARepoS3Client(server.base_url, 'token', parallel, quiet=True, part_size=MIN_PART_SIZE)
+    client.retry = policy
+    server.reset_stats()
+    start = time.time()
+    try:
+        client.process_click_upload(None, file)
+        result = 'ok'
+    except Exception as e:
+        result = 'failed'
+    return result, time.time() - start, dict(server.stats)
+
+
+@click.command()
+@click.option('--size-mib', default=400, show_default=True)
+@click.option('--parallel', default=16, show_default=True)
+@click.option('--throttle', default=8, show_default=True, help='part PUTs per second accepted by server')
+@click.option('--runs', default=5, show_default=True)
+def main(size_mib, parallel, throttle, runs):
+    server = StandinServer(tls=False, throttle=throttle).start()
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            file = os.path.join(tmpdir, 'sparse.dat')
+            with open(file, 'wb') as fh:
+                fh.truncate(size_mib * MIB)
+            parts = -(-size_mib * MIB // MIN_PART_SIZE)
+            click.echo(f"{parts} parts, {parallel} streams, server accepts {throttle} part PUTs/s")
+            click.echo(f"  {'retries':8s} {'failed':>7s} {'median':>8s} {'max':>8s} {'503s':>6s}")
+            for name, policy_cls in (('linear', LinearRetryPolicy), ('policy', RetryPolicy)):
+                res = [run(server, policy_cls(), file, parallel) for i in range(runs)]
+                failed = sum(1 for result, elapsed, stats in res if result != 'ok')
+                times = [elapsed for result, elapsed, stats in res]
+                throttled = statistics.median(stats['throttled'] for result, elapsed, stats in res)
+                click.echo(f"  {name:8s} {failed:7d} {statistics.median(times):7.1f}s {max(times):7.1f}s "
+                           f"{throttled:6.0f}")
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
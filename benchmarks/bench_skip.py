@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+""" Benchmark: re-run of upload over unchanged file tree - all files uploaded again vs. files
+    skipped by files listing and hash cache (upload --skip-unchanged).
+
+    python -m benchmarks.bench_skip [--files 50000] [--file-bytes 4096] [--parallel 8]
+"""
+
+import os, tempfile, time, click, urllib3
+
+from oarepo_s3_cli.batch import BatchUpload
+from oarepo_s3_cli.hashcache import HashCache, skip_unchanged
+from oarepo_s3_cli.lib import OARepoS3Client
+from oarepo_s3_cli.standin import StandinServer
+from oarepo_s3_cli.utils import iter_upload_sources, size_fmt
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+TOKEN = 'bench'
+
+
+def run(server, top, parallel, cache, skip=False):
+    server.reset_stats()
+    start = time.time()
+    sources = iter_upload_sources([top])
+    if skip:
+        remote = OARepoS3Client(server.base_url, TOKEN, 1, quiet=True).get_remote_files()
+        sources = skip_unchanged(sources, remote, cache, quiet=True)
+    batch = BatchUpload(server.base_url, TOKEN, parallel, quiet=True, hash_cache=cache)
+    results = batch.main(sources)
+    return time.time() - start, len(results), dict(server.stats)
+
+
+@click.command()
+@click.option('--files', default=50000, show_default=True)
+@click.option('--file-bytes', default=4096, show_default=True)
+@click.option('--parallel', default=8, show_default=True)
+@click.option('--latency', default=0.0, show_default=True, help='stand-in server ms per request')
+@click.option('--tls/--no-tls', default=True, show_default=True)
+def main(files, file_bytes, parallel, latency, tls):
+    with tempfile.TemporaryDirectory(prefix='oarepo-s3-bench-') as tmp:
+        top = os.path.join(tmp, 'tree')
+        for i in range(files):
+            dir = os.path.join(top, f'{i // 1000:03d}')
+            if i % 1000 == 0: os.makedirs(dir)
+            with open(os.path.join(dir, f'{i}.dat'), 'wb') as fh:
+                fh.write(os.urandom(file_bytes))
+        cache = HashCache(os.path.join(tmp, 'state'))
+        server = StandinServer(tls=tls, latency=latency / 1000, store=False).start()
+        click.echo(f"{files} files of {size_fmt(file_bytes)}, {parallel} streams, {server.base_url}")
+        try:
+            for name, skip in (('first upload', False), ('re-run', False), ('re-run, skip', True)):
+                elapsed, uploaded, stats = run(server, top, parallel, cache, skip)
+                click.echo(f"  {name:14s} wall {elapsed:8.2f}s  files uploaded {uploaded:6d}  "
+                           f"requests {stats['requests']:7d}")
+        finally:
+            server.stop()
+            cache.close()
+
+
+if __name__ == '__main__':
+    main()
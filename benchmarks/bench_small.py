@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+""" Benchmark: batch upload of many small files - direct PUT to files API, multipart upload of
+    one part without worker pool, and full multipart machinery (init, presign, part, complete).
+
+    python -m benchmarks.bench_small [--files 10000] [--file-bytes 65536] [--parallel 8]
+"""
+
+import os, tempfile, time, click, urllib3
+
+from oarepo_s3_cli.batch import BatchUpload
+from oarepo_s3_cli.constants import *
+from oarepo_s3_cli.standin import StandinServer
+from oarepo_s3_cli.utils import size_fmt
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+TOKEN = 'bench'
+
+
+class MultipartBatchUpload(BatchUpload):
+    """ small files as large ones - no fast path """
+    def new_client(self, file, key, content_type=None):
+        client = super().new_client(file, key, content_type)
+        client.small_size = -1
+        return client
+
+
+def run(server, batch_class, files, parallel):
+    batch = batch_class(server.base_url, TOKEN, parallel, quiet=True, part_size=MIN_PART_SIZE)
+    server.reset_stats()
+    start = time.time()
+    results = batch.main((file, f'{os.path.basename(file)}.{batch_class.__name__}') for file in files)
+    elapsed = time.time() - start
+    failed = sum(1 for res in results if res['status'] != STATUS_OK)
+    return elapsed, failed, dict(server.stats)
+
+
+@click.command()
+@click.option('--files', default=10000, show_default=True)
+@click.option('--file-bytes', default=64 * 1024, show_default=True)
+@click.option('--parallel', default=8, show_default=True)
+@click.option('--tls/--no-tls', default=True, show_default=True)
+def main(files, file_bytes, parallel, tls):
+    with tempfile.TemporaryDirectory(prefix='oarepo-s3-bench-') as tmp:
+        paths = []
+        for i in range(files):
+            paths.append(os.path.join(tmp, f'small-{i}.dat'))
+            with open(paths[-1], 'wb') as fh:
+                fh.write(os.urandom(file_bytes))
+        click.echo(f"{files} files of {size_fmt(file_bytes)}, {parallel} streams")
+        for name, direct, batch_class in (('direct PUT', True, BatchUpload),
+                                          ('one part multipart', False, BatchUpload),
+                                          ('full multipart', False, MultipartBatchUpload)):
+            server = StandinServer(tls=tls, store=False, direct=direct).start()
+            try:
+                elapsed, failed, stats = run(server, batch_class, paths, parallel)
+            finally:
+                server.stop()
+            click.echo(f"  {name:20s} wall {elapsed:8.2f}s  files/s {files / elapsed:8.0f}  "
+                       f"requests/file {stats['requests'] / files:5.2f}  failed {failed}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+""" Benchmark suite: upload, resume and check against local stand-in server.
+
+    python -m benchmarks.suite run [--sizes 1M,256M] [--kinds sparse,random] [--parallel 1,4,16]
+                                   [--part-sizes auto,16M] [--ops upload,resume,check] [-o results.json]
+                                   [--baseline previous.json --threshold 10]
+    python -m benchmarks.suite compare previous.json results.json [--threshold 10]
+
+Every operation is one oarepo-s3-cli process; its wall time, CPU time (user + sys, workers
+included), peak RSS and peak process count are measured, requests per part come from the
+stand-in server. Resume continues an upload of which the first half of parts was uploaded.
+Results are written as JSON; with --baseline (or compare) exit code is 1 when throughput
+dropped or CPU time / peak RSS grew more than --threshold percent on any scenario.
+"""
+
+import datetime, json, os, platform, subprocess, sys, tempfile, threading, time, click, urllib3
+
+from oarepo_s3_cli.bandwidth import parse_rate
+from oarepo_s3_cli.lib import OARepoS3Client
+from oarepo_s3_cli.standin import StandinServer
+from oarepo_s3_cli.utils import FileSlice, get_session, size_fmt
+from oarepo_s3_cli.version import __version__
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+TOKEN = 'bench'
+WRITE_CHUNK = 16 * 1024 * 1024
+POLL_INTERVAL = 0.05
+# metric: True if higher is better
+COMPARED = {'throughput': True, 'cpu_secs': False, 'peak_rss': False}
+
+
+def make_file(dir, kind, size):
+    """ synthetic file, sparse (hole, no disk space) or random data """
+    file = os.path.join(dir, f'{kind}-{size}.dat')
+    if os.path.exists(file) and os.path.getsize(file) == size: return file
+    with open(file, 'wb') as fh:
+        if kind == 'sparse':
+            fh.truncate(size)
+        else:
+            for offset in range(0, size, WRITE_CHUNK):
+                fh.write(os.urandom(min(WRITE_CHUNK, size - offset)))
+    return file
+
+
+def process_tree(pid):
+    """ pids of process and its descendants (Linux /proc), None elsewhere """
+    if not os.path.isdir('/proc'): return None
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit(): continue
+        try:
+            with open(f'/proc/{entry}/stat') as fh:
+                ppid = int(fh.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, todo = set(), [pid]
+    while todo:
+        p = todo.pop()
+        tree.add(p)
+        todo.extend(children.get(p, []))
+    return tree
+
+
+def run_cli(args, state_dir):
+    """ oarepo-s3-cli in own process: (exit code, wall secs, cpu secs, peak RSS, peak process count) """
+    cmd = [sys.executable, '-m', 'oarepo_s3_cli.clickdef', '-q', '-n', '--state-dir', state_dir] + args
+    start = time.time()
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+    peak, done = [1], threading.Event()
+
+    def poll():
+        while not done.wait(POLL_INTERVAL):
+            tree = process_tree(proc.pid)
+            if tree is None: return
+            peak[0] = max(peak[0], len(tree))
+
+    poller = threading.Thread(target=poll, daemon=True)
+    poller.start()
+    # rusage of the process with its waited-for children (pool workers):
+    pid, status, rusage = os.wait4(proc.pid, 0)
+    elapsed = time.time() - start
+    done.set()
+    poller.join()
+    # os.waitstatus_to_exitcode is 3.9+:
+    proc.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    return proc.returncode, elapsed, rusage.ru_utime + rusage.ru_stime, rusage.ru_maxrss * 1024, peak[0]
+
+
+def upload_half(server, file, key, parallel, part_size):
+    """ multipart upload of first half of parts (as interrupted upload), its uploadId """
+    client = OARepoS3Client(server.base_url, TOKEN, parallel, quiet=True, part_size=part_size)
+    client.set_file(file, key, showInfo=False)
+    uploadId = client.init_upload()
+    pnums = list(range(1, client.num_parts // 2 + 1))
+    if pnums:
+        session = get_session()
+        urls = client.presign_parts_upload(pnums)
+        for pn in pnums:
+            offset, size = client.get_part_range(pn)
+            with FileSlice(file, offset, size) as body:
+                resp = session.put(urls[pn], data=body, verify=False)
+            assert resp.status_code == 200, f"part {pn} upload failed ({resp.status_code})"
+    done = sum(client.get_part_range(pn)[1] for pn in pnums)
+    return uploadId, client.data_size - done
+
+
+def scenario_id(res):
+    part_size = res['part_size'] if res['part_size'] == 'auto' else size_fmt(res['part_size'], sep='')
+    return f"{res['op']} {res['kind']} {size_fmt(res['size'], sep='')} -p {res['parallel']} " \
+           f"-s {part_size} {res['engine']}"
+
+
+def run_scenario(server, state_dir, op, file, key, kind, size, parallel, part_size, engine):
+    nbytes = size
+    args = ['-e', server.base_url, '-t', TOKEN]
+    if op == 'upload':
+        args += ['upload', '-f', file, '-k', key, '-p', str(parallel), '-s', str(part_size),
+                 '--engine', engine, '-c']
+    elif op == 'resume':
+        uploadId, nbytes = upload_half(server, file, key, parallel, part_size)
+        args += ['resume', '-f', file, '-k', key, '-u', uploadId, '-p', str(parallel), '-s', str(part_size),
+                 '--engine', engine, '-c']
+    else:
+        args += ['check', '-f', file, '-k', key, '-p', str(parallel)]
+    server.reset_stats()
+    code, elapsed, cpu, rss, processes = run_cli(args, state_dir)
+    stats = dict(server.stats)
+    # small files uploaded by one direct PUT:
+    parts = stats['parts'] + stats['direct'] if op != 'check' else stats['gets']
+    return dict(op=op, kind=kind, size=size, parallel=parallel, part_size=part_size, engine=engine,
+                status=code, seconds=round(elapsed, 3), bytes=nbytes,
+                throughput=round(nbytes / max(elapsed, 1e-6)), cpu_secs=round(cpu, 3), peak_rss=rss,
+                processes=processes, requests=stats['requests'], parts=parts,
+                requests_per_part=round(stats['requests'] / parts, 2) if parts else None,
+                retried=stats['throttled'] + stats['errors'])
+
+
+def compare(baseline, results, threshold):
+    """ regressions of results against baseline, scenarios matched by op, kind, size, parallel,
+        part size and engine: [(scenario, metric, baseline value, value, change %)] """
+    base = {scenario_id(res): res for res in baseline['results'] if res['status'] == 0}
+    regressions = []
+    for res in results['results']:
+        prev = base.get(scenario_id(res))
+        if prev is None: continue
+        if res['status'] != 0:
+            regressions.append((scenario_id(res), 'status', prev['status'], res['status'], None))
+            continue
+        for metric, higher_better in COMPARED.items():
+            if not prev.get(metric) or res.get(metric) is None: continue
+            change = (res[metric] - prev[metric]) / prev[metric] * 100
+            if (-change if higher_better else change) > threshold:
+                regressions.append((scenario_id(res), metric, prev[metric], res[metric], round(change, 1)))
+    return regressions
+
+
+def report_regressions(regressions, threshold):
+    if not regressions:
+        click.echo(f"no regression above {threshold}%")
+        return
+    click.echo(f"{len(regressions)} regression(s) above {threshold}%:")
+    for scenario, metric, prev, value, change in regressions:
+        click.echo(f"  {scenario}: {metric} {prev} -> {value}" + (f" ({change:+.1f}%)" if change is not None else ''))
+    sys.exit(1)
+
+
+def _sizes_cb(ctx, param, value):
+    try:
+        sizes = [parse_rate(v) for v in value.split(',')]
+    except Exception as e:
+        raise click.BadParameter(f"{value} (<bytes>[K|M|G|T],...)")
+    if None in sizes:
+        raise click.BadParameter(f"{value} (sizes must be positive)")
+    return sizes
+
+
+def _list_cb(ctx, param, value):
+    return [v.strip() for v in value.split(',') if v.strip()]
+
+
+@click.group()
+def main():
+    pass
+
+
+@main.command('run')
+@click.option('--sizes', default='1M,64M', show_default=True, callback=_sizes_cb,
+              help='file sizes, K/M/G/T suffix (1024-based)')
+@click.option('--kinds', default='sparse,random', show_default=True, callback=_list_cb, help='sparse and/or random')
+@click.option('--ops', default='upload,resume,check', show_default=True, callback=_list_cb)
+@click.option('--parallel', default='1,4', show_default=True, callback=_list_cb, help='--parallel values')
+@click.option('--part-sizes', default='auto', show_default=True, callback=_list_cb,
+              help='--part-size values (auto or K/M/G suffix)')
+@click.option('--engines', default='thread', show_default=True, callback=_list_cb)
+@click.option('--workdir', default=None, type=click.Path(file_okay=False),
+              help='directory of generated files (kept between runs) [default: temporary]')
+@click.option('--tls/--no-tls', default=True, show_default=True)
+@click.option('--latency', default=0.0, show_default=True, help='stand-in server ms per request')
+@click.option('--bandwidth', default=None, help='stand-in server bytes/s (K/M/G suffix) [default: unlimited]')
+@click.option('-o', '--output', default=None, type=click.Path(dir_okay=False), help='results JSON file')
+@click.option('--baseline', default=None, type=click.Path(exists=True, dir_okay=False),
+              help='previous results JSON, exit code 1 on regression')
+@click.option('--threshold', default=10.0, show_default=True, help='regression threshold [%]')
+def cli_run(sizes, kinds, ops, parallel, part_sizes, engines, workdir, tls, latency, bandwidth, output,
+            baseline, threshold):
+    for kind in kinds:
+        if kind not in ('sparse', 'random'): raise click.BadParameter(kind, param_hint="'--kinds'")
+    for op in ops:
+        if op not in ('upload', 'resume', 'check'): raise click.BadParameter(op, param_hint="'--ops'")
+    part_sizes = [ps if ps == 'auto' else parse_rate(ps) for ps in part_sizes]
+    tmp = tempfile.TemporaryDirectory(prefix='oarepo-s3-bench-')
+    workdir = workdir or tmp.name
+    os.makedirs(workdir, exist_ok=True)
+    # check downloads the uploaded object - data kept by server only then:
+    server = StandinServer(tls=tls, latency=latency / 1000, bandwidth=parse_rate(bandwidth),
+                           store='check' in ops).start()
+    results = dict(version=__version__, python=platform.python_version(), platform=platform.platform(),
+                   cpus=os.cpu_count(), time=datetime.datetime.now().isoformat(timespec='seconds'),
+                   server=dict(tls=tls, latency=latency, bandwidth=bandwidth), results=[])
+    click.echo(f"  {'scenario':48s} {'status':>6s} {'MiB/s':>8s} {'cpu':>7s} {'rss':>8s} {'procs':>5s} {'req/part':>8s}")
+    try:
+        for kind in kinds:
+            for size in sizes:
+                file = make_file(workdir, kind, size)
+                for engine in engines:
+                    for p in parallel:
+                        for part_size in part_sizes:
+                            key = f'{kind}-{size}-{engine}-{p}-{part_size}.dat'
+                            for op in ops:
+                                res = run_scenario(server, os.path.join(workdir, 'state'), op, file, key, kind,
+                                                   size, int(p), part_size, engine)
+                                results['results'].append(res)
+                                click.echo(f"  {scenario_id(res):48s} {res['status']:6d} "
+                                           f"{res['throughput'] / 1024 / 1024:8.1f} {res['cpu_secs']:6.2f}s "
+                                           f"{size_fmt(res['peak_rss'], sep=''):>8s} {res['processes']:5d} "
+                                           f"{res['requests_per_part'] or 0:8.2f}")
+                            server.objects.pop(key, None)
+                if workdir == tmp.name: os.unlink(file)
+    finally:
+        server.stop()
+        tmp.cleanup()
+    if output is not None:
+        with open(output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+        click.echo(f"results written to {output}")
+    if baseline is not None:
+        with open(baseline) as fh:
+            report_regressions(compare(json.load(fh), results, threshold), threshold)
+
+
+@main.command('compare')
+@click.argument('baseline', type=click.Path(exists=True, dir_okay=False))
+@click.argument('results', type=click.Path(exists=True, dir_okay=False))
+@click.option('--threshold', default=10.0, show_default=True, help='regression threshold [%]')
+def cli_compare(baseline, results, threshold):
+    with open(baseline) as fh, open(results) as fr:
+        report_regressions(compare(json.load(fh), json.load(fr), threshold), threshold)
+
+
+if __name__ == '__main__':
+    main()
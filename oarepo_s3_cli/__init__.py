@@ -8,5 +8,6 @@
 """ OARepo S3 client init. """
 
 from .version import __version__
+from .api import Client, OARepoS3Error, UploadResult, CheckResult, DownloadResult
 
-__all__ = ('__version__')
+__all__ = ('__version__', 'Client', 'OARepoS3Error', 'UploadResult', 'CheckResult', 'DownloadResult')
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+""" OARepo S3 client library API - result objects, exceptions and progress callbacks, no terminal output. """
+
+import asyncio, functools, threading
+from concurrent.futures import ThreadPoolExecutor
+
+from oarepo_s3_cli.batch import BatchUpload
+from oarepo_s3_cli.constants import *
+from oarepo_s3_cli.lib import OARepoS3Client
+from oarepo_s3_cli.progress import ProgressCallback
+from oarepo_s3_cli.utils import get_session
+
+
+class OARepoS3Error(Exception):
+    """ failed operation: message, status (STATUS_* code, exit code of CLI), key, uploadId and part size
+        of upload left on server (resume or abort) """
+    def __init__(self, message, status=STATUS_UNKNOWN, key=None, uploadId=None, part_size=None):
+        super().__init__(message, status)
+        self.message = message
+        self.status = status
+        self.key = key
+        self.uploadId = uploadId
+        self.part_size = part_size
+
+    def __str__(self):
+        return str(self.message)
+
+
+def error_status(e):
+    """ (message, status) of exception raised by client - Exception(message, STATUS_*) or other """
+    if isinstance(e, OARepoS3Error):
+        return e.message, e.status
+    if len(e.args) == 2 and isinstance(e.args[1], int) and not isinstance(e.args[0], int):
+        return e.args
+    return str(e) or type(e).__name__, STATUS_UNKNOWN
+
+
+def plan_part_size(client):
+    """ part size of upload by client (resume must use it), None if not planned """
+    return client.plan['part_size'] if client is not None and client.plan else None
+
+
+def as_error(e, client=None):
+    if isinstance(e, OARepoS3Error): return e
+    msg, code = error_status(e)
+    key = client.key if client is not None else None
+    uploadId = client.get_uploadId() if client is not None else None
+    return OARepoS3Error(msg, code, key, uploadId, plan_part_size(client))
+
+
+class UploadResult(object):
+    """ uploaded (or, from upload_many, failed) file: object key and location, size, storage checksum
+        if known, status and message of failure, uploadId and part size of failed upload for resume """
+    def __init__(self, file, key, location=None, size=None, checksum=None, status=STATUS_OK, message=None,
+                 uploadId=None, part_size=None):
+        self.file = file
+        self.key = key
+        self.location = location
+        self.size = size
+        self.checksum = checksum
+        self.status = status
+        self.message = message
+        self.uploadId = uploadId
+        self.part_size = part_size
+
+    @property
+    def ok(self):
+        return self.status == STATUS_OK
+
+    def __repr__(self):
+        return f"UploadResult(key={self.key!r}, status={self.status}, location={self.location!r})"
+
+
+class CheckResult(object):
+    """ local file compared with uploaded object, match: same checksum """
+    def __init__(self, file, key, match):
+        self.file = file
+        self.key = key
+        self.match = match
+
+    def __bool__(self):
+        return self.match
+
+    def __repr__(self):
+        return f"CheckResult(key={self.key!r}, match={self.match})"
+
+
+class DownloadResult(object):
+    """ object downloaded to local file """
+    def __init__(self, key, file, size):
+        self.key = key
+        self.file = file
+        self.size = size
+
+    def __repr__(self):
+        return f"DownloadResult(key={self.key!r}, file={self.file!r}, size={self.size})"
+
+
+class Client(object):
+    """ OARepo S3 client for embedding: no terminal output, no signal handlers, no sys.exit - methods
+        return result objects and raise OARepoS3Error; progress events (dicts of --progress json) passed
+        to callable progress (or written by ProgressStream). Token checked on first request (or never,
+        with urlFiles of record). One HTTP session shared by all calls (injected or own), *_async methods
+        run in executor (injected or own, max_uploads threads) - many uploads of one event loop run
+        concurrently, each with up to parallel part streams. Auto part size of uploads uses throughput
+        measured on previous one. quiet=False, signals=True: messages, progress bar and interrupt handling
+        of CLI (main thread only). """
+    def __init__(self, endpoint, token, parallel=4, part_size='auto', nocheck=True, session=None, executor=None,
+                 max_uploads=8, state_dir=None, hash_cache=None, bandwidth=None, progress=None, metrics=None,
+                 profile=None, min_parallel=ADAPTIVE_MIN_PARALLEL, max_parallel=ADAPTIVE_MAX_PARALLEL,
+                 engine=DEFAULT_ENGINE, read_ahead=0, urlFiles=None, quiet=True, signals=False):
+        self.endpoint = endpoint
+        self.token = token
+        self.parallel = parallel
+        self.part_size = part_size
+        self.nocheck = nocheck
+        self.engine = engine
+        self.read_ahead = read_ahead
+        self.throughput = None
+        self.quiet = quiet
+        self.signals = signals
+        streams = max_parallel if parallel == 'auto' else parallel or MAX_PARALLEL
+        self.session = session if session is not None else get_session(streams * max_uploads + BATCH_CONTROL_THREADS)
+        self._executor = executor
+        self.own_executor = executor is None
+        self.max_uploads = max_uploads
+        self.state_dir = state_dir
+        self.hash_cache = hash_cache
+        self.bandwidth = bandwidth
+        self.own_progress = callable(progress)
+        self.progress = ProgressCallback(progress) if callable(progress) else progress
+        self.metrics = metrics
+        self.profile = profile
+        self.bounds = (min_parallel, max_parallel)
+        self._urlFiles = urlFiles
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.own_executor and self._executor is not None: self._executor.shutdown(wait=True)
+        if self.own_progress: self.progress.close()
+
+    @property
+    def executor(self):
+        """ executor of *_async methods, own one started on first use """
+        with self.lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_uploads)
+            return self._executor
+
+    @property
+    def urlFiles(self):
+        """ files API of record, from token status (checked once) """
+        with self.lock:
+            if self._urlFiles is None:
+                try:
+                    self._urlFiles = OARepoS3Client(self.endpoint, self.token, 1, quiet=True,
+                                                    session=self.session).urlFiles
+                except Exception as e:
+                    raise as_error(e) from e
+            return self._urlFiles
+
+    def client(self, part_size=None, **kwargs):
+        # worker processes (process engine) keep own sessions:
+        session = self.session if self.engine != 'process' else None
+        return OARepoS3Client(self.endpoint, self.token, self.parallel, self.quiet, engine=self.engine,
+                              part_size=part_size or self.part_size, throughput=self.throughput,
+                              urlFiles=self.urlFiles, state_dir=self.state_dir, read_ahead=self.read_ahead,
+                              min_parallel=self.bounds[0], max_parallel=self.bounds[1], bandwidth=self.bandwidth,
+                              progress=self.progress, metrics=self.metrics, profile=self.profile,
+                              hash_cache=self.hash_cache, session=session, signals=self.signals, **kwargs)
+
+    def call(self, client, method, *args):
+        try:
+            return getattr(client, method)(*args)
+        except Exception as e:
+            raise as_error(e, client) from e
+
+    def upload_result(self, client, file, location):
+        if client.throughput is not None: self.throughput = client.throughput
+        return UploadResult(file, client.key, location, client.data_size, client.checksum)
+
+    def upload(self, file, key=None, content_type=None, nocheck=None):
+        """ file (path or TarBundle) uploaded as key [default: basename of file] """
+        client = self.client()
+        if content_type is not None: client.contentType = content_type
+        nocheck = self.nocheck if nocheck is None else nocheck
+        location, code = self.call(client, 'process_click_upload', key, file, nocheck)
+        return self.upload_result(client, file, location)
+
+    def upload_stream(self, stream, key, nocheck=None, name='-'):
+        """ binary file object of unknown size (pipe) uploaded as key """
+        client = self.client()
+        nocheck = self.nocheck if nocheck is None else nocheck
+        location, code = self.call(client, 'process_click_stream', key, stream, nocheck, name)
+        return self.upload_result(client, name, location)
+
+    def resume(self, file, key=None, uploadId=None, part_size=None, nocheck=None):
+        """ interrupted upload of file continued (uploadId from OARepoS3Error or upload journal) """
+        client = self.client(part_size=part_size)
+        nocheck = self.nocheck if nocheck is None else nocheck
+        location, code = self.call(client, 'process_click_resume', key, file, uploadId, nocheck)
+        return self.upload_result(client, file, location)
+
+    def upload_many(self, files, max_files=BATCH_MAX_FILES, max_bytes=BATCH_MAX_BYTES, nocheck=None):
+        """ files: iterable of (file, key[, content type]) uploaded by one worker pool, list of
+            UploadResult (failed files included, not raised) in completion order """
+        try:
+            batch = BatchUpload(self.endpoint, self.token, self.parallel, self.quiet, part_size=self.part_size,
+                                nocheck=self.nocheck if nocheck is None else nocheck, max_files=max_files,
+                                max_bytes=max_bytes, state_dir=self.state_dir, min_parallel=self.bounds[0],
+                                max_parallel=self.bounds[1], bandwidth=self.bandwidth, progress=self.progress,
+                                metrics=self.metrics, profile=self.profile, hash_cache=self.hash_cache,
+                                urlFiles=self.urlFiles, session=self.session)
+            results = batch.main(files)
+        except Exception as e:
+            raise as_error(e) from e
+        return [UploadResult(res['file'], res['key'], res['location'], status=res['status'],
+                             message=None if res['message'] is None else str(res['message']),
+                             uploadId=res['uploadId'], part_size=plan_part_size(res['client']))
+                for res in results]
+
+    def remote_files(self):
+        """ {key: (size, checksum)} of record files, {} if not listed """
+        return self.client().get_remote_files()
+
+    def abort(self, key, uploadId):
+        """ upload of key aborted, its parts removed from server """
+        client = self.client(key=key)
+        client.set_uploadId(uploadId)
+        self.call(client, 'abort_upload')
+
+    def check(self, file, key=None):
+        """ local file (path or TarBundle) compared with uploaded object """
+        client = self.client()
+        try:
+            client.process_click_check(key, file)
+        except Exception as e:
+            if client.checked is False:
+                return CheckResult(file, client.key, False)
+            raise as_error(e, client) from e
+        return CheckResult(file, client.key, True)
+
+    def download(self, key, file=None):
+        """ object downloaded to file [default: basename of key] """
+        client = self.client()
+        file, code = self.call(client, 'process_click_download', key, file)
+        return DownloadResult(key, file, client.data_size)
+
+    def revoke(self):
+        """ token revoked - client not usable any more """
+        # no token check - token revoked as it is:
+        client = OARepoS3Client(self.endpoint, self.token, 1, self.quiet, urlFiles=self._urlFiles or '',
+                                session=self.session)
+        self.call(client, 'revoke_token')
+
+    async def run_async(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(method, *args, **kwargs))
+
+    async def upload_async(self, file, key=None, content_type=None, nocheck=None):
+        return await self.run_async(self.upload, file, key, content_type, nocheck)
+
+    async def upload_stream_async(self, stream, key, nocheck=None, name='-'):
+        return await self.run_async(self.upload_stream, stream, key, nocheck, name)
+
+    async def resume_async(self, file, key=None, uploadId=None, part_size=None, nocheck=None):
+        return await self.run_async(self.resume, file, key, uploadId, part_size, nocheck)
+
+    async def upload_many_async(self, files, max_files=BATCH_MAX_FILES, max_bytes=BATCH_MAX_BYTES, nocheck=None):
+        return await self.run_async(self.upload_many, files, max_files, max_bytes, nocheck)
+
+    async def abort_async(self, key, uploadId):
+        return await self.run_async(self.abort, key, uploadId)
+
+    async def check_async(self, file, key=None):
+        return await self.run_async(self.check, file, key)
+
+    async def download_async(self, key, file=None):
+        return await self.run_async(self.download, key, file)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+""" OARepo S3 client bandwidth limit. """
+
+import re, threading, time, uuid, logging
+import multiprocessing as mp
+
+from oarepo_s3_cli.constants import *
+
+logger = logging
+
+RATE_UNITS = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+
+# shared buckets of this process, found again by key in forked workers of process engine:
+_shared_buckets = {}
+
+
+def parse_rate(value):
+    """ bytes/s of "<number>[K|M|G|T][B][/s]", None for unlimited ("0", "unlimited") """
+    if value is None: return None
+    m = re.match(r'^\s*([0-9]+(?:\.[0-9]*)?)\s*([KMGT]?)(?:i?B)?(?:/s)?\s*$', str(value), re.IGNORECASE)
+    if m is None:
+        if str(value).strip().lower() in ('unlimited', 'none', '-'): return None
+        raise Exception(f"Invalid bandwidth \"{value}\" (<bytes/s>[K|M|G])", STATUS_WRONG_BANDWIDTH)
+    rate = int(float(m.group(1)) * RATE_UNITS[m.group(2).upper()])
+    return rate if rate > 0 else None
+
+
+class BandwidthSchedule(object):
+    """ time-of-day bandwidth limits, lines "HH:MM-HH:MM <rate>" (local time, may pass midnight,
+        first matching line wins, '#' comments), default rate outside of scheduled intervals """
+    def __init__(self, intervals=(), default=None):
+        self.intervals = list(intervals)    # (from minute, to minute, rate)
+        self.default = default
+
+    @classmethod
+    def load(cls, file, default=None):
+        intervals = []
+        with open(file, 'r') as fh:
+            for lineno, line in enumerate(fh, 1):
+                line = line.split('#', 1)[0].strip()
+                if not line: continue
+                m = re.match(r'^([0-9]{1,2}):([0-9]{2})\s*-\s*([0-9]{1,2}):([0-9]{2})\s+(\S+)$', line)
+                if m is None or int(m.group(1)) > 24 or int(m.group(3)) > 24 \
+                        or int(m.group(2)) > 59 or int(m.group(4)) > 59:
+                    raise Exception(f"Invalid bandwidth schedule line {lineno} in {file}: \"{line}\"",
+                                    STATUS_WRONG_BANDWIDTH)
+                start = int(m.group(1)) * 60 + int(m.group(2))
+                end = int(m.group(3)) * 60 + int(m.group(4))
+                intervals.append((start, end, parse_rate(m.group(5))))
+        return cls(intervals, default)
+
+    def rate_at(self, ts=None):
+        tm = time.localtime(ts)
+        minute = tm.tm_hour * 60 + tm.tm_min
+        for start, end, rate in self.intervals:
+            if (start <= minute < end) if start <= end else (minute >= start or minute < end):
+                return rate
+        return self.default
+
+
+class TokenBucket(object):
+    """ bandwidth limit shared by all upload streams: bytes are taken as they are sent and a stream
+        in debt sleeps until the bucket refills at rate (from schedule if any); shared=True keeps
+        the bucket in shared memory for worker processes forked after it was created """
+    def __init__(self, rate=None, schedule=None, burst=BANDWIDTH_BURST, shared=False):
+        self.rate = rate
+        self.schedule = schedule
+        self.burst = burst
+        self.key = None
+        if shared:
+            self.key = uuid.uuid4().hex
+            self.state, self.lock = mp.RawArray('d', 2), mp.Lock()
+            _shared_buckets[self.key] = (self.state, self.lock)
+        else:
+            self.state, self.lock = [0.0, 0.0], threading.Lock()
+        # [tokens (bytes, negative = debt), time of last refill]:
+        self.state[0], self.state[1] = 0, time.monotonic()
+        self.checked, self.current = 0, rate
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['state'], state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.key in _shared_buckets:
+            self.state, self.lock = _shared_buckets[self.key]
+        else:
+            # not forked from creator (or not shared) - limit of this process only:
+            logger.debug(f"bandwidth limit not shared with this process")
+            self.state, self.lock = [0.0, time.monotonic()], threading.Lock()
+
+    def get_rate(self):
+        if self.schedule is None: return self.rate
+        now = time.time()
+        if now - self.checked >= BANDWIDTH_SCHEDULE_CHECK:
+            self.checked, self.current = now, self.schedule.rate_at(now)
+        return self.current
+
+    def idle(self):
+        """ seconds since bytes were last sent under limit (watchdogs: slow transfer is not a hang) """
+        return time.monotonic() - self.state[1]
+
+    def part_secs(self, nbytes, streams=1):
+        """ seconds of nbytes sent by one of streams sharing lowest limited rate, 0 without limit """
+        rates = [rate for start, end, rate in self.schedule.intervals] + [self.schedule.default] \
+            if self.schedule is not None else [self.rate]
+        rates = [rate for rate in rates if rate is not None]
+        return nbytes * streams / min(rates) if rates else 0
+
+    def consume(self, nbytes):
+        rate = self.get_rate()
+        if rate is None or nbytes <= 0: return 0
+        with self.lock:
+            now = time.monotonic()
+            tokens = min(self.state[0] + (now - self.state[1]) * rate, rate * self.burst)
+            tokens -= nbytes
+            self.state[0], self.state[1] = tokens, now
+        wait = -tokens / rate if tokens < 0 else 0
+        if wait > 0: time.sleep(wait)
+        return wait
+
+
+class ThrottledBody(object):
+    """ part body (FileSlice, PartBuffer) read under bandwidth limit """
+    def __init__(self, body, bucket):
+        self.body = body
+        self.bucket = bucket
+        self.bandwidth_secs = 0     # time waited for bandwidth
+
+    def __len__(self):
+        return len(self.body)
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(BANDWIDTH_CHUNK_SIZE)
+            if not chunk: break
+            yield chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.body.close()
+
+    def __getattr__(self, name):
+        return getattr(self.body, name)
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            return b''.join(iter(self))
+        # blocks of at most BANDWIDTH_CHUNK_SIZE keep streams smooth under limit:
+        data = self.body.read(min(n, BANDWIDTH_CHUNK_SIZE))
+        self.bandwidth_secs += self.bucket.consume(len(data))
+        return data
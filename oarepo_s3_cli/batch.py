@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+""" OARepo S3 client multi-file (batch) upload. """
+
+import queue, logging
+from multiprocessing.pool import ThreadPool
+
+from oarepo_s3_cli.utils import *
+from oarepo_s3_cli.constants import *
+from oarepo_s3_cli.lib import OARepoS3Client
+from oarepo_s3_cli.parallels import AdaptiveLimit
+
+logger = logging
+
+
+class FileState(object):
+    def __init__(self, file, key, client=None, content_type=None):
+        self.file = file
+        self.key = key
+        self.content_type = content_type
+        self.client = client
+        self.small = False      # one request upload by data worker (upload_small)
+        self.ready = False      # upload initialized
+        self.supplying = False  # presign request running
+        self.next = 0           # index of next part in client.parts_unfin
+        self.running = 0
+        self.done = 0
+        self.error = None
+        self.location = None
+
+    def part_ready(self):
+        if not self.ready or self.error is not None or self.next >= len(self.client.parts_unfin):
+            return None
+        pn = self.client.parts_unfin[self.next]
+        return pn if self.client.presigns.has_key(pn) else None
+
+    def result(self):
+        msg, code = (None, STATUS_OK) if self.error is None else \
+            self.error.args if len(self.error.args) > 1 else (self.error.args[0], STATUS_UNKNOWN)
+        uploadId = self.client.get_uploadId() if self.client is not None else None
+        key = self.client.key if self.client is not None else self.key
+        # client kept for failed files only (resume/abort), results of bulk runs stay small:
+        return dict(file=self.file, key=key, location=self.location, status=code, message=msg,
+                    uploadId=uploadId, client=self.client if self.error is not None else None)
+
+
+class BatchUpload(object):
+    """ one token check and one worker pool for many files, parts of up to max_files files
+        (and max_bytes of parts) in flight interleaved, init/presign/complete of files
+        pipelined in control threads alongside data transfer; small files uploaded whole
+        by data workers, up to 2 * parallel of them in flight besides max_files """
+    def __init__(self, url, token, parallel=0, quiet=False, part_size='auto', nocheck=True,
+                 max_files=BATCH_MAX_FILES, max_bytes=BATCH_MAX_BYTES, state_dir=None,
+                 min_parallel=ADAPTIVE_MIN_PARALLEL, max_parallel=ADAPTIVE_MAX_PARALLEL, bandwidth=None,
+                 progress=None, metrics=None, profile=None, hash_cache=None, urlFiles=None, session=None):
+        self.url = url
+        self.token = token
+        # adaptive limit of part streams shared by all files:
+        self.limiter = AdaptiveLimit(min_parallel, max_parallel) if parallel == 'auto' else None
+        if self.limiter is not None: parallel = self.limiter.high
+        self.parallel = MAX_PARALLEL if parallel == 0 else parallel
+        self.quiet = quiet
+        self.part_size = part_size
+        self.nocheck = nocheck
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.state_dir = state_dir
+        # bandwidth limit shared by all files:
+        self.bandwidth = bandwidth
+        # progress events of all files in one stream:
+        self.progress = progress
+        self.metrics = metrics
+        self.profile = profile
+        self.hash_cache = hash_cache
+        self.session = session
+        self.events = queue.Queue()
+        # one connection pool for data and control threads:
+        if session is None: get_session(self.parallel + BATCH_CONTROL_THREADS)
+        # token checked once, by first client:
+        self.urlFiles = urlFiles if urlFiles is not None else \
+            OARepoS3Client(url, token, self.parallel, quiet=True, session=session).urlFiles
+
+    def new_client(self, file, key, content_type=None):
+        client = OARepoS3Client(self.url, self.token, self.parallel, self.quiet, engine='thread',
+                                part_size=self.part_size, urlFiles=self.urlFiles, state_dir=self.state_dir,
+                                bandwidth=self.bandwidth, progress=self.progress,
+                                metrics=self.metrics, profile=self.profile, hash_cache=self.hash_cache,
+                                session=self.session)
+        client.nocheck = self.nocheck
+        client.limiter = self.limiter
+        if content_type is not None: client.contentType = content_type
+        client.set_file(file, key)
+        client.set_journal()
+        return client
+
+    def submit(self, pool, event, fs, func, args=()):
+        pool.apply_async(func, args,
+                         callback=lambda res: self.events.put((event, fs, args, res)),
+                         error_callback=lambda e: self.events.put((event + '_error', fs, args, e)))
+
+    def init_file(self, fs):
+        client = fs.client
+        if not client.load_journal():
+            client.init_upload()
+        client.parts_unfin = [pn for pn in range(1, client.num_parts + 1) if client.results[pn-1] is None]
+        client.presigns = SharedList(client.presign_parts_upload, client.parts_unfin, BATCH_PRESIGNS, MAX_PRESIGNS,
+                                     shared=False)
+        client.presings_supply(MAX_PRESIGNS)
+        client.report_begin()
+
+    def complete_file(self, fs):
+        client = fs.client
+        client.parts = [res for res in client.results if res is not None]
+        location = client.complete_upload()
+        if not client.nocheck: client.process_click_check()
+        return location
+
+    def main(self, files):
+        """ files: iterable of (file, key[, content type]) consumed lazily,
+            returns list of result dicts in completion order """
+        files = iter(files)
+        exhausted, active, results = False, [], []
+        inflight_parts, inflight_bytes = 0, 0
+        pending = None      # next file, admitted when there is room for it
+
+        def finish(fs):
+            active.remove(fs)
+            result = fs.result()
+            results.append(result)
+            if fs.client is not None:
+                fs.client.report_end(result['status'], result['location'], result['message'])
+            elif self.progress is not None:
+                # file failed before upload started (not found, broken manifest):
+                self.progress.emit('end', file=fs.file, key=fs.key, status=result['status'],
+                                   location=None, message=str(result['message']))
+            if fs.error is None:
+                secho(f"Finished upload key:{fs.client.key}. [{fs.location}]", prefix='OK', quiet=self.quiet)
+            else:
+                secho(f"Upload of {fs.file} failed: {fs.error}", prefix='ERR', fg='red', quiet=self.quiet)
+
+        data_pool, ctl_pool = ThreadPool(self.parallel), ThreadPool(BATCH_CONTROL_THREADS)
+        try:
+            while True:
+                # --- admit next files: ---
+                while not exhausted or pending is not None:
+                    if pending is None:
+                        try:
+                            file, key, *content_type = next(files)
+                        except StopIteration:
+                            exhausted = True
+                            break
+                        except Exception as e:
+                            # broken source (e.g. manifest line) - no more files:
+                            exhausted = True
+                            fs = FileState(None, None)
+                            fs.error = e
+                            active.append(fs)
+                            finish(fs)
+                            break
+                        fs = FileState(file, key, content_type=content_type[0] if content_type else None)
+                        try:
+                            fs.client = self.new_client(file, key, fs.content_type)
+                        except Exception as e:
+                            fs.error = e
+                            active.append(fs)
+                            finish(fs)
+                            continue
+                        fs.small = fs.client.is_small()
+                        pending = fs
+                    fs = pending
+                    smalls = sum(1 for a in active if a.small)
+                    if fs.small:
+                        if smalls >= self.parallel * 2: break
+                        # direct PUT or one part multipart upload, no control requests pipelined:
+                        self.submit(data_pool, 'small', fs, fs.client.upload_small)
+                    else:
+                        if len(active) - smalls >= self.max_files: break
+                        self.submit(ctl_pool, 'init', fs, self.init_file, (fs,))
+                    active.append(fs)
+                    pending = None
+                # --- parts of active files round robin, bounded in flight: ---
+                submitted = True
+                while submitted:
+                    submitted = False
+                    for fs in active:
+                        if inflight_parts >= self.parallel * 2 or inflight_bytes >= self.max_bytes:
+                            break
+                        pn = fs.part_ready()
+                        if pn is None: continue
+                        size = fs.client.get_part_range(pn)[1]
+                        fs.next += 1
+                        fs.running += 1
+                        inflight_parts += 1
+                        inflight_bytes += size
+                        self.submit(data_pool, 'part', fs, fs.client.upload_part, (pn, f"val-{pn}"))
+                        submitted = True
+                for fs in list(active):
+                    presigns = fs.client.presigns if fs.ready and fs.error is None else None
+                    if presigns is None or fs.supplying:
+                        continue
+                    if presigns.idx < len(presigns.unfin) and len(presigns.list) < BATCH_PRESIGNS:
+                        fs.supplying = True
+                        self.submit(ctl_pool, 'supply', fs, fs.client.presings_supply, (MAX_PRESIGNS,))
+                    elif fs.next < len(fs.client.parts_unfin) and fs.part_ready() is None and fs.running == 0:
+                        pn = fs.client.parts_unfin[fs.next]
+                        fs.error = Exception(f"Part {pn} not presigned.", STATUS_WRONG_SERVER_RESPONSE)
+                        finish(fs)
+                if exhausted and pending is None and len(active) == 0:
+                    break
+                # --- wait for event: ---
+                try:
+                    event, fs, args, res = self.events.get(timeout=MON_TIMEOUT)
+                except queue.Empty:
+                    # parts slowed down by bandwidth limit, still sending:
+                    if self.bandwidth is not None and self.bandwidth.idle() <= MON_TIMEOUT: continue
+                    raise Exception(f"Monitor timeout ({MON_TIMEOUT}s) reached", STATUS_UPLOAD_UNCOMPLETED)
+                logger.debug(f"{funcname()} {event} {fs.file} {args}")
+                if event in ('part', 'part_error'):
+                    pn = args[0]
+                    inflight_parts -= 1
+                    inflight_bytes -= fs.client.get_part_range(pn)[1]
+                    fs.running -= 1
+                if event == 'init':
+                    fs.ready = True
+                    if len(fs.client.parts_unfin) == 0:
+                        # all parts uploaded before (journal):
+                        self.submit(ctl_pool, 'complete', fs, self.complete_file, (fs,))
+                elif event == 'supply':
+                    fs.supplying = False
+                elif event == 'part':
+                    fs.client.results[pn-1] = res
+                    fs.client.part_done(res)
+                    fs.done += 1
+                    if fs.error is not None:
+                        # file failed meanwhile (other part, supply) - finished by its last running part:
+                        if fs.running == 0 and fs in active: finish(fs)
+                    elif fs.done == len(fs.client.parts_unfin):
+                        self.submit(ctl_pool, 'complete', fs, self.complete_file, (fs,))
+                elif event == 'complete':
+                    fs.location = res
+                    finish(fs)
+                elif event == 'small':
+                    fs.location = res[0]
+                    finish(fs)
+                elif event == 'small_error':
+                    fs.error = res
+                    finish(fs)
+                else:
+                    # init/presign/part/complete error - file failed, when its running parts end:
+                    if event == 'part_error': fs.client.part_failed(res)
+                    fs.supplying = False
+                    if fs.error is None: fs.error = res
+                    if fs.running == 0 and fs in active: finish(fs)
+        finally:
+            data_pool.terminate()
+            ctl_pool.terminate()
+        if self.limiter is not None:
+            secho(self.limiter.summary(), prefix='OK', quiet=self.quiet)
+        return results
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+""" Bundle (upload --bundle): many files uploaded as one tar archive generated on the fly. """
+
+import bisect, hashlib, json, os, tarfile, time
+from multiprocessing.pool import ThreadPool
+from os import path
+
+from oarepo_s3_cli.constants import *
+from oarepo_s3_cli.utils import FileSlice, get_multipart_etag
+
+BLOCK = tarfile.BLOCKSIZE
+
+
+class TarBundle(object):
+    """ uncompressed PAX tar of members (path, name) laid out in advance - size, member offsets and
+        any byte range known without writing the archive; headers regenerated and member data read
+        from files when a range is read, so parts are read like parts of a file (in parallel, resumed,
+        hashed) and only member metadata is kept in memory. Members sorted by name, owner and
+        fractional mtime left out - the same files give the same archive (resume, check). """
+    def __init__(self, members, name='bundle'):
+        self.name = name
+        self.members = []       # [path, name, size, mtime, mode, header offset, header length]
+        self.offsets = []       # header offsets of members, end of last member
+        offset = 0
+        for file, arcname in sorted(members, key=lambda m: m[1]):
+            if not os.access(file, os.R_OK):
+                raise PermissionError(f"File not readable ({file})", STATUS_WRONG_FILE)
+            st = os.stat(file)
+            member = [file, arcname, st.st_size, int(st.st_mtime), st.st_mode & 0o7777, offset, 0]
+            member[6] = len(self.header(member))
+            self.members.append(member)
+            self.offsets.append(offset)
+            offset += member[6] + self.padded(member[2])
+        self.offsets.append(offset)
+        # end of archive - two zero blocks:
+        self.size = offset + 2 * BLOCK
+
+    @classmethod
+    def from_sources(cls, sources, name='bundle'):
+        """ bundle of (file, key, content type) of iter_upload_sources, key is member name """
+        return cls(((file, key or path.basename(file)) for file, key, content_type in sources), name)
+
+    @staticmethod
+    def padded(size):
+        return (size + BLOCK - 1) // BLOCK * BLOCK
+
+    @staticmethod
+    def header(member):
+        file, arcname, size, mtime, mode = member[:5]
+        info = tarfile.TarInfo(arcname)
+        info.size, info.mtime, info.mode, info.type = size, mtime, mode, tarfile.REGTYPE
+        info.uid = info.gid = 0
+        info.uname = info.gname = ''
+        # PAX extended header for long names and members over 8 GiB:
+        return info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+
+    def __fspath__(self):
+        # journal name and progress/profile records:
+        return self.name
+
+    def __str__(self):
+        return self.name
+
+    def identity(self):
+        """ journal identity - archive changes with any member name, size or mtime """
+        digest = hashlib.sha1()
+        for member in self.members:
+            digest.update(json.dumps(member[1:5]).encode())
+        return dict(size=self.size, members=len(self.members), digest=digest.hexdigest())
+
+    def index(self):
+        """ member records: name, data offset and size (Range request of member), mtime """
+        for file, arcname, size, mtime, mode, offset, hlen in self.members:
+            yield dict(name=arcname, offset=offset + hlen, size=size, mtime=mtime)
+
+    def write_index(self, file):
+        with open(file, 'w') as fh:
+            for rec in self.index():
+                fh.write(json.dumps(rec) + '\n')
+
+    def read_at(self, pos, n, handles):
+        """ up to n bytes at pos, handles: {path: open file} of caller """
+        i = bisect.bisect_right(self.offsets, pos) - 1
+        if i >= len(self.members):
+            # end of archive:
+            return bytes(min(n, self.size - pos))
+        file, arcname, size, mtime, mode, offset, hlen = member = self.members[i]
+        rel = pos - offset
+        if rel < hlen:
+            return self.header(member)[rel:rel + n]
+        rel -= hlen
+        if rel >= size:
+            # padding of member data:
+            return bytes(min(n, self.offsets[i + 1] - pos))
+        fh = handles.get(file)
+        if fh is None:
+            for other in handles.values(): other.close()
+            handles.clear()
+            fh = handles[file] = open(file, 'rb')
+        fh.seek(rel)
+        data = fh.read(min(n, size - rel))
+        if len(data) == 0:
+            raise Exception(f"File {file} changed while bundled (shorter than {size} B).", STATUS_WRONG_FILE)
+        return data
+
+    def slice(self, offset, size):
+        return BundleSlice(self, offset, size)
+
+    def part_md5(self, offset, size):
+        with self.slice(offset, size) as body:
+            for chunk in body: pass
+            return body.hexdigest()
+
+    def get_hash(self, part_size=0, parallel=1):
+        """ multipart ETag of archive, parts read in parallel like get_local_hash """
+        part_size = part_size if part_size != 0 else MIN_PART_SIZE
+        parts = [(offset, min(part_size, self.size - offset)) for offset in range(0, self.size, part_size)]
+        if parallel > 1 and len(parts) > 1:
+            with ThreadPool(min(parallel, len(parts))) as pool:
+                return get_multipart_etag(pool.starmap(self.part_md5, parts))
+        return get_multipart_etag([self.part_md5(*part) for part in parts])
+
+
+class BundleSlice(FileSlice):
+    """ archive bytes [offset, offset+size) streamed as HTTP body like FileSlice, member file
+        being read kept open """
+    def __init__(self, bundle, offset, size):
+        self.bundle = bundle
+        self.offset = offset
+        self.size = size
+        self.pos = 0
+        self.md5 = hashlib.md5()
+        self.handles = {}
+
+    def read(self, n=-1):
+        remain = self.size - self.pos
+        if n is None or n < 0 or n > remain: n = remain
+        if n == 0:
+            if self.read_end is None: self.read_end = time.time()
+            return b''
+        start, chunks, want = time.time(), [], n
+        while want > 0:
+            data = self.bundle.read_at(self.offset + self.pos, want, self.handles)
+            chunks.append(data)
+            self.pos += len(data)
+            want -= len(data)
+        data = b''.join(chunks)
+        if self.md5 is not None: self.md5.update(data)
+        self.read_secs += time.time() - start
+        return data
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR: pos += self.pos
+        elif whence == os.SEEK_END: pos += self.size
+        self.pos = min(max(pos, 0), self.size)
+        self.md5 = hashlib.md5() if self.pos == 0 else None
+        return self.pos
+
+    def close(self):
+        for fh in self.handles.values(): fh.close()
+        self.handles.clear()
@@ -7,13 +7,20 @@
 
 """ OARepo S3 client CLI wrapper. """
 
-import sys
+import os, sys, tempfile
 import click
+import itertools
 import logging
 import urllib3
-import requests
 from oarepo_s3_cli.utils import *
 from oarepo_s3_cli.lib import OARepoS3Client
+from oarepo_s3_cli.api import Client, error_status
+from oarepo_s3_cli.bundle import TarBundle
+from oarepo_s3_cli.hashcache import HashCache, skip_unchanged
+from oarepo_s3_cli.bandwidth import parse_rate, BandwidthSchedule, TokenBucket
+from oarepo_s3_cli.progress import ProgressStream
+from oarepo_s3_cli.metrics import Metrics, MetricsExporter
+from oarepo_s3_cli.profile import Profile
 from oarepo_s3_cli.constants import *
 from oarepo_s3_cli.version import __version__
 
@@ -21,6 +28,77 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 CTX_VARS=['debug', 'quiet', 'endpoint', 'token', 'logger', 'noninteractive']
 
+def _parallel_cb(ctx, param, value):
+    if value == 'auto': return value
+    try:
+        return int(value)
+    except ValueError:
+        raise click.BadParameter(f"\"{value}\" is not a number or auto")
+
+def _check_parallel(parallel, engine):
+    if parallel == 'auto' and engine == 'process':
+        raise click.UsageError("--parallel auto needs thread or async engine.")
+
+def _bandwidth_cb(ctx, param, value):
+    try:
+        return parse_rate(value)
+    except Exception as e:
+        raise click.BadParameter(e.args[0])
+
+def _bandwidth(max_bandwidth, schedule, engine):
+    """ token bucket shared by all upload streams, None without limit """
+    if max_bandwidth is None and schedule is None: return None
+    try:
+        schedule = BandwidthSchedule.load(schedule, max_bandwidth) if schedule is not None else None
+    except Exception as e:
+        raise click.BadParameter(e.args[0], param_hint="'--bandwidth-schedule'")
+    return TokenBucket(max_bandwidth, schedule, shared=(engine == 'process'))
+
+def _bundle(files, key=None, manifest=None):
+    """ tar bundle of files, directories, glob patterns and manifest entries, key: bundle key """
+    if key is None:
+        name = os.path.basename(files[0].rstrip('/')) if files else ''
+        key = f"{name or 'bundle'}.tar"
+    try:
+        return TarBundle.from_sources(iter_upload_sources(files, (), manifest), key)
+    except Exception as e:
+        msg, code = e.args if len(e.args) > 1 else (e.args[0], STATUS_WRONG_FILE)
+        err_fatal(msg, code)
+
+def _hash_cache(ctx):
+    """ hash cache in state dir, opened on first use - None with --no-hash-cache or --no-journal """
+    co = ctx.obj
+    if co['hash_cache'] is False:
+        co['hash_cache'] = None
+        if co['state_dir'] is not None:
+            try:
+                co['hash_cache'] = HashCache(co['state_dir'])
+                ctx.call_on_close(co['hash_cache'].close)
+            except OSError as e:
+                secho(f"Hash cache not available ({e}).", prefix='WARN', fg='yellow', quiet=co['quiet'])
+    return co['hash_cache']
+
+def _client(ctx, parallel=1, hash_cache=None, **kwargs):
+    """ library client of command - messages, progress bar and interrupt handling on terminal """
+    co = ctx.obj
+    return Client(co['endpoint'], co['token'], parallel, state_dir=co['state_dir'], hash_cache=hash_cache,
+                  progress=co['progress'], metrics=co['metrics'], profile=co['profile'], quiet=co['quiet'],
+                  signals=True, **kwargs)
+
+def _fatal(ctx, e):
+    """ error of command - exit with its status (traceback with --debug) """
+    msg, code = error_status(e)
+    ctx.obj['logger'].debug(f"Error {code} [{msg}]")
+    if ctx.obj['debug']:
+        raise e
+    err_fatal(msg, code)
+
+def _part_size_cb(ctx, param, value):
+    try:
+        return parse_part_size(value)
+    except Exception as e:
+        raise click.BadParameter(e.args[0])
+
 @click.group()
 @click.version_option(__version__)
 @click.pass_context
@@ -29,7 +107,27 @@ CTX_VARS=['debug', 'quiet', 'endpoint', 'token', 'logger', 'noninteractive']
 @click.option('-n', '--noninteractive', default=False, is_flag=True, show_default=True)
 @click.option('-e', '--endpoint', required=True, help='OARepo HTTPS endpoint e.g. https://repo.example.org')
 @click.option('-t', '--token', required=True, help='Access token (can be alternatively specified in env.variable "TOKEN")', envvar='TOKEN', show_default=True)
-def cli_main(ctx, debug, quiet, noninteractive, endpoint, token):
+@click.option('--state-dir', default=STATE_DIR, envvar='OAREPO_S3_STATE_DIR', show_default=True,
+              help='directory of upload journals (resume without uploadId and server round trips)')
+@click.option('--no-journal', 'nojournal', default=False, is_flag=True, show_default=True,
+              help='no upload journal (nor hash cache)')
+@click.option('--no-hash-cache', 'nohashcache', default=False, is_flag=True, show_default=True,
+              help='no cache of local file hashes in state dir (skip of unchanged files, check without reading)')
+@click.option('--progress', default='bar', type=click.Choice(['bar', 'json']), show_default=True,
+              help='upload progress: terminal bar or NDJSON events (start, progress, end) for monitoring')
+@click.option('--progress-file', default='-', show_default=True,
+              help='--progress json: file for events, "-" for stdout (replaces bar) or "fd:<N>" for file descriptor')
+@click.option('--metrics-listen', default=None,
+              help='serve upload metrics (Prometheus text format) on http://[host:]port/metrics [host: 127.0.0.1]')
+@click.option('--metrics-textfile', default=None, type=click.Path(dir_okay=False),
+              help='write upload metrics to file (node_exporter textfile collector) while upload runs')
+@click.option('--profile', 'profile_file', default=None, type=click.Path(dir_okay=False),
+              help='write per-part timing spans to file and print profile report (breakdown, slowest parts, '
+                   'critical path) at end of run')
+@click.option('--profile-format', default='json', type=click.Choice(['json', 'chrome']), show_default=True,
+              help='--profile file format: JSON or Chrome trace (chrome://tracing, Perfetto)')
+def cli_main(ctx, debug, quiet, noninteractive, endpoint, token, state_dir, nojournal, nohashcache, progress, progress_file,
+             metrics_listen, metrics_textfile, profile_file, profile_format):
     ctx.ensure_object(dict)
     loglevel = logging.INFO
     if quiet:
@@ -40,77 +138,208 @@ def cli_main(ctx, debug, quiet, noninteractive, endpoint, token):
     logger = logging.getLogger(__name__)
     for k in CTX_VARS:
         ctx.obj[k] = locals()[k]
+    ctx.obj['state_dir'] = None if nojournal else state_dir
+    # opened by upload and check only (_hash_cache):
+    ctx.obj['hash_cache'] = None if nohashcache else False
+    ctx.obj['progress'] = None
+    if progress == 'json':
+        try:
+            ctx.obj['progress'] = ProgressStream(progress_file)
+        except (OSError, ValueError) as e:
+            raise click.BadParameter(str(e), param_hint="'--progress-file'")
+        ctx.call_on_close(ctx.obj['progress'].close)
+    ctx.obj['metrics'] = None
+    if metrics_listen is not None or metrics_textfile is not None:
+        ctx.obj['metrics'] = Metrics()
+        try:
+            exporter = MetricsExporter(ctx.obj['metrics'], metrics_listen, metrics_textfile)
+        except Exception as e:
+            raise click.BadParameter(str(e.args[0]), param_hint="'--metrics-listen'")
+        ctx.call_on_close(exporter.close)
+    ctx.obj['profile'] = None
+    if profile_file is not None:
+        ctx.obj['profile'] = Profile(profile_file, profile_format, quiet)
+        ctx.call_on_close(ctx.obj['profile'].close)
 
 
 @cli_main.command('upload')
 @click.pass_context
-@click.option('-f', '--file', 'files', required=True, multiple=True, help='file(s) for upload, repeatable')
+@click.option('-f', '--file', 'files', multiple=True,
+              help='file(s), directories (recursive) or glob patterns for upload, repeatable, "-" for stdin '
+                   '(stream of unknown size, -k required)')
 @click.option('-k', '--key', 'keys', multiple=True,
-              help='object key(s)/names(s) for uploaded files in S3, repeatable [default: basename of file]')
-@click.option('-p', '--parallel', default=0, type=int, show_default=False,
-              help='number of parallel upload streams [default: CPU count]')
+              help='object key(s)/names(s) for uploaded files in S3, key prefix for directory/glob, repeatable '
+                   '[default: basename of file, relative path for directory/glob]')
+@click.option('-m', '--manifest', default=None, type=click.Path(exists=True, dir_okay=False, allow_dash=True),
+              help='manifest of files for upload, TSV (path, key, content type) or JSONL, "-" for stdin')
+@click.option('-p', '--parallel', default='0', callback=_parallel_cb, show_default=False,
+              help='number of parallel upload streams or "auto" (adaptive, thread/async engine) [default: CPU count]')
+@click.option('--min-parallel', default=ADAPTIVE_MIN_PARALLEL, type=click.IntRange(min=1), show_default=True,
+              help='--parallel auto: min. parallel upload streams')
+@click.option('--max-parallel', default=ADAPTIVE_MAX_PARALLEL, type=click.IntRange(min=1), show_default=True,
+              help='--parallel auto: max. parallel upload streams')
+@click.option('--engine', default=DEFAULT_ENGINE, type=click.Choice(ENGINES), show_default=True,
+              help='parallel upload engine')
+@click.option('-s', '--part-size', 'part_size', default='auto', show_default=True, callback=_part_size_cb,
+              help='part size in bytes or "auto" (by file size, parallel streams and throughput)')
+@click.option('--read-ahead', 'read_ahead', default=0, type=click.IntRange(min=0), show_default=True,
+              help='bytes of parts read into memory ahead of upload streams (e.g. for network filesystems)')
+@click.option('--max-bandwidth', default=None, callback=_bandwidth_cb,
+              help='max. bandwidth of all upload streams, bytes/s with optional K/M/G suffix (e.g. 50M) '
+                   '[default: unlimited]')
+@click.option('--bandwidth-schedule', default=None, type=click.Path(exists=True, dir_okay=False),
+              help='time-of-day bandwidth limits, lines "HH:MM-HH:MM <bytes/s>", --max-bandwidth outside of them')
+@click.option('--max-files', default=BATCH_MAX_FILES, type=int, show_default=True,
+              help='multiple files: max. files uploaded at once')
+@click.option('--max-inflight', default=BATCH_MAX_BYTES, type=int, show_default=True,
+              help='multiple files: max. bytes of parts in flight')
+@click.option('--bundle', default=False, is_flag=True, show_default=True,
+              help='upload all files as one tar archive generated on the fly (-k: archive key '
+                   '[default: basename of first file + .tar]), member index uploaded as <key>.index.jsonl')
+@click.option('--bundle-index', default=None, type=click.Path(dir_okay=False),
+              help='--bundle: also write member index (JSONL: name, offset, size, mtime) to local file')
+@click.option('--skip-unchanged', 'skip', default=False, is_flag=True, show_default=True,
+              help='skip files uploaded before - remote file of the key has the same size and checksum as cached '
+                   'hash of unchanged local file')
 @click.option('-c', '--nocheck', default=False, is_flag=True, show_default=True,
               help='no automatic checksum test of local and uploaded files')
-def cli_upload(ctx, files, keys, parallel, nocheck):
+def cli_upload(ctx, files, keys, manifest, parallel, min_parallel, max_parallel, engine, part_size, read_ahead,
+               max_bandwidth, bandwidth_schedule, max_files, max_inflight, bundle, bundle_index, skip, nocheck):
     co = ctx.obj
     logger = ctx.obj['logger']
-    if len(keys) < len(files): keys += (len(files)-len(keys)) * (None,)
+    if len(files) == 0 and manifest is None:
+        raise click.UsageError("Missing option '-f' / '--file' or '-m' / '--manifest'.")
+    _check_parallel(parallel, engine)
+    bandwidth = _bandwidth(max_bandwidth, bandwidth_schedule, engine)
+    hash_cache = _hash_cache(ctx)
+    client = _client(ctx, parallel, hash_cache, engine=engine, part_size=part_size, read_ahead=read_ahead,
+                     min_parallel=min_parallel, max_parallel=max_parallel, bandwidth=bandwidth, nocheck=nocheck)
+    if '-' in files:
+        if len(files) > 1 or manifest is not None or bundle:
+            raise click.UsageError("Stdin (-f -) is uploaded alone.")
+        if len(keys) == 0:
+            raise click.UsageError("Missing option '-k' / '--key' for upload of stdin.")
+        return _upload_stream(ctx, client, keys[0])
+    if bundle:
+        if engine == 'process':
+            raise click.UsageError("--bundle needs thread or async engine.")
+        # all files as one object, uploaded like one file:
+        bundle = _bundle(files, keys[0] if keys else None, manifest)
+        sources, multiple = [(bundle, bundle.name, None)], False
+    else:
+        # files generated lazily (directory walk, glob, manifest):
+        sources = iter_upload_sources(files, keys, manifest)
+        if skip:
+            if hash_cache is None:
+                raise click.UsageError("--skip-unchanged needs hash cache.")
+            # one files listing of record for all files:
+            try:
+                remote = client.remote_files()
+            except Exception as e:
+                _fatal(ctx, e)
+            sources = skip_unchanged(sources, remote, hash_cache, co['quiet'])
+        first = list(itertools.islice(sources, 2))
+        sources = itertools.chain(first, sources)
+        multiple = len(first) > 1
+    if multiple and engine != 'process':
+        # one worker pool for all files:
+        return _upload_batch(ctx, client, sources, max_files, max_inflight)
     # loop over multiple files:
-    for ifile, key in zip(enumerate(files), keys):
-        i, file = ifile
-        if len(files)>1 and i>0: secho("", nl=True)
+    for i, (file, key, content_type) in enumerate(sources):
+        if multiple and i>0: secho("", nl=True)
         logger.debug(f"{funcname()} file:{file}, key={key}")
         try:
-            oas3 = OARepoS3Client(co['endpoint'], co['token'], parallel, co['quiet'])
-            location, code = oas3.process_click_upload(key, file, nocheck)
-        except (FileNotFoundError, PermissionError,
-                requests.exceptions.ConnectionError, urllib3.exceptions.NewConnectionError) as e:
-            msg, code = e.args if len(e.args) > 1 else (e.args[0], STATUS_UNKNOWN)
-            err_fatal(msg, code)
+            # auto part size of next files uses throughput measured on previous one:
+            result = client.upload(file, key, content_type)
         except Exception as e:
-            msg, code = e.args if len(e.args) > 1 else (e.args[0], STATUS_UNKNOWN)
-            logger.debug(f"Error {code} \"{msg}\"[{type(e)}]")
-            secho(f"Error {code} \"{msg}\"", prefix='ERR', fg='red', quiet=co['quiet'])
-            uploadId = oas3.get_uploadId()
-            if co['noninteractive'] or click.confirm(f"\ntry resume upload?"):
-                try:
-                    oas3 = OARepoS3Client(co['endpoint'], co['token'], parallel, co['quiet'])
-                    location, code = oas3.process_click_resume(key, file, uploadId, nocheck)
-                except Exception as e:
-                    msg, code = e.args if len(e.args) > 1 else (e.args[0], STATUS_UNKNOWN)
-            if code != STATUS_OK:
-                _ask_abort(ctx, oas3, file, key, uploadId, co['noninteractive'])
-                if co['debug']:
-                    raise e
-                else:
-                    err_fatal(msg, code)
-        secho(f"Finished upload key:{key}. [{location}]", prefix='OK', quiet=co['quiet'])
-    if len(files)>1: secho(f"Done.", prefix='OK', quiet=co['quiet'])
+            result = _resume_failed(ctx, client, file, e)
+        secho(f"Finished upload key:{result.key}. [{result.location}]", prefix='OK', quiet=co['quiet'])
+    if bundle: _upload_bundle_index(ctx, bundle, bundle_index)
+    if multiple: secho(f"Done.", prefix='OK', quiet=co['quiet'])
+
+def _resume_failed(ctx, client, file, e):
+    """ upload failed on server resumed (-n, or confirmed), aborted or its resume info printed
+        when resume fails too; result of resumed upload or exit """
+    co = ctx.obj
+    msg, code = error_status(e)
+    uploadId = getattr(e, 'uploadId', None)
+    if uploadId is None:
+        # nothing left on server (file not readable, connection, token):
+        _fatal(ctx, e)
+    secho(f"Error {code} \"{msg}\"", prefix='ERR', fg='red', quiet=co['quiet'])
+    if co['noninteractive'] or click.confirm(f"\ntry resume upload?"):
+        try:
+            return client.resume(file, e.key, uploadId, e.part_size)
+        except Exception as resume_error:
+            ctx.obj['logger'].debug(f"Error [{resume_error}]")
+    _ask_abort(ctx, client, file, e.key, uploadId, e.part_size)
+    _fatal(ctx, e)
+
+def _upload_stream(ctx, client, key):
+    """ stdin read into part buffers and uploaded as they fill (pipe of unknown size) """
+    co = ctx.obj
+    try:
+        result = client.upload_stream(click.get_binary_stream('stdin'), key)
+    except Exception as e:
+        _fatal(ctx, e)
+    secho(f"Finished upload key:{key}. [{result.location}]", prefix='OK', quiet=co['quiet'])
+
+def _upload_bundle_index(ctx, bundle, file=None):
+    """ member index of uploaded bundle as object <key>.index.jsonl (members read by Range requests) """
+    co = ctx.obj
+    key = f"{bundle.name}.index.jsonl"
+    tmp = None
+    if file is None:
+        fd, file = tmp = tempfile.mkstemp(suffix='.index.jsonl')
+        os.close(fd)
+    try:
+        bundle.write_index(file)
+        result = _client(ctx).upload(file, key, 'application/x-ndjson', nocheck=True)
+        secho(f"Finished upload key:{key}. [{result.location}]", prefix='OK', quiet=co['quiet'])
+    except Exception as e:
+        msg, code = error_status(e)
+        err_fatal(f"Bundle index not uploaded: {msg}", code)
+    finally:
+        if tmp is not None: os.unlink(file)
 
 @cli_main.command('resume')
 @click.pass_context
 @click.option('-f', '--file', 'file', required=True, multiple=False, help='file for upload resume')
 @click.option('-k', '--key', help='object key (name) of uploaded file in S3 [default: basename of file]')
-@click.option('-u', '--uploadId', 'uploadId', required=True, help='uploadId returned from upload')
-@click.option('-p', '--parallel', default=0, type=int, show_default=False,
-              help='number of parallel upload streams [default: CPU count]')
+@click.option('-u', '--uploadId', 'uploadId', default=None,
+              help='uploadId returned from upload [default: from upload journal]')
+@click.option('-p', '--parallel', default='0', callback=_parallel_cb, show_default=False,
+              help='number of parallel upload streams or "auto" (adaptive, thread/async engine) [default: CPU count]')
+@click.option('--min-parallel', default=ADAPTIVE_MIN_PARALLEL, type=click.IntRange(min=1), show_default=True,
+              help='--parallel auto: min. parallel upload streams')
+@click.option('--max-parallel', default=ADAPTIVE_MAX_PARALLEL, type=click.IntRange(min=1), show_default=True,
+              help='--parallel auto: max. parallel upload streams')
+@click.option('--engine', default=DEFAULT_ENGINE, type=click.Choice(ENGINES), show_default=True,
+              help='parallel upload engine')
+@click.option('-s', '--part-size', 'part_size', default='auto', show_default=True, callback=_part_size_cb,
+              help='part size in bytes used by upload (see resume info) or "auto"')
+@click.option('--read-ahead', 'read_ahead', default=0, type=click.IntRange(min=0), show_default=True,
+              help='bytes of parts read into memory ahead of upload streams (e.g. for network filesystems)')
+@click.option('--max-bandwidth', default=None, callback=_bandwidth_cb,
+              help='max. bandwidth of all upload streams, bytes/s with optional K/M/G suffix (e.g. 50M) '
+                   '[default: unlimited]')
+@click.option('--bandwidth-schedule', default=None, type=click.Path(exists=True, dir_okay=False),
+              help='time-of-day bandwidth limits, lines "HH:MM-HH:MM <bytes/s>", --max-bandwidth outside of them')
 @click.option('-c', '--nocheck', default=False, is_flag=True, show_default=True,
               help='no automatic checksum test of local and uploaded files')
-def cli_resume(ctx, file, key, uploadId, parallel, nocheck):
+def cli_resume(ctx, file, key, uploadId, parallel, min_parallel, max_parallel, engine, part_size, read_ahead,
+               max_bandwidth, bandwidth_schedule, nocheck):
+    _check_parallel(parallel, engine)
+    bandwidth = _bandwidth(max_bandwidth, bandwidth_schedule, engine)
+    co = ctx.obj
+    co['logger'].debug(f"{funcname()} file={file}, key={key}, uploadId={uploadId}")
     try:
-        co = ctx.obj
-        logger = ctx.obj['logger']
-        logger.debug(f"{funcname()} file={file}, key={key}, uploadId={uploadId}")
-        oas3 = OARepoS3Client(co['endpoint'], co['token'], parallel, co['quiet'])
-        location, code = oas3.process_click_resume(key, file, uploadId, nocheck)
-        secho(f"Done. [{location}]", prefix='OK', quiet=co['quiet'])
+        client = _client(ctx, parallel, engine=engine, part_size=part_size, read_ahead=read_ahead,
+                         min_parallel=min_parallel, max_parallel=max_parallel, bandwidth=bandwidth)
+        result = client.resume(file, key, uploadId, nocheck=nocheck)
     except Exception as e:
-        msg, code = e.args if len(e.args)>1 else (e.args[0], STATUS_UNKNOWN)
-        logger.debug(f"Error [{msg}]")
-        if co['debug']:
-            raise e
-        else:
-            err_fatal(msg, code)
+        _fatal(ctx, e)
+    secho(f"Done. [{result.location}]", prefix='OK', quiet=co['quiet'])
 
 
 @cli_main.command('abort')
@@ -119,54 +348,49 @@ def cli_resume(ctx, file, key, uploadId, parallel, nocheck):
 @click.option('-u', '--uploadId', 'uploadId', required=True, help='uploadId returned from upload')
 def cli_abort(ctx, key, uploadId):
     try:
-        co = ctx.obj
-        logger = ctx.obj['logger']
-        oas3 = OARepoS3Client(co['endpoint'], co['token'], False, co['quiet'], key=key)
-        oas3.set_uploadId(uploadId)
-        oas3.abort_upload()
+        _client(ctx).abort(key, uploadId)
     except Exception as e:
-        msg, code = e.args if len(e.args)>1 else (e.args[0], STATUS_UNKNOWN)
-        logger.debug(f"Error [{msg}]")
-        if co['debug']:
-            raise e
-        else:
-            err_fatal(msg, code)
+        _fatal(ctx, e)
 
 
 @cli_main.command('revoke')
 @click.pass_context
 def cli_revoke(ctx):
     try:
-        co = ctx.obj
-        logger = ctx.obj['logger']
-        oas3 = OARepoS3Client(co['endpoint'], co['token'], False, co['quiet'])
-        oas3.revoke_token()
+        _client(ctx).revoke()
     except Exception as e:
-        msg, code = e.args if len(e.args)>1 else (e.args[0], STATUS_UNKNOWN)
-        logger.debug(f"Error [{msg}]")
-        if co['debug']:
-            raise e
-        else:
-            err_fatal(msg, code)
+        _fatal(ctx, e)
 
 
 @cli_main.command('check')
 @click.pass_context
 @click.option('-f', '--file', 'file', required=True, multiple=False, help='uploaded file to check')
 @click.option('-k', '--key', help='object key (name) of uploaded file in S3 [default: basename of file]')
-def cli_check(ctx, file, key):
+@click.option('-p', '--parallel', default=0, type=int, show_default=False,
+              help='number of parallel checksum workers [default: CPU count]')
+@click.option('--bundle', default=False, is_flag=True, show_default=True,
+              help='file is directory uploaded by upload --bundle')
+def cli_check(ctx, file, key, parallel, bundle):
+    if bundle: file = _bundle([file], key)
     try:
-        co = ctx.obj
-        logger = ctx.obj['logger']
-        oas3 = OARepoS3Client(co['endpoint'], co['token'], False, co['quiet'])
-        result, code = oas3.process_click_check(key, file)
+        result = _client(ctx, parallel, _hash_cache(ctx)).check(file, key)
     except Exception as e:
-        msg, code = e.args if len(e.args)>1 else (e.args[0], STATUS_UNKNOWN)
-        logger.debug(f"Error [{msg}]")
-        if co['debug']:
-            raise e
-        else:
-            err_fatal(msg, code)
+        _fatal(ctx, e)
+    if not result.match:
+        err_fatal(f"Local and remote files differ.", STATUS_GENERAL_ERROR)
+
+
+@cli_main.command('download')
+@click.pass_context
+@click.option('-k', '--key', required=True, help='object key (name) of uploaded file in S3')
+@click.option('-f', '--file', 'file', help='local file to write [default: basename of key]')
+@click.option('-p', '--parallel', default=0, type=int, show_default=False,
+              help='number of parallel download streams [default: CPU count]')
+def cli_download(ctx, key, file, parallel):
+    try:
+        _client(ctx, parallel).download(key, file)
+    except Exception as e:
+        _fatal(ctx, e)
 
 
 @cli_main.command('debug_test', hidden=True)
@@ -185,14 +409,42 @@ def cli_debug_test(ctx):
             err_fatal(e)
 
 
-def _ask_abort(ctx, oas3, file, key, uploadId, noninteractive):
+def _upload_batch(ctx, client, files, max_files, max_inflight):
     co = ctx.obj
-    if noninteractive or click.confirm(f"\ncall abort_upload? (resume will not be possible)"):
-        oas3.set_uploadId(uploadId)
-        oas3.abort_upload()
+    logger = ctx.obj['logger']
+    try:
+        results = client.upload_many(files, max_files, max_inflight)
+    except Exception as e:
+        _fatal(ctx, e)
+    failed = 0
+    for res in results:
+        if res.ok: continue
+        if res.uploadId is not None and (co['noninteractive'] or click.confirm(f"\ntry resume upload of {res.file}?")):
+            try:
+                result = client.resume(res.file, res.key, res.uploadId, res.part_size)
+                secho(f"Finished upload key:{result.key}. [{result.location}]", prefix='OK', quiet=co['quiet'])
+                continue
+            except Exception as e:
+                logger.debug(f"Error [{e}]")
+        failed += 1
+        if res.uploadId is not None: _ask_abort(ctx, client, res.file, res.key, res.uploadId, res.part_size)
+    if failed > 0:
+        err_fatal(f"{failed} of {len(results)} file(s) not uploaded.", STATUS_UPLOAD_UNCOMPLETED)
+    secho(f"Done.", prefix='OK', quiet=co['quiet'])
+
+
+def _ask_abort(ctx, client, file, key, uploadId, part_size=None):
+    co = ctx.obj
+    if co['noninteractive'] or click.confirm(f"\ncall abort_upload? (resume will not be possible)"):
+        try:
+            client.abort(key, uploadId)
+        except Exception as e:
+            msg, code = error_status(e)
+            secho(f"Error {code} \"{msg}\"", prefix='ERR', fg='red', quiet=co['quiet'])
     else:
         secho(f'abort_upload skipped.\n resume info:')
-        secho(f'   -f "{file}" -k "{key}" -u "{uploadId}"')
+        part_size = f' -s {part_size}' if part_size else ''
+        secho(f'   -f "{file}" -k "{key}" -u "{uploadId}"{part_size}')
 
 
 if __name__ == '__main__':
@@ -6,20 +6,68 @@
 # it under the terms of the MIT License; see LICENSE file for more details.
 """ OARepo S3 client constants. """
 
+import os
 import multiprocessing as mp
 
 MIB_5 = 5*1024*1024
 MIN_PART_SIZE = MIB_5
+SMALL_FILE_SIZE = MIN_PART_SIZE   # files up to this size uploaded in one request (no worker pool)
+DIRECT_UNSUPPORTED = (404, 405, 501)    # direct upload (PUT to files API) not available
 MID_PART_SIZE = MIB_5 * 5
+STREAM_PART_SIZE = 8*1024*1024  # stream of unknown size: first part size (auto)
+STREAM_GROWTH_PARTS = 1000      # stream: part size doubled every that many parts (MAX_PARTS kept to 5 TiB)
 MAX_PART_SIZE = MIB_5 * 50
+MAX_S3_PART_SIZE = 5*1024*1024*1024
+PART_SIZE_ALIGN = 1024*1024
+PARTS_PER_STREAM = 4   # auto part size: min. parts per parallel stream
+PART_TARGET_SECS = 4   # auto part size: min. part transfer time (with known throughput)
 MAX_PARTS = 10240
 MAX_PARALLEL = mp.cpu_count()
+ENGINES = ('process', 'thread', 'async')
+ADAPTIVE_MIN_PARALLEL = 2      # --parallel auto: bounds and start of part streams
+ADAPTIVE_MAX_PARALLEL = 64
+ADAPTIVE_START_PARALLEL = 4
+ADAPTIVE_WINDOW = 2            # --parallel auto: min. seconds between decisions
+ADAPTIVE_TOLERANCE = 0.05      # --parallel auto: throughput change treated as noise
+ADAPTIVE_LATENCY_RISE = 2      # --parallel auto: per-byte latency rise over best seen
+DEFAULT_ENGINE = 'thread'
 MAX_RETRIES = 5
+MAX_THROTTLED_RETRIES = 10   # retries of throttled (429, 503 SlowDown) requests
 BATCH_PRESIGNS = 200
 MAX_PRESIGNS = 400
+PRESIGN_LOW_WATER = 50        # presign prefetch: min. URLs kept ahead
+PRESIGN_RATE_WINDOW = 100     # presign prefetch: consumption rate over last N parts
+PRESIGN_EXPIRES = 3600        # presigned URL validity if not in URL
+PRESIGN_EXPIRY_MARGIN = 60    # presigned URL treated as expired this early
+PRESIGN_WAIT_TIMEOUT = 60     # worker wait for presigned URL
+PRESIGN_CHECK_INTERVAL = 1    # prefetcher expiry check interval
+BATCH_MAX_FILES = 8          # batch upload: files in flight
+BATCH_MAX_BYTES = 2*1024*1024*1024   # batch upload: bytes of parts in flight
+BATCH_CONTROL_THREADS = 2    # batch upload: threads for init/presign/complete requests
+STREAM_CHUNK_SIZE = 1024*1024   # part body streaming block
+READAHEAD_THREADS = 2   # read-ahead stage: reader threads
+HTTP_POOL_HOSTS = 4   # hosts kept in session connection pool (endpoint, S3 gateway, ...)
+STATE_DIR = os.path.join(os.environ.get('XDG_STATE_HOME') or os.path.expanduser('~/.local/state'),
+                         'oarepo-s3-cli')   # upload journals
+JOURNAL_MAX_AGE = 24*3600   # older journal is reconciled with uploaded parts listed by server
 
 CYCLE_SLEEP = 1    # progress bar refresh interval
+PROGRESS_INTERVAL = 1     # --progress json: seconds between progress events
+PROGRESS_RATE_WINDOW = 5  # --progress json: seconds of instantaneous throughput
+METRICS_INTERVAL = 15     # metrics textfile: seconds between writes
+METRICS_PART_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)   # part upload seconds
+METRICS_PRESIGN_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)    # presign request seconds
+PROFILE_SLOWEST = 5   # --profile: slowest parts in report
 RETRY_SLEEP = 2    # sleep(RETRY_SLEEP * retry)
+RETRY_BASE_SLEEP = 0.5   # retry backoff: random sleep up to RETRY_BASE_SLEEP * 2**retry
+RETRY_MAX_SLEEP = 30     # retry backoff cap (Retry-After too)
+RETRY_BUDGET_RATIO = 0.2   # retry budget: retries per request
+RETRY_BUDGET_MIN = 100     # retry budget: reserve (and cap) of retries
+RETRY_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+PART_TIMEOUT = 3600   # part PUT timeout
+BANDWIDTH_BURST = 0.25     # bandwidth limit: seconds of rate saved up by idle streams
+BANDWIDTH_CHUNK_SIZE = 64*1024   # bandwidth limit: block of part body sent at once
+BANDWIDTH_SCHEDULE_CHECK = 10    # bandwidth schedule: seconds between rate lookups
 PRESIGN_REQ_SLEEP =1
 SLOWDOWN_SLEEP = 4
 MON_TIMEOUT = 300
@@ -40,3 +88,5 @@ STATUS_INVALID_TOKEN=8
 STATUS_WRONG_SERVER_RESPONSE=9
 STATUS_UNKNOWN=10
 STATUS_UPLOAD_UNCOMPLETED=11
+STATUS_WRONG_PART_SIZE=12
+STATUS_WRONG_BANDWIDTH=13
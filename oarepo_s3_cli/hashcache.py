@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+""" OARepo S3 client local hash cache. """
+
+import os, sqlite3, threading
+from os import path
+
+from oarepo_s3_cli.utils import get_multipart_etag, secho
+
+# part size of whole file MD5 (object uploaded in one request or one part):
+WHOLE_FILE = 0
+
+
+class HashCache(object):
+    """ multipart ETags of local files by part size (WHOLE_FILE: MD5 of file) in sqlite db in state dir,
+        keyed by file identity (device, inode, size, mtime_ns) - changed file is a new entry """
+    def __init__(self, state_dir):
+        os.makedirs(state_dir, exist_ok=True)
+        self.path = path.join(state_dir, 'hashes.sqlite')
+        self.lock = threading.Lock()
+        self.db = None
+
+    def __getstate__(self):
+        # connection not pickled - worker processes open their own:
+        return dict(path=self.path)
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self.lock = threading.Lock()
+        self.db = None
+
+    def connect(self):
+        if self.db is None:
+            self.db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS hashes (dev INTEGER, ino INTEGER, size INTEGER, '
+                            'mtime_ns INTEGER, part_size INTEGER, etag TEXT, '
+                            'PRIMARY KEY (dev, ino, size, mtime_ns, part_size))')
+        return self.db
+
+    @staticmethod
+    def identity(file):
+        st = os.stat(file)
+        return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+    def etags(self, file):
+        """ {part size: ETag} of file """
+        with self.lock:
+            rows = self.connect().execute('SELECT part_size, etag FROM hashes WHERE dev=? AND ino=? AND size=? '
+                                          'AND mtime_ns=?', self.identity(file)).fetchall()
+        return dict(rows)
+
+    def get(self, file, part_size):
+        return self.etags(file).get(part_size)
+
+    def put(self, file, part_size, etag):
+        with self.lock:
+            db = self.connect()
+            db.execute('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)',
+                       self.identity(file) + (part_size, etag))
+            db.commit()
+
+    def put_parts(self, file, part_size, parts, num_parts):
+        """ ETags of file from MD5s of all its parts (computed during upload) """
+        md5s = [part.get('MD5') for part in sorted(parts, key=lambda part: part['PartNumber'])]
+        if len(md5s) != num_parts or None in md5s: return
+        self.put(file, part_size, get_multipart_etag(md5s))
+        if num_parts == 1: self.put(file, WHOLE_FILE, md5s[0])
+
+    def matches(self, file, checksum):
+        """ remote checksum ("md5:<hex>", "etag:<multipart ETag>" or bare) is a cached hash of file """
+        if checksum is None: return False
+        checksum = checksum.split(':', 1)[-1].strip('"')
+        return checksum in self.etags(file).values()
+
+    def close(self):
+        with self.lock:
+            if self.db is not None: self.db.close()
+            self.db = None
+
+
+def skip_unchanged(sources, remote, cache, quiet=False):
+    """ sources (file, key, content type) without files of the same size and cached hash as remote
+        object of their key, remote: {key: (size, checksum)} """
+    for file, key, content_type in sources:
+        entry = remote.get(key if key else path.basename(file))
+        try:
+            unchanged = entry is not None and entry[0] == path.getsize(file) and cache.matches(file, entry[1])
+        except OSError:
+            unchanged = False   # missing file fails in upload
+        if unchanged:
+            secho(f"Skipping unchanged file {file} (key {key or path.basename(file)}).", prefix='OK', quiet=quiet)
+            continue
+        yield file, key, content_type
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+""" OARepo S3 client upload journal. """
+
+import hashlib, json, os, time
+from os import path
+
+
+class Journal(object):
+    """ append-only JSONL journal of one upload: uploadId, part plan, file identity
+        and uploaded parts, one file per (files url, key, local file) in state dir """
+    def __init__(self, state_dir, urlFiles, key, file):
+        os.makedirs(state_dir, exist_ok=True)
+        name = hashlib.sha1(f"{urlFiles}\n{key}\n{path.abspath(file)}".encode()).hexdigest()
+        self.path = path.join(state_dir, f"{name}.jsonl")
+
+    @staticmethod
+    def identity(file):
+        # bundle (tar generated on the fly) - identity of its members:
+        if hasattr(file, 'identity'): return file.identity()
+        st = os.stat(file)
+        return dict(size=st.st_size, mtime_ns=st.st_mtime_ns, ino=st.st_ino, dev=st.st_dev)
+
+    def write(self, rec, mode='a'):
+        # no open file handle kept - journal is pickled with client by process engine
+        rec['ts'] = time.time()
+        with open(self.path, mode) as fh:
+            fh.write(json.dumps(rec) + '\n')
+            fh.flush()
+
+    def start(self, uploadId, plan, file):
+        self.write(dict(type='init', uploadId=uploadId, plan=plan, identity=self.identity(file)), mode='w')
+
+    def add_part(self, part):
+        self.write(dict(type='part', PartNumber=part['PartNumber'], ETag=part['ETag'], MD5=part.get('MD5')))
+
+    def load(self):
+        """ (init record, {partNum: part}, time of last record) or None """
+        if not path.exists(self.path):
+            return None
+        init, parts, ts = None, {}, 0
+        with open(self.path, 'r') as fh:
+            for line in fh:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    break   # torn last line of interrupted write
+                ts = rec.get('ts', ts)
+                if rec['type'] == 'init':
+                    init, parts = rec, {}
+                elif rec['type'] == 'part':
+                    parts[rec['PartNumber']] = dict(PartNumber=rec['PartNumber'], ETag=rec['ETag'], MD5=rec['MD5'])
+        return (init, parts, ts) if init is not None else None
+
+    def remove(self):
+        if path.exists(self.path):
+            os.unlink(self.path)
+
+    @staticmethod
+    def remove_upload(state_dir, uploadId):
+        """ removes journals of upload (abort without local file) """
+        if not path.isdir(state_dir):
+            return
+        for name in os.listdir(state_dir):
+            file = path.join(state_dir, name)
+            if not name.endswith('.jsonl'): continue
+            with open(file, 'r') as fh:
+                try:
+                    init = json.loads(fh.readline())
+                except ValueError:
+                    continue
+            if init.get('uploadId') == uploadId:
+                os.unlink(file)
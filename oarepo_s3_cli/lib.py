@@ -7,19 +7,27 @@
 
 """ OARepo S3 client lib. """
 
-import hashlib, re, socket
+import contextlib, re, sqlite3
 from os import path
 import time, requests, json, logging
-from urllib3.exceptions import NewConnectionError
 import multiprocessing as mp
+from multiprocessing.pool import ThreadPool
 
 from oarepo_s3_cli.utils import *
 from oarepo_s3_cli.constants import *
-from oarepo_s3_cli.parallels import Parallels
+from oarepo_s3_cli.parallels import Parallels, AdaptiveLimit
+from oarepo_s3_cli.journal import Journal
+from oarepo_s3_cli.bundle import TarBundle
+from oarepo_s3_cli.bandwidth import ThrottledBody
+from oarepo_s3_cli.progress import Progress
+from oarepo_s3_cli.profile import PartSpans
+from oarepo_s3_cli.retry import *
 
 # logging.basicConfig(level=logging.DEBUG)
 # logger = logging.getLogger(__name__)
 logger = logging
+# files APIs without direct upload (PUT of whole file), small files go multipart there:
+_no_direct_upload = set()
 # logger.addHandler(logging.NullHandler())
 # logger.setLevel(logging.INFO)
 # ch = logging.StreamHandler()
@@ -28,31 +36,112 @@ logger = logging
 
 class OARepoS3Client(object):
     """ """
-    def __init__(self, url, token, parallel=1, quiet=False, key=None):
+    def __init__(self, url, token, parallel=1, quiet=False, key=None, engine=DEFAULT_ENGINE,
+                 part_size='auto', throughput=None, urlFiles=None, state_dir=None, read_ahead=0,
+                 min_parallel=ADAPTIVE_MIN_PARALLEL, max_parallel=ADAPTIVE_MAX_PARALLEL, bandwidth=None,
+                 progress=None, metrics=None, profile=None, hash_cache=None, session=None, signals=True):
         self.url = url
-        # don't use certificates on localhost:
-        self.https_verify = not re.match(f"^https://127\\.0\\.0\\.1:", url)
+        self.https_verify = get_https_verify(url)
         self.token = token
-        self.parallel = MAX_PARALLEL if parallel == 0 else parallel
         self.quiet = quiet
+        self.engine = engine
+        self.limiter = None
+        # injected session (embedding application), signal handlers of CLI:
+        self._session = session
+        self.signals = signals
+        if parallel == 'auto':
+            if engine == 'process':
+                raise Exception("Adaptive parallel streams (auto) need thread or async engine.", STATUS_GENERAL_ERROR)
+            # pool of max_parallel workers, streams in flight limited by AIMD:
+            self.limiter = AdaptiveLimit(min_parallel, max_parallel)
+            parallel = self.limiter.high
+        self.parallel = MAX_PARALLEL if parallel == 0 else parallel
+        self.part_size_opt = part_size
+        self.throughput = throughput
+        self.plan = None
         self.key = key
         self.file = None
         self.contentType = 'application/octet-stream'
         self.parts, self.parts_unfin, self.uploadId, self.output = [], [], None, ''
-        self.urlFiles = self.check_token_status(self.token)
+        self.retry = RetryPolicy()
+        self.urlFiles = urlFiles if urlFiles is not None else self.check_token_status(self.token)
         self.checksum = None
+        self.local_checksum = None
         self.presigns = None
+        self.read_ahead = read_ahead
+        self.reader = None
+        self.stream = None
+        self.bandwidth = bandwidth
+        self.progress_stream = progress
+        self.progress = None
+        self.metrics = metrics
+        self.profile = profile
+        self.profile_file = None
         self.nocheck = True
+        self.state_dir = state_dir
+        self.journal = None
+        self.hash_cache = hash_cache
+        self.small_size = SMALL_FILE_SIZE
+        self.ended = False
+        # outcome of last check (None: not compared):
+        self.checked = None
+
+    @property
+    def session(self):
+        # not pickled with the client - each worker process keeps its own connection pool,
+        # thread/async engines share one
+        if self._session is not None: return self._session
+        return get_session(self.parallel)
 
     def process_click_upload(self, key=None, file=None, nocheck=True):
         self.nocheck = nocheck
         self.set_file(file, key)
+        self.set_journal()
+        if self.is_small():
+            return self.upload_small()
+        if not self.load_journal():
+            self.init_upload()
+        return self.do_upload()
+
+    def is_small(self):
+        return self.num_parts == 1 and self.data_size <= self.small_size
+
+    def upload_small(self):
+        """ small file: one PUT to files API where server has direct upload, multipart upload of one
+            part sent by this process (no worker pool) otherwise """
+        if self.load_journal():
+            return self.do_upload()
+        if self.urlFiles not in _no_direct_upload:
+            location = self.upload_direct()
+            if location is not None:
+                return location, STATUS_OK
         self.init_upload()
         return self.do_upload()
 
-    def process_click_resume(self, key, file, uploadId, nocheck=True):
+    def process_click_stream(self, key, stream, nocheck=True, name='-'):
+        """ upload of stream of unknown size (pipe, stdin), binary file object with readinto """
+        self.nocheck = nocheck
+        self.set_stream(stream, key, name)
+        self.stream.read()
+        if self.stream.eof:
+            # whole stream in first part - size known, uploaded like file:
+            self.data_size = self.stream.size
+            self.set_plan(self.data_size)
+            if self.is_small():
+                return self.upload_small()
+            self.init_upload()
+            return self.do_upload()
+        return self.upload_stream()
+
+    def process_click_resume(self, key, file, uploadId=None, nocheck=True):
         self.nocheck = nocheck
         self.set_file(file, key)
+        self.set_journal()
+        if self.load_journal(uploadId):
+            return self.do_upload()
+        if uploadId is None:
+            raise Exception(f"No upload journal found for file {self.file} (key {self.key}), uploadId required.",
+                            STATUS_GENERAL_ERROR)
         self.set_uploadId(uploadId)
         # parts = self.get_parts()
         self.scan_parts()
@@ -68,21 +157,51 @@ class OARepoS3Client(object):
             if self.results[partNum-1] is None:
                 self.parts_unfin.append(partNum)
         logger.debug(f"{funcname()} parts_unfin:\n{self.parts_unfin}")
-        self.presigns = SharedList(self.presign_parts_upload, self.parts_unfin, BATCH_PRESIGNS, MAX_PRESIGNS)
+        if len(self.parts_unfin) <= 1:
+            # one part - uploaded by this process, presigned on the way:
+            self.presigns = SharedList(self.presign_parts_upload, self.parts_unfin, BATCH_PRESIGNS, MAX_PRESIGNS,
+                                       shared=False)
+        elif self.engine == 'process':
+            self.presigns = SharedList(self.presign_parts_upload, self.parts_unfin, BATCH_PRESIGNS, MAX_PRESIGNS)
+        else:
+            # presigned ahead by own thread, workers wait for their URL:
+            self.presigns = PresignPrefetcher(self.presign_parts_upload, self.parts_unfin, BATCH_PRESIGNS,
+                                              MAX_PRESIGNS)
+            if self.read_ahead > 0 and len(self.parts_unfin) > 0 and not isinstance(self.file, TarBundle):
+                # parts read into memory ahead of senders (disk and network overlap):
+                self.reader = PartReader(self.file, self.parts_unfin, self.get_part_range, self.read_ahead)
         # ###
         # secho(f"parts_unfin:{self.parts_unfin}", prefix='DBG', fg='red')
         # secho(f"parts_unfin.join:{'#'.join(map(str,self.parts_unfin))}", prefix='DBG', fg='red')
         try:
             # parts_unfin = range(1, self.num_parts + 1)
             st = STATUS_OK
-            if len(self.parts_unfin) > 0:
+            self.report_begin()
+            if len(self.parts_unfin) == 1:
+                self.presings_supply(MAX_PRESIGNS)
+                st, newparts = self.upload_single(self.parts_unfin[0])
+                self.parts += newparts
+            elif len(self.parts_unfin) > 0:
                 self.presings_supply(MAX_PRESIGNS)
+                # progress bar replaced by progress events on stdout:
+                quiet = self.quiet or (self.progress_stream is not None and self.progress_stream.stdout)
                 self.parallels = Parallels(
                     self.upload_part, self.presings_supply,
-                    self.num_parts, self.parts_unfin, parallel=self.parallel, quiet=self.quiet
+                    self.num_parts, self.parts_unfin, parallel=self.parallel, quiet=quiet,
+                    engine=self.engine, result_callback=self.part_done, error_callback=self.part_failed,
+                    signals=self.signals, bandwidth=self.bandwidth, worker_timeout=self.worker_timeout()
                 )
-                st, newparts = self.parallels.main()
+                start = time.time()
+                if self.metrics is not None: self.metrics.watch(self.parallels.stats)
+                try:
+                    st, newparts = self.parallels.main()
+                finally:
+                    if self.metrics is not None: self.metrics.unwatch(self.parallels.stats)
+                if self.limiter is not None:
+                    secho(self.limiter.summary(), prefix='\nOK', quiet=self.quiet)
                 self.parts += newparts
+                sent = sum(self.part_size if pn < self.num_parts else self.last_size for pn in self.parts_unfin)
+                self.throughput = sent / max(time.time() - start, 1)
                 # ###
                 # secho(f'\n>---- list:', quiet=self.quiet)
                 # for i in self.presigns.iter():
@@ -92,49 +211,138 @@ class OARepoS3Client(object):
                 logger.debug(f"{funcname()} parts:\n{self.parts}")
                 location = self.complete_upload()
                 if not self.nocheck: self.process_click_check()
+                self.report_end(STATUS_OK, location)
                 return location, STATUS_OK
             else:
                 raise Exception(f"Upload failed with status {st}.", st)
         except Exception as e:
             logger.debug(f"{funcname()} caught and raising Exception \"{e}\" {procname()}")
+            msg, code = e.args if len(e.args) > 1 else (str(e), STATUS_UNKNOWN)
+            self.report_end(code, message=str(msg))
             raise e
+        finally:
+            self.presigns.close()
+            if self.reader is not None:
+                self.reader.close()
+                self.reader = None
 
     def process_click_check(self, key=None, file=None):
+        if self.stream is not None: return self.check_stream()
         if self.file is None or self.key is None: self.set_file(file, key, showInfo=False)
         msg = f"Checking file uploaded as key {self.key} with local file {self.file} ..."
         secho(f"{msg}", quiet=self.quiet)
         urlFile = f"{self.urlFiles}{self.key}"
-        if self.checksum is None:
+        cached = self.hash_cache is not None and isinstance(self.file, str)
+        if cached and self.checksum is None:
+            # remote checksum from files listing matching a cached hash - nothing read:
+            entry = self.get_remote_files().get(self.key)
+            if entry is not None and entry[0] == self.data_size and self.cache_call('matches', entry[1]):
+                secho(f"Local and remote files have the same checksum (hash cache).", prefix='OK', quiet=self.quiet)
+                self.checked = True
+                return True, STATUS_OK
+        remote_hash = self.checksum
+        if remote_hash is None and self.local_checksum is not None:
+            etags = [part['ETag'] for part in self.get_uploaded_parts()]
+            # MD5 part ETags were verified against local part MD5s during upload, opaque ones
+            # (SSE-KMS, gateways) were not - remote file read then:
+            if all(is_md5(etag) for etag in etags): remote_hash = get_multipart_etag(etags)
+        if remote_hash is None:
             secho("downloading remote file ...", quiet=self.quiet)
-            pool = mp.Pool(1)
-            fut_rem = pool.apply_async(get_remote_hash, args=(self.token, urlFile, self.part_size,))
+            # remote ranges downloaded (by own threads) concurrently with local checksum:
+            pool = ThreadPool(1)
+            fut_rem = pool.apply_async(get_remote_hash, args=(self.token, urlFile, self.part_size, self.parallel,
+                                                              self._session, self.retry))
             pool.close()
         else:
-            secho(f"using ETag as remote checksum: {self.checksum}", quiet=self.quiet)
-
-        secho("calculating local checksum ...", quiet=self.quiet)
-        local_hash = get_local_hash(self.file, self.part_size)
+            secho(f"using ETag as remote checksum: {remote_hash}", quiet=self.quiet)
+
+        local_hash = self.cache_call('get', self.part_size) if cached else None
+        if self.local_checksum is not None:
+            secho("using local checksum computed during upload ...", quiet=self.quiet)
+            local_hash = self.local_checksum
+        elif local_hash is not None:
+            secho("using local checksum from hash cache ...", quiet=self.quiet)
+        else:
+            secho("calculating local checksum ...", quiet=self.quiet)
+            local_hash = self.file.get_hash(self.part_size, self.parallel) if isinstance(self.file, TarBundle) \
+                else get_local_hash(self.file, self.part_size, self.parallel)
+            if cached: self.cache_call('put', self.part_size, local_hash)
         logger.debug(f"\n local checksum: {local_hash}")
         # return True, STATUS_OK
 
-        if self.checksum is None:
+        if remote_hash is None:
             pool.join()
             remote_hash = fut_rem.get()
-        else:
-            remote_hash = self.checksum
 
         logger.debug(f"\n remote checksum: {remote_hash}")
         if local_hash==remote_hash:
             secho(f"Local and remote files have the same checksum.",
                 prefix='OK', quiet=self.quiet)
+            self.checked = True
             return True, STATUS_OK
         # return False, STATUS_GENERAL_ERROR
+        self.checked = False
         raise Exception(f"Local and remote files differ.", STATUS_GENERAL_ERROR)
 
+    def process_click_download(self, key, file=None):
+        self.key = key
+        self.file = file if not (file is None or file == '') else path.basename(key)
+        urlFile = f"{self.urlFiles}{self.key}"
+        secho(f"Downloading key {self.key} to file {self.file} using up to {self.parallel} parallel stream(s) ...",
+              quiet=self.quiet)
+        fd = os.open(self.file, os.O_WRONLY | os.O_CREAT, 0o666)
+        try:
+            hashes = get_remote_parts(self.token, urlFile, 0, self.parallel, fd, self._session, self.retry)
+            if hashes is None:
+                # no Range support - one stream:
+                headers = {'Authorization': f"Bearer {self.token}"}
+                resp = self.retry.request(self.session.get, urlFile, stream=True, headers=headers,
+                                          verify=self.https_verify)
+                with resp:
+                    if resp.status_code >= 400:
+                        raise Exception(f"Can't read remote file (http code {resp.status_code}).",
+                                        STATUS_WRONG_SERVER_RESPONSE)
+                    os.ftruncate(fd, 0)
+                    for chunk in resp.iter_content(STREAM_CHUNK_SIZE):
+                        os.write(fd, chunk)
+        finally:
+            os.close(fd)
+        self.data_size = path.getsize(self.file)
+        secho(f"Downloaded {size_fmt(self.data_size)}. ({self.file})", prefix='OK', quiet=self.quiet)
+        return self.file, STATUS_OK
+
+    def get_remote_files(self):
+        """ {key: (size, checksum)} of record files (files API listing), {} if not listed """
+        headers = {'Authorization': f"Bearer {self.token}"}
+        try:
+            resp = self.retry.request(self.session.get, self.urlFiles, headers=headers, verify=self.https_verify)
+            if resp.status_code != 200: return {}
+            rjson = resp.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.debug(f"{funcname()} files listing failed: {e}")
+            return {}
+        entries = rjson.get('entries', []) if isinstance(rjson, dict) else rjson
+        return {entry['key']: (entry.get('size'), entry.get('checksum'))
+                for entry in entries if isinstance(entry, dict) and 'key' in entry}
+
+    def cache_call(self, method, *args):
+        """ hash cache method on self.file, None if cache not usable """
+        try:
+            return getattr(self.hash_cache, method)(self.file, *args)
+        except (OSError, sqlite3.Error) as e:
+            # hash cache is an optimization only:
+            logger.debug(f"{funcname()} hash cache {method} failed: {e}")
+            return None
+
+    def cache_hashes(self):
+        """ hashes of uploaded file from part MD5s (skip of unchanged file, check) """
+        if self.hash_cache is None or not isinstance(self.file, str) or self.stream is not None: return
+        self.cache_call('put_parts', self.part_size, self.get_uploaded_parts(), self.num_parts)
+
     def check_token_status(self, token):
         token_status_url = f"{self.url}/access-tokens/status"
         headers = { 'Authorization': f"Bearer {token}" }
-        resp = requests.get(token_status_url, headers=headers, verify=self.https_verify)
+        resp = self.retry.request(self.session.get, token_status_url, headers=headers, verify=self.https_verify)
         if resp.status_code != 200:
             raise PermissionError(f"Invalid token (http code {resp.status_code})", STATUS_INVALID_TOKEN)
         resp_json = resp.json()
@@ -152,6 +360,8 @@ class OARepoS3Client(object):
 
 
     def set_file(self, file=None, key=None, showInfo=True):
+        if isinstance(file, TarBundle):
+            return self.set_bundle(file, key, showInfo)
         if file is None or not path.exists(file) or not path.isfile(file):
             raise FileNotFoundError(f"File not found ({file})", STATUS_WRONG_FILE)
         if not os.access(file, os.R_OK):
@@ -159,18 +369,153 @@ class OARepoS3Client(object):
         self.file = file
         self.key = key if not (key is None or key=='') else path.basename(file)
         self.data_size = path.getsize(file)
-        self.num_parts, self.part_size, self.last_size = get_file_chunk_size(self.data_size)
-        self.results = [None for i in range(self.num_parts)]
+        self.set_plan(self.part_size_opt)
         if showInfo:
             msg = f"Uploading file {file} {'' if self.key=='' else f'as key {self.key}'}\n" \
                 f"    in {self.num_parts} part(s)" \
-                f" using up to {self.parallel} parallel stream(s)," \
+                f" using up to {self.parallel} parallel stream(s) ({self.engine}{', adaptive' if self.limiter else ''})," \
                 f" part size: {self.part_size}, last part size: {self.last_size} ..."
             secho(f"{msg}", quiet=self.quiet)
 
+    def set_bundle(self, bundle, key=None, showInfo=True):
+        """ tar archive of many files generated on the fly uploaded as one object """
+        self.file = bundle
+        self.key = key if not (key is None or key=='') else bundle.name
+        self.data_size = bundle.size
+        self.contentType = 'application/x-tar'
+        self.set_plan(self.part_size_opt)
+        if showInfo:
+            secho(f"Uploading {len(bundle.members)} file(s) bundled as key {self.key} ({size_fmt(self.data_size)})\n"
+                  f"    in {self.num_parts} part(s) using up to {self.parallel} parallel stream(s),"
+                  f" part size: {self.part_size}, last part size: {self.last_size} ...", quiet=self.quiet)
+
+    def set_stream(self, stream, key, name='-'):
+        """ stream parts read into memory as upload goes, up to parallel + 1 of them """
+        if key is None or key == '':
+            raise Exception(f"Object key required for upload of stream.", STATUS_WRONG_FILE)
+        part_size = STREAM_PART_SIZE if self.part_size_opt == 'auto' else self.part_size_opt
+        if part_size < MIN_PART_SIZE or part_size > MAX_S3_PART_SIZE:
+            raise Exception(f"Part size {part_size} out of range ({MIN_PART_SIZE}-{MAX_S3_PART_SIZE})",
+                            STATUS_WRONG_PART_SIZE)
+        self.file = name
+        self.key = key
+        self.data_size = None
+        self.num_parts, self.part_size, self.last_size = 0, part_size, None
+        self.results = []
+        self.plan = None
+        # nothing to resume - stream can't be read again:
+        self.journal = None
+        self.stream = self.reader = StreamReader(stream, part_size, self.parallel + 1)
+        secho(f"Uploading stream {name} as key {self.key} using up to {self.parallel} parallel stream(s),"
+              f" part size: {part_size} (growing) ...", quiet=self.quiet)
+
+    def set_plan(self, part_size='auto'):
+        if part_size == 'auto':
+            part_size = plan_part_size(self.data_size, self.parallel, self.throughput)
+        self.num_parts, self.part_size, self.last_size = get_file_chunk_size(self.data_size, part_size)
+        self.results = [None for i in range(self.num_parts)]
+        # recorded plan - resume must use the same part size:
+        self.plan = dict(part_size=self.part_size, num_parts=self.num_parts, last_size=self.last_size,
+                         parallel=self.parallel, throughput=self.throughput)
+        logger.debug(f"{funcname()} plan: {self.plan}")
+
+    def set_journal(self):
+        self.journal = None
+        if self.state_dir is None: return
+        try:
+            self.journal = Journal(self.state_dir, self.urlFiles, self.key, self.file)
+        except OSError as e:
+            # journal is an optimization only - upload goes on without it:
+            secho(f"Upload journal not available ({e}).", prefix='WARN', fg='yellow', quiet=self.quiet)
+
+    def load_journal(self, uploadId=None):
+        """ plan and parts of interrupted upload of the same file from journal, False if none """
+        if self.journal is None: return False
+        try:
+            rec = self.journal.load()
+            if rec is None: return False
+            init, parts, ts = rec
+            if uploadId is not None and init['uploadId'] != uploadId: return False
+            if init['identity'] != Journal.identity(self.file):
+                secho(f"File {self.file} changed since upload {init['uploadId']} started, journal ignored.",
+                      prefix='WARN', fg='yellow', quiet=self.quiet)
+                return False
+        except (OSError, ValueError, KeyError) as e:
+            secho(f"Upload journal not readable ({e}).", prefix='WARN', fg='yellow', quiet=self.quiet)
+            return False
+        self.set_plan(init['plan']['part_size'])
+        self.set_uploadId(init['uploadId'])
+        if time.time() - ts > JOURNAL_MAX_AGE:
+            # stale journal - upload may be gone, uploaded parts listed by server:
+            try:
+                self.scan_parts()
+            except Exception as e:
+                secho(f"Upload {init['uploadId']} from journal not found, starting new upload.",
+                      prefix='WARN', fg='yellow', quiet=self.quiet)
+                self.set_plan(self.part_size_opt)
+                self.uploadId = None
+                return False
+        else:
+            self.parts = list(parts.values())
+            for part in self.parts:
+                self.results[part['PartNumber'] - 1] = part
+        secho(f"Continuing upload {self.uploadId} from journal, {len(self.parts)} part(s) already uploaded.",
+              prefix='OK', quiet=self.quiet)
+        return True
+
+    def part_done(self, part):
+        """ part uploaded (result callback in main process) """
+        self.journal_part(part)
+        if not isinstance(part, dict): return
+        if self.progress is not None: self.progress.part(part)
+        if self.metrics is not None: self.metrics.part(part)
+        if self.profile is not None: self.profile.part(part, self.key)
+
+    def part_failed(self, e):
+        if self.progress is not None: self.progress.fail()
+        if self.metrics is not None: self.metrics.part_failed()
+
+    def report_begin(self):
+        """ upload start to progress stream and metrics """
+        self.ended = False
+        done = [pn for pn in range(1, self.num_parts + 1) if self.results[pn-1] is not None]
+        done_bytes = sum(self.get_part_range(pn)[1] for pn in done)
+        if self.metrics is not None:
+            self.metrics.file_started(self.data_size or 0, done_bytes)
+            if self.limiter is not None: self.metrics.limiter = self.limiter
+        if self.profile is not None:
+            self.profile_file = self.profile.file_started(os.fspath(self.file), self.key, self.data_size, self.num_parts)
+        if self.progress_stream is not None:
+            self.progress = Progress(self.progress_stream, os.fspath(self.file), self.key, self.data_size, self.limiter)
+            self.progress.begin(self.uploadId, self.num_parts, len(done), done_bytes,
+                                part_size=self.part_size, parallel=self.parallel, engine=self.engine)
+
+    def report_end(self, status, location=None, message=None):
+        if self.ended: return
+        self.ended = True
+        if self.progress is not None: self.progress.end(status, location, message)
+        self.progress = None
+        if self.metrics is not None: self.metrics.file_finished(status == STATUS_OK)
+        if self.profile_file is not None: self.profile.file_finished(self.profile_file, status)
+        self.profile_file = None
+
+    def journal_part(self, part):
+        if self.journal is None or not isinstance(part, dict): return
+        try:
+            self.journal.add_part(part)
+        except OSError as e:
+            logger.debug(f"{funcname()} journal write failed: {e}")
+
     def scan_parts(self):
         try:
             parts = self.get_parts()
+            sizes = {part["PartNumber"]: part["Size"] for part in parts if "Size" in part}
+            if len(sizes) > 0 and self.num_parts > 1:
+                # part size of uploaded parts wins over the local plan:
+                part_size = sizes.get(1, max(sizes.values()))
+                if part_size != self.part_size:
+                    logger.debug(f"{funcname()} part size {self.part_size} -> {part_size} (uploaded parts)")
+                    self.set_plan(part_size)
             self.parts = [{"ETag": part["ETag"], "PartNumber": part["PartNumber"]} for part in parts]
             for part in self.parts:
                 self.results[part["PartNumber"] - 1] = {"ETag": part["ETag"], "PartNumber": part["PartNumber"]}
@@ -193,13 +538,19 @@ class OARepoS3Client(object):
         logger.debug(f"{funcname()} {init_url}")
         logger.debug(f"{funcname()} {fileinfo}")
         logger.debug(f"{funcname()} {headers}")
-        resp = requests.post(init_url, data=json.dumps(fileinfo), headers=headers, verify=self.https_verify)
+        resp = self.retry.request(self.session.post, init_url, idempotent=False, data=json.dumps(fileinfo),
+                                  headers=headers, verify=self.https_verify)
         logger.debug(f"{funcname()} status: {resp.status_code}")
         if resp.status_code != 201:
             raise Exception(f"{funcname()} failed (http code {resp.status_code})", STATUS_WRONG_SERVER_RESPONSE)
         resp_json = resp.json()
         s3key, uploadId = resp_json['key'], resp_json['uploadId']
         self.set_uploadId(uploadId)
+        if self.journal is not None:
+            try:
+                self.journal.start(uploadId, self.plan, self.file)
+            except OSError as e:
+                logger.debug(f"{funcname()} journal write failed: {e}")
         secho(f"Upload initialized (uploadId {uploadId})", prefix='OK', quiet=self.quiet)
         logger.debug(f"{funcname()} uploadId: {uploadId}, s3key: {s3key}")
         return uploadId
@@ -211,7 +562,10 @@ class OARepoS3Client(object):
         # secho(f"{funcname()} {pnstr}")
         logger.debug(f"{funcname()} presign_parts_upload (url:{presign_url})")
         try:
-            resp = requests.get(presign_url, verify=self.https_verify)
+            start = time.time()
+            resp = self.retry.request(self.session.get, presign_url, verify=self.https_verify)
+            if self.metrics is not None: self.metrics.presign(len(partNums), time.time() - start)
+            if self.profile is not None: self.profile.phase('presign request', start, time.time() - start)
             logger.debug(f"{funcname()} status: {resp.status_code}")
             if resp.status_code >= 400:
                 raise Exception(f"Upload presign failed. (http code {resp.status_code})")
@@ -230,29 +584,76 @@ class OARepoS3Client(object):
     def get_parts(self):
         parts_url = f"{self.urlUpload}/parts"
         logger.debug(f"{funcname()} parts_url:{parts_url}")
-        resp = requests.get(parts_url, verify=self.https_verify)
+        resp = self.retry.request(self.session.get, parts_url, verify=self.https_verify)
         if resp.status_code >= 400:
             raise Exception(f"Upload not found. (http code {resp.status_code})")
         logger.debug(f"{funcname()} status:{resp.status_code} resp.text: {resp.text}")
         return resp.json()
 
 
+    def get_uploaded_parts(self):
+        parts = [part for part in self.parts if isinstance(part, dict)]
+        return sorted(parts, key=lambda part: part['PartNumber'])
+
+    def get_part_range(self, partNum):
+        if self.stream is not None: return self.stream.range(partNum)
+        offset = (partNum-1) * self.part_size
+        return offset, self.part_size if partNum < self.num_parts else self.last_size
+
+    def part_body(self, partNum):
+        body = self.reader.get(partNum) if self.reader is not None else None
+        if body is None: body = self.file_slice(partNum)
+        return ThrottledBody(body, self.bandwidth) if self.bandwidth is not None else body
+
+    def worker_timeout(self):
+        """ worker timeout (process engine) of part, extended by its time under bandwidth limit """
+        if self.bandwidth is None: return WORKER_TIMEOUT
+        streams = min(self.parallel, len(self.parts_unfin))
+        return WORKER_TIMEOUT + self.bandwidth.part_secs(self.part_size, streams)
+
+    def file_slice(self, partNum):
+        if isinstance(self.file, TarBundle): return self.file.slice(*self.get_part_range(partNum))
+        return FileSlice(self.file, *self.get_part_range(partNum))
+
+    def part_slot(self, size):
+        """ stream slot of part PUT - waits for adaptive limit """
+        return self.limiter.slot(size) if self.limiter is not None else contextlib.nullcontext({})
+
+    def set_local_checksum(self, parts):
+        """ multipart ETag from part MD5s computed during upload (parts uploaded before resume are read) """
+        md5s = []
+        for part in parts:
+            md5 = part.get('MD5')
+            if md5 is None:
+                with self.file_slice(part['PartNumber']) as body:
+                    for chunk in body: pass
+                    md5 = body.hexdigest()
+            md5s.append(md5)
+        self.local_checksum = get_multipart_etag(md5s) if len(md5s) == self.num_parts else None
+        logger.debug(f"{funcname()} local checksum: {self.local_checksum}")
+
     def complete_upload(self):
         complete_url = f"{self.urlUpload}/complete"
         logger.debug(f"{funcname()} complete_upload (url: {complete_url})")
+        parts = self.get_uploaded_parts()
+        if not self.nocheck: self.set_local_checksum(parts)
         parts4complete = {"parts": []}
-        for part in self.parts:
-            if part is not None:
-                parts4complete['parts'].append({
-                    'ETag': part['ETag'],
-                    'PartNumber': part['PartNumber']
-                })
+        # size of stream known at its end only:
+        if self.stream is not None: parts4complete['size'] = self.data_size
+        for part in parts:
+            parts4complete['parts'].append({
+                'ETag': part['ETag'],
+                'PartNumber': part['PartNumber']
+            })
         parts4complete_json = json.dumps(parts4complete)
         # logger.debug(f"{funcname()} parts: {parts4complete}")
         logger.debug(f"{funcname()} parts_json: {parts4complete_json}")
         headers = {'Content-Type': 'application/json'}
         secho('Completing upload ...', quiet=self.quiet)
-        resp = requests.post(complete_url, data=parts4complete_json, headers=headers, verify=self.https_verify)
+        start = time.time()
+        resp = self.retry.request(self.session.post, complete_url, data=parts4complete_json, headers=headers,
+                                  verify=self.https_verify)
+        if self.profile is not None: self.profile.phase('complete', start, time.time() - start)
         logger.debug(f"{funcname()} status: {resp.status_code}")
         if resp.status_code >= 400:
             raise Exception(f"Upload completing failed (http code {resp.status_code})", STATUS_WRONG_SERVER_RESPONSE)
@@ -262,18 +663,30 @@ class OARepoS3Client(object):
         logger.debug(f"Storage checksum={self.checksum}")
         if self.checksum is not None: self.checksum = re.sub("^etag:", '', self.checksum)
         logger.debug(f"{funcname()} location: {location}")
+        self.remove_journal()
+        self.cache_hashes()
         secho(f'Upload completed. ({location})', prefix='OK', quiet=self.quiet)
         return location
 
 
+    def remove_journal(self):
+        try:
+            if self.journal is not None:
+                self.journal.remove()
+            elif self.state_dir is not None and self.uploadId is not None:
+                Journal.remove_upload(self.state_dir, self.uploadId)
+        except OSError as e:
+            logger.debug(f"{funcname()} journal remove failed: {e}")
+
     def abort_upload(self):
         abort_url = f"{self.urlUpload}/abort"
         logger.debug(f"{funcname()} abort_url:{abort_url}")
         secho('Aborting upload ...', quiet=self.quiet)
-        resp = requests.delete(abort_url, verify=self.https_verify)
+        resp = self.retry.request(self.session.delete, abort_url, verify=self.https_verify)
         if resp.status_code >= 400:
             raise Exception(f"Upload abort failed (http code {resp.status_code})", STATUS_WRONG_SERVER_RESPONSE)
         logger.debug(f"{funcname()} status:{resp.status_code} resp.text: {resp.text}")
+        self.remove_journal()
         secho(f'Upload aborted.', prefix='OK', quiet=self.quiet)
         return resp
 
@@ -286,7 +699,8 @@ class OARepoS3Client(object):
             'Content-Type': 'application/json',
             'Authorization': f"Bearer {self.token}"
         }
-        resp = requests.post(revoke_url, headers=headers, verify=self.https_verify)
+        resp = self.retry.request(self.session.post, revoke_url, idempotent=False, headers=headers,
+                                  verify=self.https_verify)
         if resp.status_code >= 400:
             raise Exception(f"Token revoke failed (http code {resp.status_code})", STATUS_WRONG_SERVER_RESPONSE)
         logger.debug(f"{funcname()} status:{resp.status_code} resp.text: {resp.text}")
@@ -297,72 +711,215 @@ class OARepoS3Client(object):
     def delete_file(self):
         logger.debug(f"{funcname()} delete_file")
         delete_url = f"{self.urlFiles}/{self.key}"
-        resp = requests.delete(delete_url, verify=self.https_verify)
+        resp = self.retry.request(self.session.delete, delete_url, verify=self.https_verify)
         logger.debug(f"{funcname()} status: {resp.status_code}")
 
 
     def upload_part(self, partNum, val):
         logger.debug(f"\n>>Starting upload_part #{partNum} ...")
-        offset = (partNum-1) * self.part_size
-        part_size = self.part_size if partNum < self.num_parts else self.last_size
-        if not self.presigns.has_key(partNum):
-            secho(f"\n #{partNum} NOT in list of presigned parts - slowing down")
-            # part_s3_url = self.presign_parts_upload([partNum])[partNum]
-            time.sleep(SLOWDOWN_SLEEP)
-        # else:
-        #    logger.debug(f"\n #{partNum} using {partNum} presign from cache")
-        part_s3_url = self.presigns.pop(partNum)
-        ok = False
-        # raise Exception('EXCEPTION')
-        for retry in range(1, MAX_RETRIES + 1):
-            if retry>1:
-                msg = f' ... #{partNum} trying again ({retry} of {MAX_RETRIES})...'
-                secho(f"{msg}", prefix='\nWARN', fg='yellow', quiet=self.quiet)
-                time.sleep(RETRY_SLEEP * retry)
-            try:
-                retry_str = f' retry {retry}' if retry>1 else ''
-                logger.debug(f"\n..Opening file {self.file} at offset {offset}{retry_str} ...")
-                with open(self.file, 'rb') as fh:
-                    fh.seek(offset)
-                    data = fh.read(part_size)
-                    ETag = None
-                    if data is None or len(data)==0:
-                        continue
-                    logger.debug(f"...#{partNum} PUT upload offset {offset}{retry_str}")
-                    # --- request: ---
-                    resp = requests.put(part_s3_url, data=data, timeout=3600)
+        offset, part_size = self.get_part_range(partNum)
+        spans = PartSpans()
+        with spans.span('presign'):
+            part_s3_url = self.presigns.pop(partNum)
+            presigned = part_s3_url is not None
+            if part_s3_url is None:
+                # not presigned in time - presigned by worker itself:
+                logger.debug(f"\n #{partNum} NOT in list of presigned parts - presigning")
+                part_s3_url = self.presign_parts_upload([partNum])[partNum]
+        self.retry.deposit()
+        attempt, throttled, start = 0, 0, time.time()
+        try:
+            while True:
+                resp, action, reason = None, RETRY_FATAL, None
+                try:
+                    logger.debug(f"\n..#{partNum} PUT upload offset {offset}{f' retry {attempt}' if attempt else ''}")
+                    t = time.time()
+                    with self.part_body(partNum) as body:
+                        spans.add('read', t, time.time() - t)
+                        t = time.time()
+                        with self.part_slot(part_size) as slot:
+                            spans.add('slot', t, time.time() - t)
+                            # --- request (body streamed from disk or read ahead): ---
+                            connect, start_put = connect_secs(), time.time()
+                            resp = self.session.put(part_s3_url, data=body, timeout=PART_TIMEOUT,
+                                                    verify=get_https_verify(part_s3_url))
+                            spans.request(start_put, time.time(), connect_secs() - connect, body)
+                            MD5 = body.hexdigest()
+                            action = self.retry.classify(resp, presigned=True)
+                            slot['outcome'] = action
                     logger.debug(f"...#{partNum} resp status:{resp.status_code} headers:{resp.headers}")
-                    if 'Connection' in resp.headers and resp.headers['Connection']=='close':
-                        continue
-                    # logger.debug(f"  #{partNum} resp.text: {resp.text}")
-                    ETag = resp.headers['ETag'].strip('"')
-                    logger.debug(f"...#{partNum} ETag: {ETag}")
-                    ok = True
-                    break
-            except (NewConnectionError, ConnectionError, socket.gaierror) as e:
-                msg = f"Error uploading part #{partNum} retry {retry} from {MAX_RETRIES}"
+                    reason = f"http code {resp.status_code}"
+                    if action == RETRY_OK:
+                        ETag = resp.headers.get('ETag', '').strip('"')
+                        logger.debug(f"...#{partNum} ETag: {ETag} MD5: {MD5}")
+                        if ETag == '':
+                            action, reason = RETRY, "no ETag in response"
+                        elif is_md5(ETag) and MD5 is not None and ETag != MD5:
+                            action, reason = RETRY, f"ETag {ETag} differs from local MD5 {MD5}"
+                        else:
+                            logger.debug(f"<<<Stop upload_part #{partNum} status:OK.")
+                            result = dict(PartNumber=partNum, status=STATUS_OK, ETag=ETag, MD5=MD5, Size=part_size,
+                                          Secs=round(time.time() - start, 3), Retries=attempt, Throttled=throttled,
+                                          Presigned=presigned)
+                            if self.profile is not None: result.update(spans.fields())
+                            return result
+                except (FileNotFoundError, PermissionError) as e:
+                    raise Exception(f"Error reading file {self.file} (part {partNum}): {e}", STATUS_WRONG_FILE)
+                except SignalException as e:
+                    emsg, signumber = e.args[1] if len(e.args) > 1 else (None, None)
+                    logger.debug(f"  #{partNum} Error [{e}/{type(e)}]")
+                    if signumber != signal.SIGALRM: raise
+                    action, reason = RETRY, "worker timeout"
+                except Exception as e:
+                    action, reason = self.retry.classify(exc=e), f"{type(e).__name__}: {e}"
+                    logger.debug(f"  #{partNum} Error [{e}/{type(e)}]")
+                attempt += 1
+                if action == RETRY_THROTTLED: throttled += 1
+                if action == RETRY_FATAL:
+                    raise Exception(f"Part {partNum} upload failed ({reason}).", STATUS_WRONG_SERVER_RESPONSE)
+                if not self.retry.allow(attempt, action):
+                    raise Exception(f"Part {partNum} upload failed ({reason}).", STATUS_ERR_MAX_RETRIES)
+                msg = f"Part #{partNum} {reason}, trying again ({attempt} of {self.retry.max_attempts(action)}) ..."
                 secho(f"{msg}", prefix='\nWARN', fg='yellow', quiet=self.quiet)
-                logger.debug(f"  #{partNum} Error [{e}]")
-            except FileNotFoundError or PermissionError as e:
-                msg = f"Error reading file #{self.file} retry {retry} from {MAX_RETRIES}"
-                secho(f"{msg}", prefix='\nWARN', fg='yellow', quiet=self.quiet)
-                logger.debug(f"  #{partNum} Error [{e}]")
-            except SignalException as e:
-                emsg, signumber = e.args[1] if len(e.args) > 1 else (None, None)
-                msg = f"SIGNAL: Error uploading part #{partNum} retry {retry} from {MAX_RETRIES} [{e}/{type(e)}]"
-                # secho(f"{msg}", prefix='\nWARN', fg='yellow', quiet=self.quiet)
-                logger.debug(f"  #{partNum} Error [{e}/{type(e)}]")
-                if signumber != signal.SIGALRM: break
-            except Exception as e:
-                msg = f"General error uploading part #{partNum} retry {retry} from {MAX_RETRIES} [{e}/{type(e)}]"
-                secho(f"{msg}", prefix='\nWARN', fg='yellow', quiet=self.quiet)
-                logger.debug(f"  #{partNum} Error [{e}/type(e)]")
+                with spans.span('retry'):
+                    self.retry.sleep(attempt, resp)
+                if action == RETRY_PRESIGN:
+                    with spans.span('presign'):
+                        part_s3_url = self.presign_parts_upload([partNum])[partNum]
+        finally:
+            if self.reader is not None: self.reader.release(partNum)
+
+    def upload_stream(self):
+        """ parts of stream uploaded by thread pool as they are read, reading waits for free buffer """
+        self.init_upload()
+        # part numbers presigned ahead, unused ones at end of stream are left:
+        self.presigns = PresignPrefetcher(self.presign_parts_upload, range(1, MAX_PARTS + 1), BATCH_PRESIGNS,
+                                          MAX_PRESIGNS)
+        self.presings_supply(MAX_PRESIGNS)
+        self.report_begin()
+        failed = []
+
+        def done(part):
+            self.parts.append(part)
+            self.part_done(part)
+
+        def error(e):
+            failed.append(e)
+            self.part_failed(e)
+
+        pool = ThreadPool(self.parallel)
+        try:
+            pn, start = 1, time.time()
+            while pn is not None and not failed:
+                pool.apply_async(self.upload_part, (pn, f"val-{pn}"), callback=done, error_callback=error)
+                pn = self.stream.read()
+            pool.close()
+            pool.join()
+            if failed: raise failed[0]
+            self.data_size = self.stream.size
+            self.num_parts = len(self.parts)
+            self.results = sorted(self.parts, key=lambda part: part['PartNumber'])
+            self.throughput = self.data_size / max(time.time() - start, 1)
+            location = self.complete_upload()
+            if not self.nocheck: self.check_stream()
+            self.report_end(STATUS_OK, location)
+            return location, STATUS_OK
+        except Exception as e:
+            logger.debug(f"{funcname()} caught and raising Exception \"{e}\" {procname()}")
+            msg, code = e.args if len(e.args) > 1 else (str(e), STATUS_UNKNOWN)
+            self.report_end(code, message=str(msg))
+            # stream can't be read again - nothing to resume:
+            try:
+                self.abort_upload()
+            except Exception as abort_error:
+                logger.debug(f"{funcname()} abort failed: {abort_error}")
+            raise
+        finally:
+            pool.terminate()
+            self.presigns.close()
+            self.stream.close()
+
+    def check_stream(self):
+        """ multipart ETag of part MD5s against storage checksum (stream can't be read again) """
+        if self.checksum is None or self.local_checksum is None:
+            secho(f"No storage checksum, part ETags were checked during upload.", quiet=self.quiet)
+            return True, STATUS_OK
+        self.checked = self.checksum == self.local_checksum
+        if not self.checked:
+            raise Exception(f"Local and remote files differ.", STATUS_GENERAL_ERROR)
+        secho(f"Local and remote files have the same checksum.", prefix='OK', quiet=self.quiet)
+        return True, STATUS_OK
+
+    def upload_single(self, partNum):
+        """ the only part to upload, without worker pool """
+        try:
+            part = self.upload_part(partNum, f"val-{partNum}")
+        except Exception as e:
+            self.part_failed(e)
+            raise
+        self.results[partNum-1] = part
+        self.part_done(part)
+        return STATUS_OK, [part]
 
-        logger.debug(f"<<<Stop upload_part #{partNum} status:{'OK' if ok else 'ERR'}.")
-        if ok:
-            return dict(PartNumber=partNum, status=STATUS_OK, ETag=ETag)
-        else:
-            raise Exception(f"Part {partNum} upload failed.", STATUS_ERR_MAX_RETRIES)
+    def upload_direct(self):
+        """ whole (small) file in one PUT to files API, location or None if server has no direct upload """
+        url = f"{self.urlFiles}{self.key}"
+        headers = {
+            'Content-Type': self.contentType,
+            'Authorization': f"Bearer {self.token}"
+        }
+        logger.debug(f"{funcname()} direct upload (url: {url})")
+        # nothing to resume of one request:
+        self.journal = None
+        bodies, spans = [], PartSpans()
+
+        def put(url, **kwargs):
+            # fresh body for each attempt:
+            with self.part_body(1) as body, self.part_slot(self.data_size) as slot:
+                bodies.append(body)
+                connect, start = connect_secs(), time.time()
+                resp = self.session.put(url, data=body, **kwargs)
+                spans.request(start, time.time(), connect_secs() - connect, body)
+                slot['outcome'] = self.retry.classify(resp)
+                return resp
+
+        start, resp = time.time(), None
+        try:
+            resp = self.retry.request(put, url, headers=headers, timeout=PART_TIMEOUT, verify=self.https_verify)
+            logger.debug(f"{funcname()} status: {resp.status_code}")
+            if resp.status_code in DIRECT_UNSUPPORTED:
+                _no_direct_upload.add(self.urlFiles)
+                return None
+            self.report_begin()
+            if resp.status_code >= 400:
+                raise Exception(f"Upload failed (http code {resp.status_code})", STATUS_WRONG_SERVER_RESPONSE)
+            rjson = resp.json() if resp.content else {}
+            MD5 = bodies[-1].hexdigest()
+            checksum = rjson.get('checksum') or ''
+            if checksum.startswith('md5:'):
+                if MD5 is not None and checksum[4:] != MD5:
+                    raise Exception(f"Uploaded file checksum {checksum} differs from local MD5 {MD5}.",
+                                    STATUS_WRONG_SERVER_RESPONSE)
+                # verified - check compares multipart ETag of the one part:
+                self.parts = [dict(PartNumber=1, ETag=checksum[4:], MD5=MD5)]
+                self.checksum = get_multipart_etag([checksum[4:]])
+            part = dict(PartNumber=1, status=STATUS_OK, ETag=checksum[4:] or None, MD5=MD5, Size=self.data_size,
+                        Secs=round(time.time() - start, 3), Retries=len(bodies) - 1, Throttled=0, Presigned=True)
+            if self.profile is not None: part.update(spans.fields())
+            self.part_done(part)
+            if self.parts: self.cache_hashes()
+            location = rjson.get('links', {}).get('self', url)
+            secho(f'Upload completed. ({location})', prefix='OK', quiet=self.quiet)
+            if not self.nocheck:
+                if self.parts: self.set_local_checksum(self.parts)
+                self.process_click_check()
+            self.report_end(STATUS_OK, location)
+            return location
+        except Exception as e:
+            msg, code = e.args if len(e.args) > 1 else (str(e), STATUS_UNKNOWN)
+            if resp is None: self.report_begin()
+            self.report_end(code, message=str(msg))
+            raise
 
     def presings_supply(self, cnt=MAX_PRESIGNS):
         self.presigns.supply(cnt, cnt)
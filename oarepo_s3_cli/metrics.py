@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+""" OARepo S3 client metrics in Prometheus text format (/metrics endpoint, textfile collector). """
+
+import bisect, os, threading, time, logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from oarepo_s3_cli.constants import *
+
+logger = logging
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram(object):
+    """ cumulative histogram of observed values (Prometheus buckets, sum and count) """
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name):
+        total = 0
+        for le, cnt in zip(self.buckets + ['+Inf'], self.counts):
+            total += cnt
+            yield f'{name}_bucket{{le="{le}"}} {total}'
+        yield f'{name}_sum {round(self.sum, 6)}'
+        yield f'{name}_count {self.count}'
+
+
+class Metrics(object):
+    """ counters of all uploads of this run, fed by clients in main process; parts states
+        from Stats of running Parallels """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = dict(files_started=0, files_ok=0, files_failed=0, parts_finished=0, parts_failed=0,
+                             bytes_sent=0, retries=0, throttled=0, presign_requests=0, presign_urls=0,
+                             presign_misses=0)
+        self.gauges = dict(size_bytes=0, done_bytes=0)
+        self.part_duration = Histogram(METRICS_PART_BUCKETS)
+        self.presign_duration = Histogram(METRICS_PRESIGN_BUCKETS)
+        self.stats = []         # Stats of running Parallels
+        self.limiter = None
+        self.start = time.time()
+
+    def __getstate__(self):
+        # worker processes count into own (discarded) metrics:
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def file_started(self, size, done_bytes):
+        with self.lock:
+            self.counters['files_started'] += 1
+            self.gauges['size_bytes'] += size
+            self.gauges['done_bytes'] += done_bytes
+
+    def file_finished(self, ok):
+        with self.lock:
+            self.counters['files_ok' if ok else 'files_failed'] += 1
+
+    def part(self, part):
+        """ finished part - dict returned by upload_part """
+        with self.lock:
+            c = self.counters
+            c['parts_finished'] += 1
+            c['bytes_sent'] += part.get('Size', 0)
+            c['retries'] += part.get('Retries', 0)
+            c['throttled'] += part.get('Throttled', 0)
+            c['presign_misses'] += 0 if part.get('Presigned', True) else 1
+            self.gauges['done_bytes'] += part.get('Size', 0)
+            if 'Secs' in part: self.part_duration.observe(part['Secs'])
+
+    def part_failed(self):
+        with self.lock:
+            self.counters['parts_failed'] += 1
+
+    def presign(self, urls, secs):
+        with self.lock:
+            self.counters['presign_requests'] += 1
+            self.counters['presign_urls'] += urls
+            self.presign_duration.observe(secs)
+
+    def watch(self, stats):
+        with self.lock:
+            self.stats.append(stats)
+
+    def unwatch(self, stats):
+        with self.lock:
+            if stats in self.stats: self.stats.remove(stats)
+
+    def render(self):
+        """ metrics in Prometheus text exposition format """
+        with self.lock:
+            c, g = dict(self.counters), dict(self.gauges)
+            states = dict(pending=0, running=0, terminating=0)
+            for stats in self.stats:
+                states['pending'] += stats.pending
+                states['running'] += stats.running
+                states['terminating'] += stats.for_terminate
+            lines = []
+            def metric(name, kind, help, samples):
+                lines.append(f'# HELP oarepo_s3_{name} {help}')
+                lines.append(f'# TYPE oarepo_s3_{name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'oarepo_s3_{name}{labels} {value}')
+            metric('files_started_total', 'counter', 'Files of which upload started.', [('', c['files_started'])])
+            metric('files_finished_total', 'counter', 'Files of which upload finished.',
+                   [('{status="ok"}', c['files_ok']), ('{status="failed"}', c['files_failed'])])
+            metric('upload_size_bytes', 'gauge', 'Total size of started uploads.', [('', g['size_bytes'])])
+            metric('upload_done_bytes', 'gauge', 'Bytes of started uploads in S3.', [('', g['done_bytes'])])
+            metric('sent_bytes_total', 'counter', 'Bytes of parts sent.', [('', c['bytes_sent'])])
+            metric('parts_total', 'counter', 'Parts uploaded or failed.',
+                   [('{status="ok"}', c['parts_finished']), ('{status="failed"}', c['parts_failed'])])
+            metric('parts', 'gauge', 'Parts of running upload by state.',
+                   [(f'{{state="{state}"}}', cnt) for state, cnt in states.items()])
+            metric('part_retries_total', 'counter', 'Part upload retries.', [('', c['retries'])])
+            metric('part_throttled_total', 'counter', 'Throttled part uploads (429, 503).', [('', c['throttled'])])
+            metric('presign_requests_total', 'counter', 'Presign requests.', [('', c['presign_requests'])])
+            metric('presign_urls_total', 'counter', 'Presigned part URLs.', [('', c['presign_urls'])])
+            metric('presign_misses_total', 'counter', 'Parts not presigned ahead of upload.',
+                   [('', c['presign_misses'])])
+            lines.append('# HELP oarepo_s3_part_duration_seconds Part upload time (with retries).')
+            lines.append('# TYPE oarepo_s3_part_duration_seconds histogram')
+            lines.extend(self.part_duration.lines('oarepo_s3_part_duration_seconds'))
+            lines.append('# HELP oarepo_s3_presign_duration_seconds Presign request time.')
+            lines.append('# TYPE oarepo_s3_presign_duration_seconds histogram')
+            lines.extend(self.presign_duration.lines('oarepo_s3_presign_duration_seconds'))
+            if self.limiter is not None:
+                metric('streams', 'gauge', 'Parallel part streams (--parallel auto).', [('', self.limiter.limit)])
+            metric('start_time_seconds', 'gauge', 'Start time of client.', [('', round(self.start, 3))])
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsExporter(object):
+    """ metrics served on http://<listen>/metrics and/or written to textfile (node_exporter
+        textfile collector) every interval and on close """
+    def __init__(self, metrics, listen=None, textfile=None, interval=METRICS_INTERVAL):
+        self.metrics = metrics
+        self.textfile = textfile
+        self.interval = interval
+        self.server = None
+        self.stop = threading.Event()
+        self.threads = []
+        if listen is not None:
+            host, port = parse_listen(listen)
+            self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+            self.server.daemon_threads = True
+            self.server.metrics = metrics
+            self.threads.append(threading.Thread(target=self.server.serve_forever, daemon=True))
+        if textfile is not None:
+            self.write_textfile()
+            self.threads.append(threading.Thread(target=self.run, daemon=True))
+        for thread in self.threads: thread.start()
+
+    @property
+    def url(self):
+        if self.server is None: return None
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/metrics'
+
+    def write_textfile(self):
+        # written atomically - collector never reads partial file:
+        tmp = f'{self.textfile}.{os.getpid()}.tmp'
+        try:
+            with open(tmp, 'w') as fh:
+                fh.write(self.metrics.render())
+            os.replace(tmp, self.textfile)
+        except OSError as e:
+            logger.debug(f"metrics textfile write failed: {e}")
+
+    def run(self):
+        while not self.stop.wait(self.interval):
+            self.write_textfile()
+
+    def close(self):
+        self.stop.set()
+        if self.textfile is not None: self.write_textfile()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+def parse_listen(value):
+    """ (host, port) of "[host:]port", localhost by default """
+    host, _, port = str(value).rpartition(':')
+    try:
+        return host or '127.0.0.1', int(port)
+    except ValueError:
+        raise Exception(f"Invalid metrics listen address \"{value}\" ([host:]port)", STATUS_GENERAL_ERROR)
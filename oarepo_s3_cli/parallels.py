@@ -7,25 +7,195 @@
 
 """ OARepo S3 client parallel processing lib."""
 
-import sys, time, signal, logging
+import asyncio, contextlib, sys, time, signal, threading, logging
 import multiprocessing as mp
+from multiprocessing.pool import ThreadPool
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import timedelta
 from oarepo_s3_cli.utils import *
 
 logger = logging
 
+class AsyncResult(object):
+    def __init__(self, fut):
+        self.fut = fut
+
+    def get(self, timeout=None):
+        try:
+            return self.fut.result(timeout)
+        except FutureTimeoutError:
+            raise mp.TimeoutError()
+
+    def ready(self):
+        return self.fut.done()
+
+
+class AsyncPool(object):
+    """ asyncio engine with apply_async interface of multiprocessing pools """
+    def __init__(self, processes):
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(processes)
+        self.loop.set_default_executor(self.executor)
+        self.futs = []
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    async def run(self, func, args, callback, error_callback):
+        try:
+            # blocking part upload (requests) runs in the loop executor:
+            res = await self.loop.run_in_executor(None, func, *args)
+        except Exception as e:
+            if error_callback is not None: error_callback(e)
+            raise
+        if callback is not None: callback(res)
+        return res
+
+    def apply_async(self, func, args=(), kwds={}, callback=None, error_callback=None):
+        fut = asyncio.run_coroutine_threadsafe(self.run(func, args, callback, error_callback), self.loop)
+        self.futs.append(fut)
+        return AsyncResult(fut)
+
+    def close(self):
+        pass
+
+    def terminate(self):
+        # cancelled tasks cancel their executor futures not started yet (shutdown(cancel_futures) is 3.9+):
+        for fut in self.futs: fut.cancel()
+        self.executor.shutdown(wait=False)
+
+    def join(self):
+        for fut in self.futs:
+            try: fut.result()
+            except: pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.executor.shutdown()
+        # tasks cancelled by terminate end when loop runs again:
+        tasks = asyncio.all_tasks(self.loop) if hasattr(asyncio, 'all_tasks') else asyncio.Task.all_tasks(self.loop)
+        pending = [task for task in tasks if not task.done()]
+        if pending: self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        self.loop.close()
+
+
+class AdaptiveLimit(object):
+    """ AIMD limit of part streams in flight (--parallel auto): one more stream per window while
+        throughput grows and per-part latency holds, halved on throttling/errors, one less when
+        throughput drops, kept within [low, high] """
+    def __init__(self, low=ADAPTIVE_MIN_PARALLEL, high=ADAPTIVE_MAX_PARALLEL, start=None):
+        self.low = max(1, low)
+        self.high = max(self.low, high)
+        self.limit = min(max(start or ADAPTIVE_START_PARALLEL, self.low), self.high)
+        self.start = self.limit
+        self.active = 0
+        self.cond = threading.Condition()
+        self.decisions = []     # (time, old limit, new limit, throughput, reason)
+        self.prev_throughput = None
+        self.min_latency = None     # best seconds per byte
+        self.total_bytes = 0
+        self.began = time.time()
+        self.new_window()
+
+    def new_window(self):
+        self.window_start = time.time()
+        self.window_bytes = 0
+        self.window_secs = 0
+        self.window_parts = 0
+        self.window_throttled = 0
+        self.window_errors = 0
+        self.saturated = False
+
+    def acquire(self):
+        with self.cond:
+            self.cond.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+            if self.active >= self.limit: self.saturated = True
+
+    def release(self, nbytes, secs, outcome):
+        with self.cond:
+            self.active -= 1
+            if outcome == 'ok':
+                self.window_bytes += nbytes
+                self.window_secs += secs
+                self.window_parts += 1
+                self.total_bytes += nbytes
+            elif outcome == 'throttled':
+                self.window_throttled += 1
+            else:
+                self.window_errors += 1
+            self.adjust()
+            self.cond.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, nbytes):
+        """ one part stream: outcome ('ok', 'throttled', other) set by caller """
+        self.acquire()
+        rec, start = {'outcome': 'error'}, time.time()
+        try:
+            yield rec
+        finally:
+            self.release(nbytes, time.time() - start, rec['outcome'])
+
+    def set_limit(self, limit, throughput, reason):
+        limit = min(max(limit, self.low), self.high)
+        if limit != self.limit:
+            self.decisions.append((time.time(), self.limit, limit, throughput, reason))
+            logger.debug(f"\nadaptive parallel {self.limit} -> {limit} ({reason}, {size_fmt(throughput)}/s)")
+            self.limit = limit
+
+    def adjust(self):
+        elapsed = time.time() - self.window_start
+        events = self.window_parts + self.window_throttled + self.window_errors
+        if elapsed < ADAPTIVE_WINDOW or events < max(1, self.limit // 2):
+            return
+        throughput = self.window_bytes / elapsed
+        latency = self.window_secs / self.window_bytes if self.window_bytes > 0 else None
+        if latency is not None and (self.min_latency is None or latency < self.min_latency):
+            self.min_latency = latency
+        prev, self.prev_throughput = self.prev_throughput, throughput
+        if self.window_throttled > 0 or self.window_errors > 0:
+            what = 'throttled' if self.window_throttled > 0 else 'errors'
+            self.set_limit(self.limit // 2, throughput, what)
+        elif prev is not None and throughput < prev * (1 - ADAPTIVE_TOLERANCE):
+            self.set_limit(self.limit - 1, throughput, 'throughput dropped')
+        elif latency is not None and latency > self.min_latency * ADAPTIVE_LATENCY_RISE and \
+                prev is not None and throughput < prev * (1 + ADAPTIVE_TOLERANCE):
+            self.set_limit(self.limit - 1, throughput, 'latency rising')
+        elif self.saturated:
+            self.set_limit(self.limit + 1, throughput, 'throughput growing')
+        self.new_window()
+
+    def summary(self):
+        ups = sum(1 for d in self.decisions if d[2] > d[1])
+        downs = len(self.decisions) - ups
+        limits = [self.start] + [d[2] for d in self.decisions]
+        elapsed = max(time.time() - self.began, 1e-6)
+        return f"adaptive parallel streams: start {self.start}, final {self.limit}, " \
+            f"range {min(limits)}-{max(limits)} (bounds {self.low}-{self.high}), " \
+            f"{ups} increase(s), {downs} decrease(s), {size_fmt(self.total_bytes / elapsed)}/s"
+
+
 class Parallels():
-    def __init__(self, worker, idle_callback, num_parts, parts_unfin, parallel=0, quiet=False):
+    def __init__(self, worker, idle_callback, num_parts, parts_unfin, parallel=0, quiet=False,
+                 engine=DEFAULT_ENGINE, result_callback=None, error_callback=None, signals=True,
+                 bandwidth=None, worker_timeout=WORKER_TIMEOUT):
         self.worker = worker
+        self.engine = engine
         self.idle_callback = idle_callback
+        self.result_callback = result_callback
+        self.error_callback = error_callback
         self.num_parts = num_parts
         self.parts_unfin = parts_unfin
         self.pool_size = MAX_PARALLEL if parallel == 0 else parallel
         if self.pool_size > len(self.parts_unfin): self.pool_size = len(self.parts_unfin)
         self.mon_timeout = MON_TIMEOUT
+        # parts slowed down by bandwidth limit - no timeout while bytes are sent:
+        self.bandwidth = bandwidth
+        self.worker_timeout = worker_timeout
         self.killed = False
         self.pn = None
         self.quiet = quiet
+        # SIGINT/SIGTERM handlers and SIGALRM progress output - main thread of CLI only:
+        self.signals = signals and threading.current_thread() is threading.main_thread()
         self.stats = Stats(self.num_parts, self.num_parts-len(self.parts_unfin))
         self.spinner = Spinner()
         self.start = 0
@@ -63,15 +233,32 @@ class Parallels():
         msg = f"%s %3d%% [%s] pending:%-{w}d; started:%-{w}d; finished:%-{w}d; failed:%-{w}d %s %s" % vals
         secho(f"\r %-100s." % (msg,), nl=False, quiet=self.quiet)
         sys.stdout.flush()
-        if self.stats.remaining>0: signal.alarm(CYCLE_SLEEP)
+        if self.stats.remaining>0 and self.signals: signal.alarm(CYCLE_SLEEP)
+
+
+    def sending(self):
+        """ bytes sent under bandwidth limit within monitor timeout """
+        return self.bandwidth is not None and self.bandwidth.idle() <= self.mon_timeout
 
+    def make_pool(self):
+        if self.engine == 'process':
+            return mp.Pool(self.pool_size)
+        elif self.engine == 'thread':
+            return ThreadPool(self.pool_size)
+        elif self.engine == 'async':
+            return AsyncPool(self.pool_size)
+        raise Exception(f"Unknown engine {self.engine}", STATUS_GENERAL_ERROR)
 
     def worker_wrapper(self, pn, val):
-        self.pn = pn
-        signal.signal(signal.SIGINT, self.signal_handler)
-        # signal.signal(signal.SIGTERM, self.signal_handler)
-        signal.signal(signal.SIGALRM, self.signal_handler)
-        alrms = signal.alarm(WORKER_TIMEOUT)
+        # signals (and alarm timeout) are available in worker processes only:
+        use_signals = self.engine == 'process'
+        alrms = None
+        if use_signals:
+            self.pn = pn
+            signal.signal(signal.SIGINT, self.signal_handler)
+            # signal.signal(signal.SIGTERM, self.signal_handler)
+            signal.signal(signal.SIGALRM, self.signal_handler)
+            alrms = signal.alarm(int(self.worker_timeout))
         logger.debug(f"\n>#{pn} {procname()} (alarms:{alrms}, val:{val})")
         try:
             res = self.worker(pn, val)
@@ -81,19 +268,23 @@ class Parallels():
             # https://stackoverflow.com/questions/6062576/adding-information-to-an-exception/6062799
             raise type(e)((pn,)+e.args).with_traceback(sys.exc_info()[2])
         finally:
-            alrms = signal.alarm(0)
+            if use_signals: alrms = signal.alarm(0)
         logger.debug(f"\n<#{pn} {procname()} (alrms:{alrms})")
-        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        if use_signals: signal.signal(signal.SIGINT, signal.SIG_IGN)
         return pn, res
 
     def main(self):
         futs = [None for i in range(self.num_parts)]
         results = [None for i in range(self.num_parts)]
+        # main cycle woken by last result (not pickled with self for worker processes):
+        finished = threading.Event()
         # --- handlers: ---
         def ok_cb(res):
             logger.debug(f'\nCB:{procname()} {res}')
             results[res[0]-1] = res[1]
             self.stats.finish()
+            if self.stats.remaining == 0: finished.set()
+            if self.result_callback is not None: self.result_callback(res[1])
 
         def err_cb(res):
             logger.debug(f'\nERR CB:{procname()} {res}/{type(res)}')
@@ -102,14 +293,16 @@ class Parallels():
                 pn, msg = res.args
                 results[pn - 1] = res
             self.stats.fail()
+            if self.stats.remaining == 0: finished.set()
+            if self.error_callback is not None: self.error_callback(res)
 
         # --- process pool init: ---
         logger.debug(f'Start main: {120*"="}')
         self.start = time.time()
         pool = None
         try:
-            pool = mp.Pool(self.pool_size)
-            logger.debug(f'main: Start {self.pool_size} parallel uploads of {self.num_parts} parts')
+            pool = self.make_pool()
+            logger.debug(f'main: Start {self.pool_size} parallel ({self.engine}) uploads of {self.num_parts} parts')
             for partNum in self.parts_unfin:
                 futs[partNum-1] = pool.apply_async(
                     self.worker_wrapper, args=(partNum, f"val-{partNum}",),
@@ -124,10 +317,11 @@ class Parallels():
             logger.debug(f"{procname()} pool closed.")
         else:
             logger.debug(f"{procname()} no pool started.")
-        signal.signal(signal.SIGINT, self.signal_handler)
-        signal.signal(signal.SIGTERM, self.signal_handler)
-        signal.signal(signal.SIGALRM, self.output)
-        alrms = signal.alarm(CYCLE_SLEEP)
+        if self.signals:
+            signal.signal(signal.SIGINT, self.signal_handler)
+            signal.signal(signal.SIGTERM, self.signal_handler)
+            signal.signal(signal.SIGALRM, self.output)
+            alrms = signal.alarm(CYCLE_SLEEP)
 
         # --- main cycle: ---
         try:
@@ -140,15 +334,15 @@ class Parallels():
                     pool.terminate()
                     break
                 if self.stats.remaining == 0: break
-                if self.timer > self.mon_timeout:
-                    logger.critical(f"\nMonitor timeout ({MON_TIMEOUT}s) reached")
-                    secho(f"\nMonitor timeout ({MON_TIMEOUT}s) reached", prefix='\nERR', fg='red')
+                if self.timer > self.mon_timeout and not self.sending():
+                    logger.critical(f"\nMonitor timeout ({self.mon_timeout}s) reached")
+                    secho(f"\nMonitor timeout ({self.mon_timeout}s) reached", prefix='\nERR', fg='red', quiet=self.quiet)
                     break
                 self.idle_callback()
-                time.sleep(PRESIGN_REQ_SLEEP)
+                finished.wait(PRESIGN_REQ_SLEEP)
         except Exception as e:
             raise Exception(None, f'Main cycle Exception {e})')
-        alrms = signal.alarm(0)
+        if self.signals: alrms = signal.alarm(0)
         reason = 'finished' if self.stats.remaining == 0 else 'interrupt' if self.killed else 'timeout?'
         logger.debug(f"\n{'-' * 10} main cycle ended ({reason}) {'-' * 10}")
 
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+""" Upload profile (--profile): per-part spans measured by workers, end-of-run report
+    (breakdown, slowest parts, critical path) and profile file (JSON or Chrome trace). """
+
+import contextlib, json, os, threading, time, logging
+import click
+
+from oarepo_s3_cli.constants import *
+from oarepo_s3_cli.progress import percentile
+
+logger = logging
+
+# presign: URL wait or own presign, read: read-ahead wait and file reads, slot: adaptive limit wait,
+# connect: TCP/TLS connect, bandwidth: --max-bandwidth wait, send: body transfer, response: server
+# response after body sent, retry: retry sleeps
+SPANS = ('presign', 'read', 'slot', 'connect', 'bandwidth', 'send', 'response', 'retry')
+
+
+class PartSpans(object):
+    """ spans of one part upload in worker, [name, start, secs] """
+    def __init__(self):
+        self.spans = []
+
+    def add(self, name, start, secs):
+        if secs > 0: self.spans.append([name, round(start, 6), round(secs, 6)])
+
+    @contextlib.contextmanager
+    def span(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.time() - start)
+
+    def request(self, start, end, connect, body):
+        """ spans of part PUT from start to response end; reads, bandwidth waits and sending
+            are interleaved - laid out one after another """
+        sent = getattr(body, 'read_end', None) or end
+        t = start
+        for name, secs in (('connect', connect), ('read', getattr(body, 'read_secs', 0)),
+                           ('bandwidth', getattr(body, 'bandwidth_secs', 0))):
+            self.add(name, t, secs)
+            t += secs
+        self.add('send', t, sent - t)
+        t = max(t, sent)
+        self.add('response', t, end - t)
+
+    def fields(self):
+        """ part result fields of profile """
+        return dict(Spans=self.spans, Pid=os.getpid(), Tid=threading.get_native_id())
+
+
+class Profile(object):
+    """ parts with spans and phases (presign requests, complete) of all uploads of this run,
+        fed by clients in main process """
+    def __init__(self, file=None, format='json', quiet=False, slowest=PROFILE_SLOWEST):
+        self.file = file
+        self.format = format
+        self.quiet = quiet
+        self.slowest_cnt = slowest
+        self.lock = threading.Lock()
+        self.files = []
+        self.parts = []
+        self.phases = []    # [name, start, secs] in main process
+        self.start = time.time()
+
+    def __getstate__(self):
+        # worker processes only add spans to part results:
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def file_started(self, file, key, size, parts):
+        rec = dict(file=file, key=key, size=size, parts=parts, start=round(time.time(), 6), end=None, status=None)
+        with self.lock:
+            self.files.append(rec)
+        return rec
+
+    def file_finished(self, rec, status):
+        rec.update(end=round(time.time(), 6), status=status)
+
+    def part(self, part, key=None):
+        if 'Spans' not in part: return
+        with self.lock:
+            self.parts.append(dict(part, Key=key))
+
+    def phase(self, name, start, secs):
+        with self.lock:
+            self.phases.append([name, round(start, 6), round(secs, 6)])
+
+    def breakdown(self, parts=None):
+        """ {span: dict(total, share, mean, p95)} over parts """
+        values = {name: [] for name in SPANS}
+        for part in self.parts if parts is None else parts:
+            secs = dict.fromkeys(SPANS, 0)
+            for name, start, dur in part['Spans']: secs[name] = secs.get(name, 0) + dur
+            for name, dur in secs.items(): values.setdefault(name, []).append(dur)
+        total = sum(sum(v) for v in values.values()) or 1
+        return {name: dict(total=round(sum(v), 3), share=round(sum(v) / total, 4),
+                           mean=round(sum(v) / len(v), 4) if v else 0, p95=percentile(sorted(v), 95) or 0)
+                for name, v in values.items()}
+
+    def slowest(self, n=None):
+        return sorted(self.parts, key=lambda part: -part.get('Secs', 0))[:n or self.slowest_cnt]
+
+    def critical_path(self):
+        """ estimate: stream (worker) finishing last, its parts one after another; time of the
+            run before its first part (setup), between its parts (idle) and after (complete) """
+        if not self.parts: return None
+        streams = {}
+        for part in self.parts:
+            streams.setdefault((part['Pid'], part['Tid']), []).append(part)
+        end = lambda part: max(s + d for name, s, d in part['Spans'])
+        begin = lambda part: min(s for name, s, d in part['Spans'])
+        stream = max(streams.values(), key=lambda parts: max(end(part) for part in parts))
+        stream.sort(key=begin)
+        run_start = min(rec['start'] for rec in self.files) if self.files else self.start
+        run_end = max([rec['end'] or time.time() for rec in self.files] + [end(stream[-1])])
+        secs = {name: v['total'] for name, v in self.breakdown(stream).items()}
+        busy = sum(secs.values())
+        secs['setup'] = round(max(begin(stream[0]) - run_start, 0), 3)
+        secs['finish'] = round(max(run_end - end(stream[-1]), 0), 3)
+        secs['idle'] = round(max(run_end - run_start - busy - secs['setup'] - secs['finish'], 0), 3)
+        return dict(stream=f'{stream[0]["Pid"]}-{stream[0]["Tid"]}', parts=len(stream),
+                    secs=round(run_end - run_start, 3), breakdown={k: v for k, v in secs.items() if v > 0})
+
+    def summary(self):
+        return dict(files=len(self.files), parts=len(self.parts),
+                    streams=len({(part['Pid'], part['Tid']) for part in self.parts}),
+                    breakdown=self.breakdown(), critical_path=self.critical_path(),
+                    slowest=[dict(key=part['Key'], part=part['PartNumber'], secs=part.get('Secs'),
+                                  retries=part.get('Retries', 0), spans=self.part_secs(part))
+                             for part in self.slowest()])
+
+    @staticmethod
+    def part_secs(part):
+        secs = {}
+        for name, start, dur in part['Spans']: secs[name] = round(secs.get(name, 0) + dur, 3)
+        return secs
+
+    def report(self, summary=None):
+        """ end-of-run report lines """
+        s = summary or self.summary()
+        lines = [f"Profile: {s['files']} file(s), {s['parts']} part(s), {s['streams']} stream(s)"]
+        if not s['parts']: return lines
+        lines.append(f"  {'span':10s} {'total':>9s} {'share':>7s} {'mean':>8s} {'p95':>8s}")
+        for name, v in s['breakdown'].items():
+            lines.append(f"  {name:10s} {v['total']:8.2f}s {v['share']*100:6.1f}% {v['mean']:7.3f}s {v['p95']:7.3f}s")
+        lines.append(f"  slowest parts:")
+        for part in s['slowest']:
+            spans = ', '.join(f"{name} {secs:.2f}s" for name, secs in
+                              sorted(part['spans'].items(), key=lambda kv: -kv[1]) if secs >= 0.01)
+            retries = f" ({part['retries']} retries)" if part['retries'] else ''
+            lines.append(f"    {part['key']} #{part['part']}: {part['secs']:.2f}s - {spans}{retries}")
+        cp = s['critical_path']
+        share = ', '.join(f"{name} {secs:.2f}s ({secs / max(cp['secs'], 1e-6) * 100:.0f}%)" for name, secs in
+                          sorted(cp['breakdown'].items(), key=lambda kv: -kv[1]) if secs >= 0.01)
+        lines.append(f"  critical path: {cp['secs']:.2f}s, stream {cp['stream']} ({cp['parts']} parts): {share}")
+        return lines
+
+    def trace_events(self):
+        """ Chrome trace (chrome://tracing, Perfetto) events: parts and their spans by worker,
+            files and phases of main process """
+        us = lambda secs: round(secs * 1e6)
+        main = os.getpid()
+        events = [dict(name='process_name', ph='M', pid=main, tid=0, args=dict(name='oarepo-s3-cli'))]
+        for rec in self.files:
+            if rec['end'] is None: continue
+            events.append(dict(name=rec['key'], cat='file', ph='X', ts=us(rec['start']),
+                               dur=us(rec['end'] - rec['start']), pid=main, tid=0,
+                               args=dict(size=rec['size'], parts=rec['parts'], status=rec['status'])))
+        for name, start, secs in self.phases:
+            events.append(dict(name=name, cat='phase', ph='X', ts=us(start), dur=us(secs), pid=main, tid=1))
+        for part in self.parts:
+            first = min(s for name, s, d in part['Spans'])
+            last = max(s + d for name, s, d in part['Spans'])
+            pid, tid = part['Pid'], part['Tid']
+            events.append(dict(name=f"{part['Key']} #{part['PartNumber']}", cat='part', ph='X', ts=us(first),
+                               dur=us(last - first), pid=pid, tid=tid,
+                               args=dict(size=part.get('Size'), retries=part.get('Retries', 0))))
+            for name, start, secs in part['Spans']:
+                events.append(dict(name=name, cat='span', ph='X', ts=us(start), dur=us(secs), pid=pid, tid=tid))
+        return events
+
+    def write(self, summary):
+        if self.format == 'chrome':
+            data = dict(traceEvents=self.trace_events(), displayTimeUnit='ms', otherData=summary)
+        else:
+            data = dict(summary=summary, files=self.files, phases=self.phases, parts=self.parts)
+        with open(self.file, 'w') as fh:
+            json.dump(data, fh)
+
+    def close(self):
+        summary = self.summary()
+        if self.file is not None:
+            try:
+                self.write(summary)
+            except OSError as e:
+                logger.error(f"Profile write failed: {e}")
+        if not self.quiet:
+            # stderr - stdout may carry progress events:
+            click.echo('\n'.join(self.report(summary)), err=True)
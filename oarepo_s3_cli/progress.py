@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+""" OARepo S3 client machine-readable progress (NDJSON events). """
+
+import bisect, collections, json, os, sys, threading, time
+
+from oarepo_s3_cli.constants import *
+
+
+def percentile(values, p):
+    """ nearest-rank percentile of sorted values, None for no values """
+    if not values: return None
+    return values[min(len(values) - 1, max(0, -(-len(values) * p // 100) - 1))]
+
+
+class ProgressStream(object):
+    """ NDJSON progress events written to file, '-' (stdout) or 'fd:N', one line per event;
+        'progress' events of tracked uploads emitted every interval by own thread """
+    def __init__(self, dest='-', interval=PROGRESS_INTERVAL):
+        self.dest = dest
+        self.interval = interval
+        if dest == '-':
+            self.fh = sys.stdout
+        elif dest.startswith('fd:'):
+            self.fh = os.fdopen(int(dest[3:]), 'w', buffering=1, closefd=False)
+        else:
+            self.fh = open(dest, 'a', buffering=1)
+        self.lock = threading.Lock()
+        self.tracked = []
+        self.stop = threading.Event()
+        self.thread = None
+
+    @property
+    def stdout(self):
+        return self.dest == '-'
+
+    def __getstate__(self):
+        # not pickled to worker processes - events are written by main process only:
+        return {}
+
+    def __setstate__(self, state):
+        self.fh = None
+
+    def emit(self, event, **fields):
+        if self.fh is None: return
+        line = json.dumps(dict(event=event, ts=round(time.time(), 3), **fields))
+        with self.lock:
+            self.fh.write(line + '\n')
+            self.fh.flush()
+
+    def track(self, progress):
+        with self.lock:
+            self.tracked.append(progress)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def untrack(self, progress):
+        with self.lock:
+            if progress in self.tracked: self.tracked.remove(progress)
+
+    def run(self):
+        while not self.stop.wait(self.interval):
+            with self.lock:
+                tracked = list(self.tracked)
+            for progress in tracked:
+                progress.emit_progress()
+
+    def close(self):
+        self.stop.set()
+        if self.fh is not None and self.fh is not sys.stdout:
+            self.fh.close()
+        self.fh = None
+
+
+class ProgressCallback(ProgressStream):
+    """ progress events passed as dicts (fields of NDJSON events) to callback of embedding application,
+        called from upload threads - must be thread-safe and quick """
+    def __init__(self, callback, interval=PROGRESS_INTERVAL):
+        self.dest = None
+        self.callback = callback
+        self.interval = interval
+        self.fh = None
+        self.lock = threading.Lock()
+        self.tracked = []
+        self.stop = threading.Event()
+        self.thread = None
+
+    def __setstate__(self, state):
+        self.callback = None
+
+    def emit(self, event, **fields):
+        if self.callback is None: return
+        self.callback(dict(event=event, ts=round(time.time(), 3), **fields))
+
+    def close(self):
+        self.stop.set()
+        self.callback = None
+
+
+class Progress(object):
+    """ counters of one upload (parts sent, latency, retries, presign hits) for progress events """
+    def __init__(self, stream, file, key, size, limiter=None):
+        self.stream = stream
+        self.ident = dict(file=file, key=key)
+        self.size = size
+        self.limiter = limiter
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.parts_total = self.parts_done = self.parts_failed = 0
+        self.bytes_done = 0         # uploaded before (journal, resume) and now
+        self.bytes_sent = 0         # uploaded now
+        self.retries = 0
+        self.presign_hits = 0
+        self.latencies = []         # seconds per part, sorted
+        self.recent = collections.deque()   # (time, bytes) of parts finished in rate window
+
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.stream = None
+
+    def begin(self, uploadId, parts_total, parts_done, bytes_done, **fields):
+        with self.lock:
+            self.parts_total, self.parts_done, self.bytes_done = parts_total, parts_done, bytes_done
+            self.start = time.time()
+        self.stream.emit('start', **self.ident, uploadId=uploadId, size=self.size, parts_total=parts_total,
+                         parts_done=parts_done, bytes_done=bytes_done, **fields)
+        self.stream.track(self)
+
+    def part(self, part):
+        """ finished part - dict returned by upload_part """
+        now = time.time()
+        with self.lock:
+            size = part.get('Size', 0)
+            self.parts_done += 1
+            self.bytes_done += size
+            self.bytes_sent += size
+            self.retries += part.get('Retries', 0)
+            self.presign_hits += 1 if part.get('Presigned') else 0
+            if 'Secs' in part: bisect.insort(self.latencies, part['Secs'])
+            self.recent.append((now, size))
+
+    def fail(self):
+        with self.lock:
+            self.parts_failed += 1
+
+    def snapshot(self):
+        now = time.time()
+        with self.lock:
+            while self.recent and self.recent[0][0] < now - PROGRESS_RATE_WINDOW:
+                self.recent.popleft()
+            elapsed = max(now - self.start, 1e-3)
+            average = self.bytes_sent / elapsed
+            current = sum(size for ts, size in self.recent) / min(PROGRESS_RATE_WINDOW, elapsed)
+            sent_parts = len(self.latencies)
+            # size of stream unknown until its end:
+            remaining = self.size - self.bytes_done if self.size is not None else None
+            return dict(
+                **self.ident, elapsed=round(elapsed, 3),
+                bytes_done=self.bytes_done, bytes_sent=self.bytes_sent, bytes_total=self.size,
+                parts_done=self.parts_done, parts_failed=self.parts_failed, parts_total=self.parts_total,
+                throughput=round(current), avg_throughput=round(average),
+                latency_p50=percentile(self.latencies, 50), latency_p95=percentile(self.latencies, 95),
+                latency_p99=percentile(self.latencies, 99), retries=self.retries,
+                presign_hit_rate=round(self.presign_hits / sent_parts, 3) if sent_parts else None,
+                eta=round(remaining / average, 1) if remaining is not None and average > 0 else
+                    (0 if remaining == 0 else None),
+                streams=self.limiter.limit if self.limiter is not None else None)
+
+    def emit_progress(self):
+        if self.stream is not None: self.stream.emit('progress', **self.snapshot())
+
+    def end(self, status, location=None, message=None):
+        if self.stream is None: return
+        self.stream.untrack(self)
+        self.stream.emit('end', **self.snapshot(), status=status, location=location,
+                         message=str(message) if message is not None else None)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+""" OARepo S3 client retry policy. """
+
+import email.utils, random, threading, time, logging
+import requests
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+
+from oarepo_s3_cli.constants import *
+
+logger = logging
+
+RETRY_OK, RETRY, RETRY_THROTTLED, RETRY_PRESIGN, RETRY_FATAL = 'ok', 'retry', 'throttled', 'presign', 'fatal'
+
+# transport errors - request may be repeated (local I/O errors, bare OSError, are fatal):
+TRANSPORT_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError, Urllib3HTTPError)
+
+
+class RetryPolicy(object):
+    """ retries of HTTP requests: response classification, exponential backoff with full jitter
+        (or Retry-After) and retry budget shared by all requests of client: every first attempt
+        deposits RETRY_BUDGET_RATIO of a retry, so a failing server gets no retry storm;
+        throttled requests (429, 503 SlowDown) are slowed down by backoff only, without budget """
+    def __init__(self, max_retries=MAX_RETRIES, base=RETRY_BASE_SLEEP, cap=RETRY_MAX_SLEEP,
+                 ratio=RETRY_BUDGET_RATIO, reserve=RETRY_BUDGET_MIN, max_throttled=MAX_THROTTLED_RETRIES):
+        self.max_retries = max_retries
+        self.max_throttled = max_throttled
+        self.base = base
+        self.cap = cap
+        self.ratio = ratio
+        self.reserve = reserve
+        self.tokens = reserve
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # budget of worker process (process engine) starts again:
+        state = dict(self.__dict__)
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def classify(self, resp=None, exc=None, idempotent=True, presigned=False):
+        if exc is not None:
+            if not isinstance(exc, TRANSPORT_ERRORS): return RETRY_FATAL
+            # request not sent at all is always safe to repeat:
+            connect = isinstance(exc, requests.exceptions.ConnectTimeout) or \
+                'NewConnectionError' in repr(exc)
+            return RETRY if idempotent or connect else RETRY_FATAL
+        code = resp.status_code
+        if code < 400:
+            return RETRY_OK
+        if code in (429, 503):
+            # throttled (SlowDown), request not processed:
+            return RETRY_THROTTLED
+        if not idempotent:
+            return RETRY_FATAL
+        if code in RETRY_STATUS_CODES or (code == 400 and 'RequestTimeout' in resp.text):
+            return RETRY
+        if code == 403 and presigned:
+            # expired (or otherwise rejected) presigned URL - new presign:
+            return RETRY_PRESIGN
+        return RETRY_FATAL
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.tokens + self.ratio, self.reserve)
+
+    def max_attempts(self, action=RETRY):
+        return self.max_throttled if action == RETRY_THROTTLED else self.max_retries
+
+    def allow(self, attempt, action=RETRY):
+        """ may retry number attempt (1..) be made - withdraws budget """
+        if attempt > self.max_attempts(action): return False
+        if action == RETRY_THROTTLED: return True
+        with self.lock:
+            if self.tokens < 1:
+                logger.debug(f"retry budget exhausted")
+                return False
+            self.tokens -= 1
+        return True
+
+    def delay(self, attempt, resp=None):
+        retry_after = get_retry_after(resp)
+        if retry_after is not None:
+            return min(retry_after, self.cap)
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+    def sleep(self, attempt, resp=None):
+        time.sleep(self.delay(attempt, resp))
+
+    def request(self, func, url, idempotent=True, **kwargs):
+        """ func(url, **kwargs) (session.get, ...) retried by policy, response of last attempt returned """
+        self.deposit()
+        attempt = 0
+        while True:
+            resp, exc = None, None
+            try:
+                resp = func(url, **kwargs)
+            except Exception as e:
+                exc = e
+            action = self.classify(resp, exc, idempotent)
+            attempt += 1
+            if action not in (RETRY, RETRY_THROTTLED) or not self.allow(attempt, action):
+                if exc is not None: raise exc
+                return resp
+            logger.debug(f"retry {attempt} of {url} ({resp.status_code if resp is not None else exc})")
+            self.sleep(attempt, resp)
+
+
+def get_retry_after(resp):
+    value = resp.headers.get('Retry-After') if resp is not None else None
+    if value is None: return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
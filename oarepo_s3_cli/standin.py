@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+""" Local OARepo + S3 stand-in server for benchmarks and tests.
+
+    python -m oarepo_s3_cli.standin [--port 8443] [--latency 20] [--bandwidth 100M] [--errors 0.01] ...
+
+OARepo files API (token status, multipart init, presign, parts, complete, abort, token revoke)
+and presigned S3 part PUTs and object GETs (Range) on 127.0.0.1, with multipart ETags computed
+from the data received. Latency, bandwidth, throttling (503 SlowDown), error injection (500) and
+presigned URL expiry are configurable.
+"""
+
+import hashlib, json, os, random, re, shutil, ssl, subprocess, tempfile, threading, time, uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, quote, unquote
+import click
+
+from oarepo_s3_cli.bandwidth import TokenBucket, parse_rate
+
+FILES_PATH = '/draft/records/1/files/'
+CHUNK_SIZE = 256 * 1024
+
+
+def make_cert(tmpdir):
+    """ self-signed certificate for 127.0.0.1 (needs openssl binary) """
+    cert, key = os.path.join(tmpdir, 'cert.pem'), os.path.join(tmpdir, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-subj', '/CN=127.0.0.1', '-keyout', key, '-out', cert],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return cert, key
+
+
+class Upload(object):
+    def __init__(self, key, size):
+        self.key = key
+        self.size = size
+        self.parts = {}     # partNum: (ETag, size, stored file or None)
+
+
+class StoredObject(object):
+    """ completed upload: parts in order and multipart ETag """
+    def __init__(self, parts, etag):
+        self.parts = parts  # [(size, stored file or None)]
+        self.size = sum(size for size, file in parts)
+        self.etag = etag
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, code, body=None, headers=None):
+        data = b'' if body is None else json.dumps(body).encode()
+        self.send_response(code)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self, md5=None, fh=None):
+        remain = int(self.headers.get('Content-Length', 0))
+        while remain > 0:
+            chunk = self.rfile.read(min(remain, CHUNK_SIZE))
+            if not chunk: break
+            self.server.transfer('bytes_in', len(chunk))
+            if md5 is not None: md5.update(chunk)
+            if fh is not None: fh.write(chunk)
+            remain -= len(chunk)
+        return int(self.headers.get('Content-Length', 0)) - remain
+
+    def begin(self):
+        srv = self.server
+        srv.count('requests')
+        if srv.latency: time.sleep(srv.latency)
+        return srv, urlparse(self.path)
+
+    def authorized(self):
+        token = self.server.token
+        if token is None or self.headers.get('Authorization') == f'Bearer {token}':
+            return True
+        self.read_body()
+        self.reply(401, {'status': 'Unauthorized'})
+        return False
+
+    def presigned_valid(self, url):
+        """ presigned URL not expired (X-Amz-Date + X-Amz-Expires) """
+        q = parse_qs(url.query)
+        try:
+            return time.time() <= float(q['X-Amz-Date'][0]) + float(q['X-Amz-Expires'][0])
+        except (KeyError, ValueError):
+            return False
+
+    def do_GET(self):
+        srv, url = self.begin()
+        path = url.path
+        if path.startswith('/s3/'):
+            return self.get_object(url)
+        if not self.authorized(): return
+        if path == '/access-tokens/status':
+            return self.reply(200, {'status': 'OK', 'links': {'files': f'{srv.base_url}{FILES_PATH}'}})
+        if path == FILES_PATH:
+            # files listing, checksum of object uploaded in one request is its MD5:
+            return self.reply(200, {'entries': [
+                {'key': key, 'size': obj.size, 'checksum': f"{'etag' if '-' in obj.etag else 'md5'}:{obj.etag}"}
+                for key, obj in sorted(srv.objects.items())]})
+        m = re.match(f'^{FILES_PATH}(.+)/([^/]+)/([0-9,]+)/presigned$', path)
+        if m and m.group(2) in srv.uploads:
+            uploadId, pnums = m.group(2), m.group(3).split(',')
+            return self.reply(200, {'presignedUrls': {pn: srv.presign(f'/s3/{uploadId}/{pn}') for pn in pnums}})
+        m = re.match(f'^{FILES_PATH}(.+)/([^/]+)/parts$', path)
+        if m and m.group(2) in srv.uploads:
+            parts = srv.uploads[m.group(2)].parts
+            return self.reply(200, [{'ETag': parts[pn][0], 'PartNumber': pn, 'Size': parts[pn][1]}
+                                    for pn in sorted(parts)])
+        m = re.match(f'^{FILES_PATH}(.+)$', path)
+        if m and unquote(m.group(1)) in srv.objects:
+            # files API redirects to presigned S3 object URL (Range kept by client):
+            location = srv.presign(f'/s3/objects/{m.group(1)}')
+            return self.reply(302, headers={'Location': location})
+        self.reply(404)
+
+    def get_object(self, url):
+        srv = self.server
+        m = re.match('^/s3/objects/(.+)$', url.path)
+        obj = srv.objects.get(unquote(m.group(1))) if m else None
+        if obj is None:
+            return self.reply(404)
+        if not self.presigned_valid(url):
+            return self.reply(403, {'Code': 'AccessDenied'})
+        if any(file is None for size, file in obj.parts):
+            # data not stored (store=False):
+            return self.reply(501, {'Code': 'NotImplemented'})
+        first, last, code = 0, obj.size - 1, 200
+        m = re.match('^bytes=([0-9]+)-([0-9]*)$', self.headers.get('Range', ''))
+        if m:
+            first = int(m.group(1))
+            last = min(int(m.group(2)), obj.size - 1) if m.group(2) else obj.size - 1
+            if first >= obj.size:
+                return self.reply(416, headers={'Content-Range': f'bytes */{obj.size}'})
+            code = 206
+        srv.count('gets')
+        self.send_response(code)
+        if code == 206: self.send_header('Content-Range', f'bytes {first}-{last}/{obj.size}')
+        self.send_header('ETag', f'"{obj.etag}"')
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(last - first + 1))
+        self.end_headers()
+        offset = 0
+        for size, file in obj.parts:
+            lo, hi = max(first, offset), min(last + 1, offset + size)
+            if lo < hi:
+                with open(file, 'rb') as fh:
+                    fh.seek(lo - offset)
+                    remain = hi - lo
+                    while remain > 0:
+                        chunk = fh.read(min(remain, CHUNK_SIZE))
+                        srv.transfer('bytes_out', len(chunk))
+                        self.wfile.write(chunk)
+                        remain -= len(chunk)
+            offset += size
+
+    def do_PUT(self):
+        srv, url = self.begin()
+        if url.path.startswith(FILES_PATH):
+            return self.put_direct(url)
+        m = re.match('^/s3/([^/]+)/([0-9]+)$', url.path)
+        if not m or m.group(1) not in srv.uploads:
+            self.read_body()
+            return self.reply(404)
+        if not self.presigned_valid(url):
+            self.read_body()
+            srv.count('expired')
+            return self.reply(403, {'Code': 'AccessDenied', 'Message': 'Request has expired'})
+        if srv.throttled():
+            self.read_body()
+            srv.count('throttled')
+            return self.reply(503, {'Code': 'SlowDown'}, headers={'Connection': 'keep-alive'})
+        uploadId, pn = m.group(1), int(m.group(2))
+        md5 = hashlib.md5()
+        file = os.path.join(srv.datadir, f'{uploadId}.{pn}') if srv.datadir is not None else None
+        with open(file, 'wb') if file is not None else open(os.devnull, 'wb') as fh:
+            size = self.read_body(md5, fh if file is not None else None)
+        if srv.inject_error():
+            srv.count('errors')
+            return self.reply(500, {'Code': 'InternalError'})
+        srv.count('parts')
+        etag = md5.hexdigest()
+        upload = srv.uploads.get(uploadId)
+        if upload is not None: upload.parts[pn] = (etag, size, file)
+        self.reply(200, headers={'ETag': f'"{etag}"'})
+
+    def put_direct(self, url):
+        """ direct upload of whole file to files API (direct=True) """
+        srv = self.server
+        if not self.authorized(): return
+        key = unquote(url.path[len(FILES_PATH):])
+        if not srv.direct or not key:
+            self.read_body()
+            return self.reply(405, {'status': 'Method not allowed'})
+        md5 = hashlib.md5()
+        file = os.path.join(srv.datadir, f'direct.{uuid.uuid4().hex}') if srv.datadir is not None else None
+        with open(file, 'wb') if file is not None else open(os.devnull, 'wb') as fh:
+            size = self.read_body(md5, fh if file is not None else None)
+        srv.count('direct')
+        srv.objects[key] = StoredObject([(size, file)], md5.hexdigest())
+        self.reply(201, {'key': key, 'size': size, 'checksum': f'md5:{md5.hexdigest()}',
+                         'links': {'self': f'{srv.base_url}{FILES_PATH}{quote(key)}'}})
+
+    def do_POST(self):
+        srv, url = self.begin()
+        if not self.authorized(): return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if url.path == FILES_PATH and url.query == 'multipart=true':
+            info = json.loads(body)
+            uploadId = uuid.uuid4().hex
+            # size of stream unknown at init - sent by complete:
+            srv.uploads[uploadId] = Upload(info['key'], info.get('size'))
+            return self.reply(201, {'key': info['key'], 'uploadId': uploadId})
+        m = re.match(f'^{FILES_PATH}(.+)/([^/]+)/complete$', url.path)
+        if m and m.group(2) in srv.uploads:
+            upload = srv.uploads[m.group(2)]
+            body = json.loads(body)
+            parts = body['parts']
+            if any(upload.parts.get(p['PartNumber'], (None,))[0] != p['ETag'] for p in parts):
+                return self.reply(400, {'Code': 'InvalidPart'})
+            size = body.get('size', upload.size)
+            if size is not None and size != sum(upload.parts[p['PartNumber']][1] for p in parts):
+                return self.reply(400, {'Code': 'IncompleteBody'})
+            digests = b''.join(bytes.fromhex(p['ETag']) for p in parts)
+            checksum = f'{hashlib.md5(digests).hexdigest()}-{len(parts)}'
+            srv.uploads.pop(m.group(2))
+            srv.objects[unquote(m.group(1))] = StoredObject(
+                [upload.parts[p['PartNumber']][1:] for p in parts], checksum)
+            return self.reply(200, {'location': f'{srv.base_url}{FILES_PATH}{m.group(1)}',
+                                    'checksum': f'etag:{checksum}'})
+        if url.path == '/access-tokens/revoke':
+            return self.reply(200)
+        self.reply(404)
+
+    def do_DELETE(self):
+        srv, url = self.begin()
+        if not self.authorized(): return
+        m = re.match(f'^{FILES_PATH}(.+)/([^/]+)/abort$', url.path)
+        upload = srv.uploads.pop(m.group(2), None) if m else None
+        if upload is not None:
+            for etag, size, file in upload.parts.values():
+                if file is not None and os.path.exists(file): os.unlink(file)
+            return self.reply(200)
+        self.reply(404)
+
+
+class StandinServer(ThreadingHTTPServer):
+    """ OARepo files API + presigned S3 on 127.0.0.1, counting connections, requests and bytes;
+        latency: seconds added to each request, bandwidth: bytes/s of all transfers, throttle:
+        part PUTs per second above which 503 SlowDown is answered, errors: probability of part
+        PUT answered 500, expires: validity of presigned URLs, store: part data kept (GET, check),
+        direct: direct upload of whole file by PUT to files API (405 otherwise) """
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, port=0, tls=True, throttle=0, latency=0, bandwidth=None, errors=0, expires=3600,
+                 store=True, token=None, seed=None, direct=True):
+        super().__init__(('127.0.0.1', port), StandinHandler)
+        self.stats = {'connections': 0, 'requests': 0, 'parts': 0, 'throttled': 0, 'errors': 0, 'expired': 0,
+                      'gets': 0, 'direct': 0, 'bytes_in': 0, 'bytes_out': 0}
+        self.throttle = throttle
+        self.latency = latency
+        self.bucket = TokenBucket(bandwidth) if bandwidth else None
+        self.errors = errors
+        self.expires = expires
+        self.token = token
+        self.direct = direct
+        self.random = random.Random(seed)
+        self.window = (0, 0)   # second, PUTs in it
+        self.lock = threading.Lock()
+        self.uploads = {}
+        self.objects = {}
+        self.tmpdir = tempfile.mkdtemp(prefix='oarepo-s3-standin-')
+        self.datadir = self.tmpdir if store else None
+        self.ssl_context = None
+        if tls:
+            self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self.ssl_context.load_cert_chain(*make_cert(self.tmpdir))
+        scheme = 'https' if tls else 'http'
+        self.base_url = f'{scheme}://127.0.0.1:{self.server_address[1]}'
+
+    def count(self, name, i=1):
+        with self.lock:
+            self.stats[name] += i
+
+    def transfer(self, name, nbytes):
+        self.count(name, nbytes)
+        if self.bucket is not None: self.bucket.consume(nbytes)
+
+    def presign(self, path):
+        return f'{self.base_url}{path}?X-Amz-Date={time.time():.3f}&X-Amz-Expires={self.expires}'
+
+    def throttled(self):
+        if not self.throttle: return False
+        with self.lock:
+            second, puts = self.window
+            now = int(time.time())
+            if now != second: second, puts = now, 0
+            self.window = (second, puts + 1)
+            return puts >= self.throttle
+
+    def inject_error(self):
+        if not self.errors: return False
+        with self.lock:
+            return self.random.random() < self.errors
+
+    def reset_stats(self):
+        with self.lock:
+            for k in self.stats: self.stats[k] = 0
+
+    def process_request(self, request, client_address):
+        self.count('connections')
+        super().process_request(request, client_address)
+
+    def finish_request(self, request, client_address):
+        if self.ssl_context is not None:
+            # TLS handshake in the handler thread (one per accepted connection):
+            request = self.ssl_context.wrap_socket(request, server_side=True)
+        super().finish_request(request, client_address)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
+@click.command()
+@click.option('--port', default=0, show_default=True, help='port (0: any free port)')
+@click.option('--tls/--no-tls', default=True, show_default=True, help='HTTPS with self-signed certificate')
+@click.option('--latency', default=0.0, show_default=True, help='ms added to each request')
+@click.option('--bandwidth', default=None, help='bytes/s of all transfers (K/M/G suffix) [default: unlimited]')
+@click.option('--throttle', default=0, show_default=True, help='part PUTs per second, 503 SlowDown above (0: off)')
+@click.option('--errors', default=0.0, show_default=True, help='probability of part PUT answered 500')
+@click.option('--expires', default=3600, show_default=True, help='presigned URL validity [s]')
+@click.option('--store/--no-store', default=True, show_default=True, help='keep uploaded data (download, check)')
+@click.option('--token', default=None, help='required access token [default: any]')
+@click.option('--direct/--no-direct', default=True, show_default=True, help='direct upload (PUT) of small files')
+def main(port, tls, latency, bandwidth, throttle, errors, expires, store, token, direct):
+    srv = StandinServer(port, tls, throttle, latency / 1000, parse_rate(bandwidth), errors, expires, store, token,
+                        direct=direct)
+    click.echo(f"stand-in server on {srv.base_url}, e.g.:\n"
+               f"  oarepo-s3-cli -e {srv.base_url} -t {token or 'x'} upload -f <file>")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.server_close()
+        shutil.rmtree(srv.tmpdir, ignore_errors=True)
+        click.echo(f"\n{srv.stats}")
+
+
+if __name__ == '__main__':
+    main()
@@ -6,12 +6,20 @@
 # it under the terms of the MIT License; see LICENSE file for more details.
 """ OARepo S3 client utils. """
 
-import click, hashlib, requests, signal, sys, time
+import click, collections, glob, hashlib, json, re, requests, signal, sys, threading, time
 import os.path
+from urllib.parse import urlparse, parse_qs
 import multiprocessing as mp
+from multiprocessing.pool import ThreadPool
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 from oarepo_s3_cli.constants import *
+from oarepo_s3_cli.retry import RETRY, RetryPolicy
 
-def get_file_chunk_size(file_size):
+_sessions = {}
+
+def get_file_chunk_size(file_size, part_size=0):
     def getnumchunks(file_size, chunk_size):
         num = int(file_size / chunk_size)
         remain = file_size % chunk_size
@@ -20,6 +28,15 @@ def get_file_chunk_size(file_size):
             last_size = remain
             num += 1
         return num, chunk_size, last_size
+    if part_size:
+        if file_size <= part_size:
+            return 1, file_size, file_size
+        if part_size < MIN_PART_SIZE or part_size > MAX_S3_PART_SIZE:
+            raise Exception(f"Part size {part_size} out of range ({MIN_PART_SIZE}-{MAX_S3_PART_SIZE})",
+                            STATUS_WRONG_PART_SIZE)
+        if file_size > MAX_PARTS * part_size:
+            raise Exception(f"Part size {part_size} too small (MAX_PARTS exceeded)", STATUS_WRONG_PART_SIZE)
+        return getnumchunks(file_size, part_size)
     # return Math.min(Math.max(MIN_PART_SIZE, Math.ceil(file_size / MAX_PARTS)), MAX_PART_SIZE)
     if file_size <= MIN_PART_SIZE:
         return 1, file_size, file_size
@@ -32,6 +49,85 @@ def get_file_chunk_size(file_size):
     else:
         raise Exception(f"Unsupported file size (MAX_PARTS and MAX_PART_SIZE exceeded)", STATUS_WRONG_FILE)
 
+def plan_part_size(file_size, parallel=MAX_PARALLEL, throughput=None):
+    """ auto part size: every stream gets PARTS_PER_STREAM parts at least, parts are large enough
+        to keep request overhead low (PART_TARGET_SECS per part with known throughput [B/s])
+        and S3 limits (MIN_PART_SIZE, MAX_PARTS) are kept """
+    parallel = max(parallel, 1)
+    low = max(MIN_PART_SIZE, -(-file_size // MAX_PARTS))
+    high = min(MAX_PART_SIZE, file_size // (parallel * PARTS_PER_STREAM))
+    size = high if not throughput else int(throughput / parallel * PART_TARGET_SECS)
+    size = max(low, min(size, high))
+    size = -(-size // PART_SIZE_ALIGN) * PART_SIZE_ALIGN
+    return min(size, MAX_S3_PART_SIZE)
+
+def parse_part_size(value):
+    if value is None or value == 'auto':
+        return 'auto'
+    try:
+        return int(value)
+    except ValueError:
+        raise Exception(f"Invalid part size \"{value}\" (auto|<bytes>)", STATUS_WRONG_PART_SIZE)
+
+def get_https_verify(url):
+    # don't use certificates on localhost:
+    return not re.match(f"^https://127\\.0\\.0\\.1:", url)
+
+_timing = threading.local()
+
+def connect_secs():
+    """ seconds spent by this thread in connects (TCP, TLS handshake) so far """
+    return getattr(_timing, 'connect', 0)
+
+class TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.time()
+        try:
+            super().connect()
+        finally:
+            _timing.connect = connect_secs() + time.time() - start
+
+class TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        start = time.time()
+        try:
+            super().connect()
+        finally:
+            _timing.connect = connect_secs() + time.time() - start
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """ connections timed into connect_secs() (part spans of --profile) """
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': TimedHTTPConnectionPool,
+                                                   'https': TimedHTTPSConnectionPool}
+
+def get_session(pool_size=1):
+    """ persistent (keep-alive) HTTP session, one per worker process """
+    pid = os.getpid()
+    session = _sessions.get(pid)
+    if session is None:
+        # sessions inherited from parent process by fork must not be reused:
+        _sessions.clear()
+        session = requests.Session()
+        session.pool_size = 0
+        _sessions[pid] = session
+    if session.pool_size < pool_size:
+        replaced = {id(session.adapters[prefix]): session.adapters[prefix] for prefix in ('https://', 'http://')}
+        adapter = TimedHTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.pool_size = pool_size
+        # idle connections of smaller pool closed, connections in use closed when released:
+        for old in replaced.values(): old.close()
+    return session
+
 def funcname(colon=True):
     frame = sys._getframe(1)
     argv0 = os.path.basename(sys.argv[0])
@@ -116,13 +212,13 @@ class Stats(object):
         return self.num_parts - self.finished - self.failed
 
 class SharedList():
-    def __init__(self, action, unfin, grouplen, maxlen):
+    def __init__(self, action, unfin, grouplen, maxlen, shared=True):
         self.action = action
         self.unfin = unfin
         self.grouplen = grouplen
         self.maxlen = maxlen
-        mpman = mp.Manager()
-        self.list = mpman.dict()
+        # shared between processes through manager, in-process dict for thread/async engine:
+        self.list = mp.Manager().dict() if shared else {}
         self.idx = 0
 
     def prepare(self, cnt=0):
@@ -162,6 +258,156 @@ class SharedList():
     def get_value(self, pn):
         return(self.list[pn])
 
+    def close(self):
+        pass
+
+def get_presign_expiry(url, default=PRESIGN_EXPIRES):
+    """ expiry time of just received presigned URL (S3 signature v4 or v2 query),
+        default validity if unknown """
+    query = parse_qs(urlparse(url).query)
+    try:
+        if 'X-Amz-Expires' in query:
+            # validity counted by local clock - server clock skew ignored:
+            return time.time() + int(query['X-Amz-Expires'][0])
+        if 'Expires' in query:
+            return int(query['Expires'][0])
+    except ValueError:
+        pass
+    return time.time() + default
+
+class PresignPrefetcher(object):
+    """ presigned part URLs fetched ahead by background thread (thread/async engines):
+        refilled below low-water mark raised with consumption rate, expired URLs presigned again,
+        workers wait for their URL on condition instead of sleeping; failed presign request hands
+        its awaited parts back to workers (presigned by themselves) and prefetch goes on after backoff """
+    def __init__(self, action, unfin, grouplen, maxlen, low_water=PRESIGN_LOW_WATER):
+        self.action = action
+        self.unfin = unfin
+        self.grouplen = grouplen
+        self.maxlen = maxlen
+        self.low_water = low_water
+        self.list = {}          # pn -> (url, expiry)
+        self.urgent = []        # parts wanted before their turn, expired parts
+        self.fetching = set()   # parts in running presign request
+        self.popped = set()
+        self.idx = 0            # next part of unfin for prefetch
+        self.pops = collections.deque(maxlen=PRESIGN_RATE_WINDOW)
+        self.latency = 0        # duration of last presign request
+        self.error = None       # last presign error
+        self.errors = 0         # presign requests failed in row
+        self.failed = set()     # awaited parts of failed request - presigned by worker
+        self.backoff = RetryPolicy()
+        self.closed = False
+        self.cond = threading.Condition()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def supply(self, cnt=0, min=0):
+        self.start()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def low_water_mark(self):
+        # URLs consumed during two presign requests at current pop rate:
+        rate = 0
+        if len(self.pops) > 1 and self.pops[-1] > self.pops[0]:
+            rate = (len(self.pops) - 1) / (self.pops[-1] - self.pops[0])
+        return min(self.maxlen, max(self.low_water, int(rate * self.latency * 2) + 1))
+
+    def expired(self, expiry, now):
+        return now > expiry - PRESIGN_EXPIRY_MARGIN
+
+    def next_batch(self):
+        now = time.time()
+        for pn, (url, expiry) in list(self.list.items()):
+            if self.expired(expiry, now):
+                del self.list[pn]
+                self.urgent.append(pn)
+        pnums = []
+        for pn in self.urgent:
+            if pn not in self.fetching and pn not in pnums and len(pnums) < self.grouplen:
+                pnums.append(pn)
+        self.urgent = [pn for pn in self.urgent if pn not in pnums]
+        if len(self.list) + len(self.fetching) < self.low_water_mark():
+            room = min(self.grouplen, self.maxlen - len(self.list) - len(self.fetching)) - len(pnums)
+            while room > 0 and self.idx < len(self.unfin):
+                pn = self.unfin[self.idx]
+                self.idx += 1
+                if pn in self.list or pn in self.fetching or pn in self.popped or pn in pnums: continue
+                pnums.append(pn)
+                room -= 1
+        self.fetching.update(pnums)
+        return pnums
+
+    def run(self):
+        while True:
+            with self.cond:
+                pnums = []
+                while not self.closed:
+                    if self.errors > 0:
+                        # backoff after failed presign request:
+                        self.cond.wait(self.backoff.delay(self.errors))
+                        if self.closed: break
+                    pnums = self.next_batch()
+                    if len(pnums) > 0: break
+                    self.cond.wait(PRESIGN_CHECK_INTERVAL)
+                if self.closed: return
+            start = time.time()
+            try:
+                # (presign request retried by client's retry policy)
+                vals = self.action(pnums)
+            except Exception as e:
+                with self.cond:
+                    self.fetching.difference_update(pnums)
+                    self.error = e
+                    self.errors += 1
+                    # awaited parts handed back to their workers, others fetched again:
+                    self.failed.update(pn for pn in pnums if pn in self.popped)
+                    self.urgent.extend(pn for pn in pnums if pn not in self.popped)
+                    self.cond.notify_all()
+                continue
+            with self.cond:
+                self.errors = 0
+                now = time.time()
+                self.latency = now - start
+                for pn in vals:
+                    # fresh URL usable for a while even with (v2) expiry in the past - no presign loop:
+                    self.list[pn] = (vals[pn], max(get_presign_expiry(vals[pn]), now + 2 * PRESIGN_EXPIRY_MARGIN))
+                self.fetching.difference_update(pnums)
+                self.cond.notify_all()
+
+    def has_key(self, pn):
+        with self.cond:
+            return pn in self.list and not self.expired(self.list[pn][1], time.time())
+
+    def pop(self, pn, timeout=PRESIGN_WAIT_TIMEOUT):
+        """ URL of part, waits until presigned, None on timeout or failed presigning """
+        deadline = time.time() + timeout
+        with self.cond:
+            self.start()
+            self.pops.append(time.time())
+            self.popped.add(pn)
+            while pn not in self.failed:
+                now = time.time()
+                url, expiry = self.list.pop(pn, (None, 0))
+                if url is not None and not self.expired(expiry, now):
+                    self.cond.notify_all()
+                    return url
+                if pn not in self.fetching and pn not in self.urgent:
+                    self.urgent.append(pn)
+                    self.cond.notify_all()
+                if now >= deadline: break
+                self.cond.wait(deadline - now)
+            self.failed.discard(pn)
+            return None
+
 class Spinner(object):
     def __init__(self):
         self.chars = '|/-\\'
@@ -173,31 +419,427 @@ class Spinner(object):
         self.index = self.index + 1 if self.index + 1 < self.len else 0
         return spinchar
 
-def get_local_hash(file, _part_size=0):
-    hashes = []
-    part_size = _part_size if _part_size!=0 else MIN_PART_SIZE
-    with open(file, "rb") as f:
-        while 1:
-            chunk = f.read(part_size)
+class FileSlice(object):
+    """ read-only file-like view of file bytes [offset, offset+size), streamed as HTTP body
+        and MD5 hashed on the way """
+    read_secs = 0       # time spent reading (and hashing)
+    read_end = None     # time of end-of-body read - body sent
+
+    def __init__(self, file, offset, size):
+        self.offset = offset
+        self.size = size
+        self.pos = 0
+        self.md5 = hashlib.md5()
+        self.fh = open(file, 'rb')
+        self.fh.seek(offset)
+        # kernel reads the part ahead while its beginning is sent:
+        fadvise_willneed(self.fh.fileno(), offset, size)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(STREAM_CHUNK_SIZE)
             if not chunk: break
-            hashes.append(hashlib.md5(chunk).digest())
-    local_hash = hashlib.md5(b''.join(hashes)).hexdigest() + '-' + str(len(hashes))
-    return local_hash
+            yield chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read(self, n=-1):
+        remain = self.size - self.pos
+        if n is None or n < 0 or n > remain: n = remain
+        if n == 0:
+            if self.read_end is None: self.read_end = time.time()
+            return b''
+        start = time.time()
+        data = self.fh.read(n)
+        if self.md5 is not None: self.md5.update(data)
+        self.pos += len(data)
+        self.read_secs += time.time() - start
+        return data
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR: pos += self.pos
+        elif whence == os.SEEK_END: pos += self.size
+        self.pos = min(max(pos, 0), self.size)
+        self.fh.seek(self.offset + self.pos)
+        # hash is valid for sequential read from the beginning only:
+        self.md5 = hashlib.md5() if self.pos == 0 else None
+        return self.pos
+
+    def hexdigest(self):
+        if self.md5 is None or self.pos != self.size: return None
+        return self.md5.hexdigest()
+
+    def close(self):
+        self.fh.close()
+
+def fadvise_willneed(fd, offset, size):
+    if hasattr(os, 'posix_fadvise') and size > 0:
+        try:
+            os.posix_fadvise(fd, offset, size, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+
+class PartBuffer(FileSlice):
+    """ part read ahead into memory by PartReader, streamed like FileSlice, MD5 computed by reader """
+    def __init__(self, data, md5):
+        self.data = memoryview(data)
+        self.size = len(data)
+        self.pos = 0
+        self.digest = md5
+
+    def read(self, n=-1):
+        remain = self.size - self.pos
+        if n is None or n < 0 or n > remain: n = remain
+        if n == 0 and self.read_end is None: self.read_end = time.time()
+        data = bytes(self.data[self.pos:self.pos + n])
+        self.pos += n
+        return data
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR: pos += self.pos
+        elif whence == os.SEEK_END: pos += self.size
+        self.pos = min(max(pos, 0), self.size)
+        return self.pos
+
+    def hexdigest(self):
+        return self.digest
+
+    def close(self):
+        pass
+
+class PartReader(object):
+    """ read-ahead stage: parts read (and MD5 hashed) in upload order by reader threads
+        into memory ahead of senders, bytes of parts read and not released bounded by max_bytes """
+    def __init__(self, file, parts, get_range, max_bytes, threads=READAHEAD_THREADS):
+        self.parts = list(parts)     # upload order
+        self.order = {pn: i for i, pn in enumerate(self.parts)}
+        self.get_range = get_range
+        self.max_bytes = max_bytes
+        self.buffers = {}            # pn -> data, md5 or exception
+        self.sizes = {}              # pn -> size of part read or being read
+        self.idx = 0
+        self.closed = False
+        self.cond = threading.Condition()
+        self.fd = os.open(file, os.O_RDONLY)
+        self.threads = [threading.Thread(target=self.run, daemon=True) for i in range(threads)]
+        for thread in self.threads: thread.start()
 
-def get_remote_hash(token, url, _part_size=0):
-    hashes = []
+    @property
+    def used(self):
+        return sum(self.sizes.values())
+
+    def read_part(self, pn):
+        offset, size = self.get_range(pn)
+        data, md5, pos = bytearray(size), hashlib.md5(), 0
+        view = memoryview(data)
+        while pos < size:
+            n = os.preadv(self.fd, [view[pos:]], offset + pos)
+            if n == 0: raise EOFError(f"File shorter than expected (part {pn})")
+            pos += n
+        md5.update(data)
+        return data, md5.hexdigest()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.closed and self.idx < len(self.parts):
+                    size = self.get_range(self.parts[self.idx])[1]
+                    # one part larger than buffer limit is read alone:
+                    if len(self.sizes) == 0 or self.used + size <= self.max_bytes: break
+                    self.cond.wait()
+                if self.closed or self.idx >= len(self.parts): return
+                pn = self.parts[self.idx]
+                self.idx += 1
+                self.sizes[pn] = size
+                following = self.parts[self.idx] if self.idx < len(self.parts) else None
+            if following is not None:
+                fadvise_willneed(self.fd, *self.get_range(following))
+            try:
+                res = self.read_part(pn)
+            except Exception as e:
+                res = e
+            with self.cond:
+                if pn in self.sizes: self.buffers[pn] = res
+                self.cond.notify_all()
+
+    def get(self, pn, timeout=None):
+        """ part body (PartBuffer), None for part not read by reader """
+        with self.cond:
+            if pn not in self.sizes and self.order.get(pn, -1) < self.idx: return None
+            if not self.cond.wait_for(lambda: pn in self.buffers or self.closed, timeout): return None
+            res = self.buffers.get(pn)
+        if res is None: return None
+        if isinstance(res, Exception): raise res
+        return PartBuffer(*res)
+
+    def release(self, pn):
+        with self.cond:
+            self.buffers.pop(pn, None)
+            self.sizes.pop(pn, None)
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.buffers.clear()
+            self.sizes.clear()
+            self.cond.notify_all()
+        for thread in self.threads: thread.join()
+        os.close(self.fd)
+
+class StreamReader(object):
+    """ parts of stream of unknown size (pipe, stdin) read sequentially into memory (and MD5 hashed)
+        for upload, like PartReader; parts read and not released bounded by max_parts, part size
+        doubled every growth parts so that MAX_PARTS parts hold the largest S3 object """
+    def __init__(self, stream, part_size, max_parts, growth=STREAM_GROWTH_PARTS):
+        self.stream = stream
+        self.part_size = part_size
+        self.max_parts = max_parts
+        self.growth = growth
+        self.buffers = {}       # pn -> data, md5
+        self.ranges = {}        # pn -> offset, size
+        self.next = 1
+        self.size = 0           # bytes read
+        self.eof = False
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def get_part_size(self, pn):
+        return min(self.part_size << ((pn - 1) // self.growth), MAX_S3_PART_SIZE)
+
+    def read(self):
+        """ number of next part read (waits for free buffer), None at end of stream """
+        if self.eof: return None
+        with self.cond:
+            self.cond.wait_for(lambda: len(self.buffers) < self.max_parts or self.closed)
+            if self.closed: return None
+        pn, size = self.next, self.get_part_size(self.next)
+        data, pos = bytearray(size), 0
+        with memoryview(data) as view:
+            while pos < size:
+                n = self.stream.readinto(view[pos:])
+                if not n:
+                    self.eof = True
+                    break
+                pos += n
+        # stream ended at part boundary (empty stream is one empty part):
+        if pos == 0 and pn > 1: return None
+        del data[pos:]
+        with self.cond:
+            self.buffers[pn] = (data, hashlib.md5(data).hexdigest())
+            self.ranges[pn] = (self.size, pos)
+        self.size += pos
+        self.next += 1
+        return pn
+
+    def range(self, pn):
+        return self.ranges[pn]
+
+    def get(self, pn, timeout=None):
+        with self.cond:
+            res = self.buffers.get(pn)
+        if res is None:
+            raise Exception(f"Part {pn} of stream not in memory (can't be read again).", STATUS_WRONG_FILE)
+        return PartBuffer(*res)
+
+    def release(self, pn):
+        with self.cond:
+            self.buffers.pop(pn, None)
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.buffers.clear()
+            self.cond.notify_all()
+
+def is_md5(etag):
+    return etag is not None and re.match('^[0-9a-f]{32}$', etag) is not None
+
+def get_multipart_etag(digests):
+    """ S3 multipart ETag from ordered part MD5 digests (bytes or hex strings) """
+    digests = [bytes.fromhex(d) if isinstance(d, str) else d for d in digests]
+    return hashlib.md5(b''.join(digests)).hexdigest() + '-' + str(len(digests))
+
+def get_part_md5(fd, offset, size):
+    """ MD5 digest of file part, os.pread doesn't move shared file offset """
+    md5 = hashlib.md5()
+    while size > 0:
+        chunk = os.pread(fd, min(size, STREAM_CHUNK_SIZE), offset)
+        if not chunk: break
+        md5.update(chunk)
+        offset += len(chunk)
+        size -= len(chunk)
+    return md5.digest()
+
+def get_local_hash(file, _part_size=0, parallel=1):
+    part_size = _part_size if _part_size!=0 else MIN_PART_SIZE
+    fd = os.open(file, os.O_RDONLY)
+    try:
+        file_size = os.fstat(fd).st_size
+        parts = [(fd, offset, min(part_size, file_size - offset)) for offset in range(0, file_size, part_size)]
+        if parallel > 1 and len(parts) > 1:
+            # hashlib and os.pread release GIL, ordered results from starmap:
+            with ThreadPool(min(parallel, len(parts))) as pool:
+                hashes = pool.starmap(get_part_md5, parts)
+        else:
+            hashes = [get_part_md5(*part) for part in parts]
+    finally:
+        os.close(fd)
+    return get_multipart_etag(hashes)
+
+def get_remote_size(token, url, session=None, retry=None):
+    """ remote object size from ranged GET, None if server ignores Range """
+    headers = {
+        'Authorization': f"Bearer {token}",
+        'Range': 'bytes=0-0'
+    }
+    session = session or get_session()
+    retry = retry or RetryPolicy()
+    with retry.request(session.get, url, stream=True, headers=headers, verify=get_https_verify(url)) as resp:
+        m = re.match('^bytes (0-0|\\*)/([0-9]+)$', resp.headers.get('Content-Range', ''))
+        if resp.status_code == 416 and m:
+            return int(m.group(2))
+        if resp.status_code >= 400:
+            raise Exception(f"Can't read remote file.", STATUS_GENERAL_ERROR)
+        return int(m.group(2)) if resp.status_code == 206 and m else None
+
+def get_remote_part(token, url, offset, size, fd=None, session=None, retry=None):
+    """ MD5 digest of remote range [offset, offset+size), written to fd at offset if given;
+        range read again when connection breaks while body is received """
+    headers = {
+        'Authorization': f"Bearer {token}",
+        'Range': f"bytes={offset}-{offset+size-1}"
+    }
+    session = session or get_session()
+    retry = retry or RetryPolicy()
+    attempt = 0
+    while True:
+        md5, received = hashlib.md5(), 0
+        try:
+            with retry.request(session.get, url, stream=True, headers=headers, verify=get_https_verify(url)) as resp:
+                if resp.status_code != 206:
+                    raise Exception(f"Can't read remote file range (http code {resp.status_code}).",
+                                    STATUS_GENERAL_ERROR)
+                for chunk in resp.iter_content(STREAM_CHUNK_SIZE):
+                    md5.update(chunk)
+                    if fd is not None:
+                        view = memoryview(chunk)
+                        while len(view) > 0:
+                            written = os.pwrite(fd, view, offset + received)
+                            view, received = view[written:], received + written
+                    else:
+                        received += len(chunk)
+        except Exception as e:
+            attempt += 1
+            if retry.classify(exc=e) != RETRY or not retry.allow(attempt): raise
+            retry.sleep(attempt)
+            continue
+        if received != size:
+            raise Exception(f"Incomplete remote file range ({received} of {size} B).", STATUS_GENERAL_ERROR)
+        return md5.digest()
+
+def get_remote_parts(token, url, _part_size=0, parallel=1, fd=None, session=None, retry=None):
+    """ part MD5 digests of remote object read by concurrent Range requests aligned to part boundaries
+        (part size 0: auto), parts written to fd if given; None if server ignores Range """
+    session = session or get_session(parallel)
+    # one retry budget for all ranges:
+    retry = retry or RetryPolicy()
+    size = get_remote_size(token, url, session, retry)
+    if size is None:
+        return None
+    part_size = _part_size if _part_size != 0 else plan_part_size(size, parallel)
+    if fd is not None: os.ftruncate(fd, size)
+    parts = [(token, url, offset, min(part_size, size - offset), fd, session, retry)
+             for offset in range(0, size, part_size)]
+    if parallel > 1 and len(parts) > 1:
+        with ThreadPool(min(parallel, len(parts))) as pool:
+            return pool.starmap(get_remote_part, parts)
+    return [get_remote_part(*part) for part in parts]
+
+def get_remote_hash(token, url, _part_size=0, parallel=1, session=None, retry=None):
     part_size = _part_size if _part_size!=0 else MIN_PART_SIZE
+    retry = retry or RetryPolicy()
+    hashes = get_remote_parts(token, url, part_size, parallel, session=session, retry=retry)
+    if hashes is not None:
+        return get_multipart_etag(hashes)
+    # no Range support - one stream:
+    hashes = []
     headers = {
         'Authorization': f"Bearer {token}"
     }
-    resp = requests.get(url, stream=True, headers=headers, verify=False)
+    resp = retry.request((session or get_session()).get, url, stream=True, headers=headers,
+                         verify=get_https_verify(url))
     if resp.status_code >= 400:
         raise Exception(f"Can't read remote file.", STATUS_GENERAL_ERROR)
     for chunk in resp.iter_content(part_size):
         hashes.append(hashlib.md5(chunk).digest())
-    remote_hash = hashlib.md5(b''.join(hashes)).hexdigest() + '-' + str(len(hashes))
-    return remote_hash
-
+    return get_multipart_etag(hashes)
+
+
+def walk_files(top):
+    """ regular files under directory top, streamed (os.scandir, no full listing in memory) """
+    with os.scandir(top) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk_files(entry.path)
+            elif entry.is_file():
+                yield entry.path
+
+def source_key(path, base, prefix=None):
+    """ object key from path relative to base directory """
+    key = os.path.relpath(path, base).replace(os.sep, '/')
+    return key if prefix is None or prefix == '' else f"{prefix.rstrip('/')}/{key}"
+
+def iter_manifest(manifest):
+    """ (path, key, content type) from TSV or JSONL manifest, read line by line """
+    fh = sys.stdin if manifest == '-' else open(manifest, 'r')
+    try:
+        for num, line in enumerate(fh, 1):
+            line = line.rstrip('\n')
+            if line.strip() == '' or line.startswith('#'): continue
+            if line.lstrip().startswith('{'):
+                rec = json.loads(line)
+                vals = (rec.get('path'), rec.get('key'), rec.get('content_type'))
+            else:
+                vals = (line.split('\t') + [None, None])[:3]
+            path, key, content_type = (v if v != '' else None for v in vals)
+            if path is None:
+                raise Exception(f"Manifest {manifest} line {num}: missing path", STATUS_WRONG_FILE)
+            if key is None and not os.path.isabs(path) and not os.path.normpath(path).startswith('..'):
+                key = os.path.normpath(path).replace(os.sep, '/')
+            yield path, key, content_type
+    finally:
+        if fh is not sys.stdin: fh.close()
+
+def iter_upload_sources(files, keys=(), manifest=None):
+    """ (file, key, content type) of files, directories (recursive), glob patterns and manifest entries,
+        generated lazily; keys of directory and glob files are relative paths (prefixed by given key) """
+    for i, file in enumerate(files):
+        key = keys[i] if i < len(keys) else None
+        if os.path.isdir(file):
+            for path in walk_files(file):
+                yield path, source_key(path, file, key), None
+        elif glob.has_magic(file):
+            base = file
+            while glob.has_magic(base): base = os.path.dirname(base)
+            for path in glob.iglob(file, recursive=True):
+                if os.path.isfile(path):
+                    yield path, source_key(path, base or '.', key), None
+        else:
+            yield file, key, None
+    if manifest is not None:
+        yield from iter_manifest(manifest)
 
 class UploadFailedException(Exception):
     pass
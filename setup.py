@@ -38,7 +38,7 @@ install_requires = [
     'urllib3',
 ]
 
-packages = find_packages()
+packages = find_packages(exclude=['benchmarks', 'tests'])
 
 # Get the version string. Cannot be done with import!
 g = {}
@@ -7,7 +7,8 @@
 
 """Pytest configuration."""
 
-import hashlib, pytest, string, random, urllib3
+import hashlib, os, pytest, re, string, random, threading, urllib3
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import Mock
 
 fake_file_size = 1024
@@ -19,6 +20,12 @@ fake_file_info = Mock(
     hash_md5=hashlib.md5(hashlib.md5(fake_data.encode()).digest()).hexdigest()+'-1'
 )
 
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path, monkeypatch):
+    # upload journals of CLI tests kept out of user's state dir:
+    monkeypatch.setenv('OAREPO_S3_STATE_DIR', str(tmp_path / 'state'))
+    return str(tmp_path / 'state')
+
 @pytest.fixture(scope='module')
 def urllib3_reconf():
     urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -41,6 +48,88 @@ def mock_oarepo():
 def fake_file():
     return fake_file_info
 
+class RangeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        data = self.server.data
+        m = re.match('^bytes=([0-9]+)-([0-9]+)$', self.headers.get('Range', ''))
+        fault = self.server.faults.pop(0) if m is not None and self.server.faults else None
+        if fault == 500:
+            self.send_response(500)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if m is None:
+            code, body = 200, data
+        elif int(m.group(1)) >= len(data):
+            code, body = 416, b''
+            self.server.ranges.append(m.groups())
+        else:
+            first, last = int(m.group(1)), min(int(m.group(2)), len(data) - 1)
+            code, body = 206, data[first:last + 1]
+            self.server.ranges.append(m.groups())
+        self.send_response(code)
+        if code == 206:
+            self.send_header('Content-Range', f'bytes {first}-{last}/{len(data)}')
+        elif code == 416:
+            self.send_header('Content-Range', f'bytes */{len(data)}')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if fault == 'reset':
+            # connection broken in the middle of body:
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+@pytest.fixture()
+def range_server():
+    """ local HTTP server of random data with Range support """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    server.data = os.urandom(1000 * 1000 + 7)
+    server.ranges = []
+    server.faults = []      # 500 or 'reset' answered to next ranged GETs
+    server.url = f'http://127.0.0.1:{server.server_address[1]}/draft/records/1/files/range.dat'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+class SinkHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_PUT(self):
+        remain = int(self.headers.get('Content-Length', 0))
+        while remain > 0:
+            chunk = self.rfile.read(min(remain, 65536))
+            if not chunk: break
+            remain -= len(chunk)
+            with self.server.lock:
+                self.server.received += len(chunk)
+        self.send_response(200)
+        self.send_header('ETag', '"sink"')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+@pytest.fixture()
+def sink_server():
+    """ local HTTP server discarding PUT bodies, bytes received counted """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SinkHandler)
+    server.received = 0
+    server.lock = threading.Lock()
+    server.url = f'http://127.0.0.1:{server.server_address[1]}/sink'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
 class MockPoolApplyResults:
     def __init__(self, func, args, callback=None):
         print(f'MockPoolApplyResults: {args}')
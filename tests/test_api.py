@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Module api tests - library client without terminal output, signals or sys.exit."""
+
+import asyncio, os, signal, threading, pytest
+
+from oarepo_s3_cli import Client, OARepoS3Error
+from oarepo_s3_cli.constants import *
+from oarepo_s3_cli.standin import StandinServer
+
+
+@pytest.fixture
+def srv():
+    srv = StandinServer(tls=False).start()
+    yield srv
+    srv.stop()
+
+
+def test_client_upload(srv, tmp_path, capsys):
+    big, small = tmp_path / 'big.dat', tmp_path / 'small.dat'
+    big.write_bytes(os.urandom(3 * MIN_PART_SIZE + 1000))
+    small.write_bytes(os.urandom(1000))
+    events = []
+    handler = signal.getsignal(signal.SIGINT)
+    with Client(srv.base_url, 'tok', parallel=3, part_size=MIN_PART_SIZE, progress=events.append) as client:
+        result = client.upload(str(big), nocheck=False)
+        assert result.ok and result.key == 'big.dat' and result.size == big.stat().st_size
+        assert srv.objects['big.dat'].size == result.size
+        assert client.check(str(big)).match
+        client.upload(str(small), 'other.dat')
+        assert not client.check(str(big), 'other.dat')
+        down = client.download('big.dat', str(tmp_path / 'down.dat'))
+        assert down.size == result.size and (tmp_path / 'down.dat').read_bytes() == big.read_bytes()
+        results = client.upload_many([(str(big), 'a'), (str(tmp_path / 'missing'), 'b')])
+        assert sorted((res.key, res.ok) for res in results) == [('a', True), ('b', False)]
+        with pytest.raises(OARepoS3Error) as exc:
+            client.upload(str(tmp_path / 'missing'))
+        assert exc.value.status == STATUS_WRONG_FILE
+    assert [e['event'] for e in events if e['key'] == 'big.dat'][0] == 'start'
+    assert events[-1]['event'] == 'end'
+    # nothing on terminal, host signal handlers kept:
+    assert capsys.readouterr().out == ''
+    assert signal.getsignal(signal.SIGINT) is handler
+
+
+def test_client_async(srv, tmp_path):
+    files = []
+    for i in range(6):
+        files.append(tmp_path / f'f{i}.dat')
+        files[-1].write_bytes(os.urandom(MIN_PART_SIZE + i))
+
+    async def upload_all(client):
+        return await asyncio.gather(*[client.upload_async(str(file)) for file in files])
+
+    with Client(srv.base_url, 'tok', parallel=2, part_size=MIN_PART_SIZE, max_uploads=6) as client:
+        results = asyncio.new_event_loop().run_until_complete(upload_all(client))
+    assert [res.key for res in results] == [file.name for file in files]
+    assert all(srv.objects[file.name].size == file.stat().st_size for file in files)
+
+
+def test_client_errors(srv, tmp_path):
+    file = tmp_path / 'data.dat'
+    file.write_bytes(os.urandom(2 * MIN_PART_SIZE))
+    secured = StandinServer(tls=False, token='secret').start()
+    try:
+        with pytest.raises(OARepoS3Error) as exc:
+            Client(secured.base_url, 'wrong').upload(str(file))
+        assert exc.value.status == STATUS_INVALID_TOKEN
+    finally:
+        secured.stop()
+    # used from other thread than main (no signal handlers there):
+    results = []
+    client = Client(srv.base_url, 'tok', parallel=2, part_size=MIN_PART_SIZE)
+    thread = threading.Thread(target=lambda: results.append(client.upload(str(file))))
+    thread.start()
+    thread.join()
+    assert results[0].ok and srv.objects['data.dat'].size == file.stat().st_size
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Module bandwidth tests."""
+
+import os, time, pytest, requests
+import multiprocessing as mp
+from multiprocessing.pool import ThreadPool
+
+from oarepo_s3_cli import Client
+from oarepo_s3_cli.constants import *
+from oarepo_s3_cli.bandwidth import *
+from oarepo_s3_cli.standin import StandinServer
+from oarepo_s3_cli.utils import FileSlice
+
+
+def test_parse_rate():
+    assert parse_rate('1000') == 1000
+    assert parse_rate('50M') == 50 * 1024**2
+    assert parse_rate('1.5GB/s') == int(1.5 * 1024**3)
+    assert parse_rate('0') is None and parse_rate('unlimited') is None
+    with pytest.raises(Exception) as e:
+        parse_rate('fast')
+    assert e.value.args[1] == STATUS_WRONG_BANDWIDTH
+
+
+def test_schedule(tmp_path):
+    file = tmp_path / 'schedule.txt'
+    file.write_text("# office hours\n08:00-18:00 10M\n22:00-06:00 unlimited  # night\n18:00-22:00 50M\n")
+    schedule = BandwidthSchedule.load(file, default=1000)
+    at = lambda h, m: time.mktime((2021, 3, 1, h, m, 0, 0, 0, -1))
+    assert schedule.rate_at(at(9, 30)) == 10 * 1024**2
+    assert schedule.rate_at(at(18, 0)) == 50 * 1024**2
+    assert schedule.rate_at(at(23, 0)) is None and schedule.rate_at(at(2, 0)) is None
+    assert schedule.rate_at(at(7, 0)) == 1000
+    file.write_text("8-18 10M\n")
+    with pytest.raises(Exception) as e:
+        BandwidthSchedule.load(file)
+    assert e.value.args[1] == STATUS_WRONG_BANDWIDTH
+
+
+def test_bandwidth_limit(sink_server, tmp_path):
+    """ sustained throughput of parallel streams within few percent of limit """
+    file = tmp_path / 'data.dat'
+    file.write_bytes(os.urandom(4 * 1024 * 1024))
+    rate, streams = 8 * 1024 * 1024, 4
+    bucket = TokenBucket(rate)
+
+    def put(i):
+        with ThrottledBody(FileSlice(file, 0, file.stat().st_size), bucket) as body:
+            resp = requests.put(sink_server.url, data=body)
+            assert resp.status_code == 200 and body.hexdigest() is not None
+
+    start = time.time()
+    with ThreadPool(streams) as pool:
+        pool.map(put, range(streams))
+    elapsed = time.time() - start
+    assert sink_server.received == streams * 4 * 1024 * 1024
+    assert abs(sink_server.received / elapsed - rate) / rate < 0.05
+
+
+def consume(args):
+    bucket, nbytes = args
+    for i in range(nbytes // BANDWIDTH_CHUNK_SIZE):
+        bucket.consume(BANDWIDTH_CHUNK_SIZE)
+
+
+@pytest.mark.skipif(mp.get_start_method() != 'fork', reason='shared bucket inherited by forked workers')
+def test_bandwidth_limit_shared():
+    rate, nbytes = 4 * 1024 * 1024, 1024 * 1024
+    bucket = TokenBucket(rate, shared=True)
+    with mp.Pool(4) as pool:
+        start = time.time()
+        pool.map(consume, [(bucket, nbytes)] * 8, chunksize=1)
+        elapsed = time.time() - start
+    assert abs(8 * nbytes / elapsed - rate) / rate < 0.05
+
+
+@pytest.mark.parametrize('engine', ['thread', 'process'])
+def test_bandwidth_limit_timeouts(engine, tmp_path, monkeypatch):
+    """ parts slowed down by limit beyond monitor (and worker) timeout are not a hang """
+    monkeypatch.setattr('oarepo_s3_cli.parallels.MON_TIMEOUT', 1)
+    monkeypatch.setattr('oarepo_s3_cli.batch.MON_TIMEOUT', 1)
+    monkeypatch.setattr('oarepo_s3_cli.lib.WORKER_TIMEOUT', 1)
+    files = [tmp_path / 'a.dat', tmp_path / 'b.dat']
+    for file in files: file.write_bytes(os.urandom(2 * MIN_PART_SIZE))
+    srv = StandinServer(tls=False).start()
+    try:
+        bucket = TokenBucket(4 * 1024 * 1024, shared=(engine == 'process'))
+        with Client(srv.base_url, 'tok', parallel=2, part_size=MIN_PART_SIZE, engine=engine,
+                    bandwidth=bucket) as client:
+            start = time.time()
+            assert client.upload(str(files[0])).ok
+            assert time.time() - start > 1
+            # batch of files (thread engine only) or next file:
+            results = client.upload_many([(str(file), None) for file in files]) if engine == 'thread' \
+                else [client.upload(str(files[1]))]
+            assert all(res.ok for res in results)
+        assert srv.objects['a.dat'].size == srv.objects['b.dat'].size == 2 * MIN_PART_SIZE
+    finally:
+        srv.stop()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Module batch tests."""
+
+import hashlib, json, re, time
+import responses
+
+from oarepo_s3_cli.constants import *
+from oarepo_s3_cli.batch import BatchUpload
+
+
+@responses.activate
+def test_batch_upload(mock_oarepo, tmp_path):
+    files_url = f'{mock_oarepo.url}/draft/records/1/files/'
+    responses.add(responses.GET, f"{mock_oarepo.url}/access-tokens/status", status=200,
+        json={'status': 'OK', 'links': {'files': files_url}})
+    responses.add_callback(responses.POST, f"{files_url}?multipart=true",
+        callback=lambda req: (201, {}, json.dumps({'key': json.loads(req.body)['key'],
+                                                   'uploadId': 'up-' + json.loads(req.body)['key']})))
+    responses.add_callback(responses.GET, re.compile(f"{files_url}.*/presigned"),
+        callback=lambda req: (200, {}, json.dumps({'presignedUrls': {
+            pn: f"https://s3.example.org/{req.url.split('/')[-4]}/{pn}" for pn in req.url.split('/')[-2].split(',')}})))
+    responses.add_callback(responses.PUT, re.compile('https://s3.example.org/.*'),
+        callback=lambda req: (200, {'ETag': hashlib.md5(req.body).hexdigest()}, ''))
+    responses.add_callback(responses.POST, re.compile(f"{files_url}.*/complete"),
+        callback=lambda req: (200, {}, json.dumps({'location': req.url.rsplit('/', 2)[0]})))
+    # no direct upload of small files - one part multipart uploads:
+    responses.add(responses.PUT, re.compile(f"{files_url}[^/]+$"), status=405)
+
+    files = []
+    for i in range(5):
+        fn = tmp_path / f'file{i}.dat'
+        fn.write_bytes(bytes([i]) * (i + 1) * 100)
+        files.append((str(fn), None))
+    files.append((str(tmp_path / 'missing.dat'), 'missing'))
+    batch = BatchUpload(mock_oarepo.url, mock_oarepo.token, parallel=2, quiet=True, max_files=2)
+    results = batch.main(iter(files))
+    assert len(results) == 6
+    ok = [res for res in results if res['status'] == STATUS_OK]
+    assert sorted(res['key'] for res in ok) == [f'file{i}.dat' for i in range(5)]
+    assert [res['status'] for res in results if res['key'] == 'missing'] == [STATUS_WRONG_FILE]
+    # token checked once:
+    assert len([c for c in responses.calls if c.request.url.endswith('/access-tokens/status')]) == 1
+
+
+@responses.activate
+def test_batch_part_failed(mock_oarepo, tmp_path, monkeypatch):
+    monkeypatch.setattr('oarepo_s3_cli.batch.MON_TIMEOUT', 5)
+    files_url = f'{mock_oarepo.url}/draft/records/1/files/'
+    responses.add(responses.GET, f"{mock_oarepo.url}/access-tokens/status", status=200,
+        json={'status': 'OK', 'links': {'files': files_url}})
+    responses.add_callback(responses.POST, f"{files_url}?multipart=true",
+        callback=lambda req: (201, {}, json.dumps({'key': json.loads(req.body)['key'],
+                                                   'uploadId': 'up-' + json.loads(req.body)['key']})))
+    responses.add_callback(responses.GET, re.compile(f"{files_url}.*/presigned"),
+        callback=lambda req: (200, {}, json.dumps({'presignedUrls': {
+            pn: f"https://s3.example.org/{req.url.split('/')[-4]}/{pn}" for pn in req.url.split('/')[-2].split(',')}})))
+
+    def put(req):
+        if req.url.endswith('bad.dat/1'):
+            # fatal error of part 1 while part 2 of same file still in flight:
+            return (400, {}, 'InvalidArgument')
+        if req.url.endswith('bad.dat/2'): time.sleep(0.5)
+        return (200, {'ETag': hashlib.md5(req.body).hexdigest()}, '')
+
+    responses.add_callback(responses.PUT, re.compile('https://s3.example.org/.*'), callback=put)
+    responses.add_callback(responses.POST, re.compile(f"{files_url}.*/complete"),
+        callback=lambda req: (200, {}, json.dumps({'location': req.url.rsplit('/', 2)[0]})))
+    responses.add(responses.PUT, re.compile(f"{files_url}[^/]+$"), status=405)
+
+    (tmp_path / 'bad.dat').write_bytes(b'b' * (2 * MIN_PART_SIZE))
+    (tmp_path / 'good.dat').write_bytes(b'g' * 1000)
+    batch = BatchUpload(mock_oarepo.url, mock_oarepo.token, parallel=2, quiet=True, part_size=MIN_PART_SIZE)
+    t = time.time()
+    results = batch.main(iter([(str(tmp_path / 'bad.dat'), None), (str(tmp_path / 'good.dat'), None)]))
+    assert time.time() - t < 5
+    results = {res['key']: res for res in results}
+    assert results['good.dat']['status'] == STATUS_OK
+    # failed file returned with its upload for resume:
+    assert results['bad.dat']['status'] != STATUS_OK and results['bad.dat']['uploadId'] == 'up-bad.dat'
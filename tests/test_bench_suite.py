@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Module benchmark suite tests."""
+
+import json
+from click.testing import CliRunner
+
+from benchmarks.suite import compare, main
+
+
+def result(op='upload', **kwargs):
+    res = dict(op=op, kind='sparse', size=1024 * 1024, parallel=4, part_size='auto', engine='thread', status=0,
+               throughput=100, cpu_secs=1.0, peak_rss=1000)
+    res.update(kwargs)
+    return res
+
+
+def test_compare():
+    baseline = dict(results=[result(), result('check'), result('resume')])
+    results = dict(results=[result(throughput=95, cpu_secs=1.05), result('check', throughput=80, peak_rss=1200),
+                            result('resume', status=1), result('upload', parallel=16, throughput=1)])
+    regressions = compare(baseline, results, 10)
+    assert [(r[0].split()[0], r[1]) for r in regressions] == \
+           [('check', 'throughput'), ('check', 'peak_rss'), ('resume', 'status')]
+    assert regressions[0][2:] == (100, 80, -20.0)
+    assert compare(baseline, results, 25) == [regressions[-1]]
+
+
+def test_suite_run(tmp_path):
+    out = tmp_path / 'results.json'
+    args = ['run', '--sizes', '1M', '--kinds', 'sparse', '--parallel', '2', '--ops', 'upload,resume,check',
+            '--no-tls', '-o', str(out)]
+    res = CliRunner().invoke(main, args)
+    assert res.exit_code == 0, res.output
+    results = json.loads(out.read_text())['results']
+    assert [r['op'] for r in results] == ['upload', 'resume', 'check']
+    assert all(r['status'] == 0 and r['throughput'] > 0 and r['cpu_secs'] > 0 and r['peak_rss'] > 0
+               for r in results)
+    assert results[0]['parts'] == 1 and results[0]['requests_per_part'] >= 1
+    # same results as baseline - no regression:
+    res = CliRunner().invoke(main, ['compare', str(out), str(out)])
+    assert res.exit_code == 0 and 'no regression' in res.output
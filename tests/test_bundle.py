@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Module bundle tests - tar archive generated on the fly."""
+
+import io, json, os, tarfile, pytest, requests
+from click.testing import CliRunner
+
+from oarepo_s3_cli.bundle import TarBundle
+from oarepo_s3_cli.clickdef import cli_main
+from oarepo_s3_cli.constants import *
+from oarepo_s3_cli.standin import FILES_PATH, StandinServer
+from oarepo_s3_cli.utils import get_local_hash, iter_upload_sources
+
+
+@pytest.fixture
+def tree(tmp_path):
+    top = tmp_path / 'tree'
+    (top / 'sub').mkdir(parents=True)
+    for i in range(20):
+        name = f"sub/{'long-name-' * 12}{i}.dat" if i % 5 == 0 else f'f{i}.dat'
+        (top / name).write_bytes(os.urandom(i * 1021))
+    (top / 'empty').write_bytes(b'')
+    return top
+
+
+def test_bundle_ranges(tree, tmp_path):
+    bundle = TarBundle.from_sources(iter_upload_sources([str(tree)]), 'tree.tar')
+    # archive read in odd sized ranges:
+    data = b''.join(bundle.slice(offset, min(7777, bundle.size - offset)).read()
+                    for offset in range(0, bundle.size, 7777))
+    assert len(data) == bundle.size
+    archive = tarfile.open(fileobj=io.BytesIO(data))
+    assert sorted(archive.getnames()) == sorted(rec['name'] for rec in bundle.index())
+    for rec in bundle.index():
+        content = (tree / rec['name']).read_bytes()
+        assert data[rec['offset']:rec['offset'] + rec['size']] == content
+        assert archive.extractfile(rec['name']).read() == content
+    file = tmp_path / 'tree.tar'
+    file.write_bytes(data)
+    assert bundle.get_hash(MIN_PART_SIZE, 4) == get_local_hash(str(file), MIN_PART_SIZE)
+    # same files - same archive:
+    assert TarBundle.from_sources(iter_upload_sources([str(tree)]), 'x').identity() == bundle.identity()
+
+
+def test_bundle_upload(tree, tmp_path):
+    srv = StandinServer(tls=False).start()
+    try:
+        index = tmp_path / 'index.jsonl'
+        args = ['-e', srv.base_url, '-t', 'tok', '-q', '-n', '--no-journal']
+        result = CliRunner().invoke(cli_main, args + ['upload', '-f', str(tree), '--bundle', '-p', '4',
+                                                      '--bundle-index', str(index)])
+        assert result.exit_code == 0, result.output
+        assert srv.objects['tree.tar'].size == TarBundle.from_sources(iter_upload_sources([str(tree)])).size
+        assert 'tree.tar.index.jsonl' in srv.objects
+        # member read by Range request:
+        rec = [json.loads(line) for line in index.read_text().splitlines()][3]
+        resp = requests.get(f'{srv.base_url}{FILES_PATH}tree.tar',
+                            headers={'Range': f"bytes={rec['offset']}-{rec['offset'] + rec['size'] - 1}"})
+        assert resp.content == (tree / rec['name']).read_bytes()
+        result = CliRunner().invoke(cli_main, args + ['check', '-f', str(tree), '--bundle'])
+        assert result.exit_code == 0, result.output
+    finally:
+        srv.stop()
@@ -108,6 +108,8 @@ def test_upload(
     presign_url = f"{upload_url}/{mock_oarepo.partNum}/presigned"
     parts_url = f'{upload_url}/parts'
     part_s3_url = 'https://mock_part_s3_url.example.org'
+    # no direct upload of small file - one part multipart upload:
+    responses.add(responses.PUT, file_url, status=405)
     responses.add(responses.GET, presign_url, status=200,
         json={ 'presignedUrls':{'1': part_s3_url, } }
     )
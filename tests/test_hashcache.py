@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Module hashcache tests."""
+
+import hashlib, os, pickle
+from click.testing import CliRunner
+
+from oarepo_s3_cli.clickdef import cli_main
+from oarepo_s3_cli.constants import *
+from oarepo_s3_cli.hashcache import HashCache, WHOLE_FILE, skip_unchanged
+from oarepo_s3_cli.standin import StandinServer
+from oarepo_s3_cli.utils import get_local_hash
+
+
+def test_hash_cache(tmp_path):
+    file = tmp_path / 'data.dat'
+    file.write_bytes(b'x' * 1000)
+    cache = HashCache(str(tmp_path / 'state'))
+    md5 = hashlib.md5(b'x' * 1000).hexdigest()
+    cache.put_parts(str(file), 1000, [dict(PartNumber=1, ETag=md5, MD5=md5)], 1)
+    assert cache.get(str(file), WHOLE_FILE) == md5
+    assert cache.get(str(file), 1000) == get_local_hash(str(file), 1000)
+    assert cache.matches(str(file), f'md5:{md5}') and not cache.matches(str(file), 'md5:0' * 32)
+    remote = {'data.dat': (1000, f'md5:{md5}'), 'other': (5, None)}
+    sources = [(str(file), None, None), (str(tmp_path / 'other'), 'other', None)]
+    assert [key for f, key, ct in skip_unchanged(sources, remote, cache, quiet=True)] == ['other']
+    # changed file - new identity:
+    os.utime(file, ns=(0, 0))
+    assert cache.etags(str(file)) == {} and not cache.matches(str(file), f'md5:{md5}')
+    # connection not pickled (process engine workers):
+    assert pickle.loads(pickle.dumps(cache)).path == cache.path
+    cache.close()
+
+
+def test_skip_unchanged(tmp_path):
+    top = tmp_path / 'tree'
+    top.mkdir()
+    for i in range(4):
+        (top / f'f{i}.dat').write_bytes(os.urandom(1000 + i))
+    srv = StandinServer(tls=False).start()
+    try:
+        args = ['-e', srv.base_url, '-t', 'tok', '-q', '-n', '--state-dir', str(tmp_path / 'state')]
+        # hash cache not opened by other commands, nor without journal:
+        result = CliRunner().invoke(cli_main, args + ['download', '-k', 'none.dat', '-f', str(tmp_path / 'x')])
+        assert result.exit_code != 0 and not (tmp_path / 'state').exists()
+        upload = args + ['upload', '-f', str(top), '--skip-unchanged', '-p', '2']
+        assert CliRunner().invoke(cli_main, upload).exit_code == 0
+        assert srv.stats['direct'] == 4
+        (top / 'f1.dat').write_bytes(os.urandom(1000))
+        srv.reset_stats()
+        result = CliRunner().invoke(cli_main, upload)
+        assert result.exit_code == 0, result.output
+        assert srv.stats['direct'] == 1
+        # check answered from files listing and hash cache:
+        srv.reset_stats()
+        result = CliRunner().invoke(cli_main, args + ['check', '-f', str(top / 'f2.dat'), '-k', 'f2.dat'])
+        assert result.exit_code == 0, result.output
+        assert srv.stats['gets'] == 0
+        result = CliRunner().invoke(cli_main, args[:-2] + ['--state-dir', str(tmp_path / 'nojournal'), '--no-journal',
+                                                          'upload', '-f', str(top), '--skip-unchanged'])
+        assert result.exit_code != 0 and not (tmp_path / 'nojournal').exists()
+    finally:
+        srv.stop()
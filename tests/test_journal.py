@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Module journal tests."""
+
+import hashlib, json, os, re
+import responses
+
+from oarepo_s3_cli.constants import *
+from oarepo_s3_cli.journal import Journal
+from oarepo_s3_cli.lib import OARepoS3Client
+
+
+def test_journal(state_dir, tmp_path):
+    file = tmp_path / 'data.dat'
+    file.write_bytes(b'x' * 100)
+    journal = Journal(state_dir, 'https://repo/files/', 'data.dat', str(file))
+    assert journal.load() is None
+    journal.start('up-1', dict(part_size=MIN_PART_SIZE), str(file))
+    journal.add_part(dict(PartNumber=2, ETag='e2', MD5='m2', status=STATUS_OK))
+    journal.add_part(dict(PartNumber=1, ETag='e1', MD5='m1'))
+    with open(journal.path, 'a') as fh:
+        fh.write('{"type": "part", "PartNu')   # interrupted write
+    init, parts, ts = journal.load()
+    assert init['uploadId'] == 'up-1' and init['identity'] == Journal.identity(str(file))
+    assert parts == {1: dict(PartNumber=1, ETag='e1', MD5='m1'), 2: dict(PartNumber=2, ETag='e2', MD5='m2')}
+    # other key - other journal:
+    assert Journal(state_dir, 'https://repo/files/', 'other.dat', str(file)).load() is None
+    Journal.remove_upload(state_dir, 'up-1')
+    assert journal.load() is None
+
+
+@responses.activate
+def test_upload_from_journal(mock_oarepo, state_dir, tmp_path):
+    files_url = f'{mock_oarepo.url}/draft/records/1/files/'
+    responses.add(responses.GET, f"{mock_oarepo.url}/access-tokens/status", status=200,
+        json={'status': 'OK', 'links': {'files': files_url}})
+    responses.add(responses.POST, f"{files_url}?multipart=true", status=201,
+        json={'key': 'data.dat', 'uploadId': 'up-new'})
+    responses.add_callback(responses.GET, re.compile(f"{files_url}.*/presigned"),
+        callback=lambda req: (200, {}, json.dumps({'presignedUrls': {
+            pn: f"https://s3.example.org/{pn}" for pn in req.url.split('/')[-2].split(',')}})))
+    responses.add_callback(responses.PUT, re.compile('https://s3.example.org/.*'),
+        callback=lambda req: (200, {'ETag': hashlib.md5(req.body).hexdigest()}, ''))
+    responses.add(responses.POST, re.compile(f"{files_url}.*/complete"), status=200,
+        json={'location': f"{files_url}data.dat"})
+
+    file = tmp_path / 'data.dat'
+    data = os.urandom(2 * MIN_PART_SIZE + 100)
+    file.write_bytes(data)
+    md5 = hashlib.md5(data[:MIN_PART_SIZE]).hexdigest()
+    # interrupted upload, part 1 done:
+    journal = Journal(state_dir, files_url, 'data.dat', str(file))
+    journal.start('up-old', dict(part_size=MIN_PART_SIZE), str(file))
+    journal.add_part(dict(PartNumber=1, ETag=md5, MD5=md5))
+
+    oas3 = OARepoS3Client(mock_oarepo.url, mock_oarepo.token, parallel=2, quiet=True, state_dir=state_dir)
+    assert oas3.process_click_upload(None, str(file), nocheck=False) == (f"{files_url}data.dat", STATUS_OK)
+    urls = [call.request.url for call in responses.calls]
+    # no init and no server listing of parts, part 1 not sent again:
+    assert not any(url.endswith('?multipart=true') or url.endswith('/parts') for url in urls)
+    assert sorted(url for url in urls if url.startswith('https://s3.example.org/')) == \
+        ['https://s3.example.org/2', 'https://s3.example.org/3']
+    assert oas3.get_uploadId() == 'up-old'
+    parts = json.loads(responses.calls[-1].request.body)['parts']
+    assert [part['PartNumber'] for part in parts] == [1, 2, 3]
+    assert journal.load() is None
+
+    # changed file - journal ignored, new upload:
+    journal.start('up-old', dict(part_size=MIN_PART_SIZE), str(file))
+    file.write_bytes(data[:-1])
+    oas3 = OARepoS3Client(mock_oarepo.url, mock_oarepo.token, parallel=2, quiet=True, state_dir=state_dir)
+    oas3.process_click_upload(None, str(file))
+    assert oas3.get_uploadId() == 'up-new'
@@ -7,17 +7,17 @@
 
 """Module lib tests."""
 
-import re
+import hashlib, re
 import responses
 from unittest import mock
 
 from oarepo_s3_cli.constants import *
-from oarepo_s3_cli.utils import SharedList
+from oarepo_s3_cli.utils import SharedList, get_local_hash
 from oarepo_s3_cli.lib import OARepoS3Client
 from tests.conftest import fake_file_info
 
 
-@mock.patch('oarepo_s3_cli.lib.requests.get')
+@mock.patch('requests.Session.get')
 def test_check_token_status(mock_get, mock_oarepo):
     mock_get.return_value = mock.Mock(
         status_code=200,
@@ -84,7 +84,7 @@ def test_OARepoS3Client(mock_path_getsize, mock_path_isfile, mock_path_exists, m
     assert oas3.part_size == test_size
 
 @responses.activate
-@mock.patch('builtins.open', new_callable=mock.mock_open, read_data=fake_file_info.data)
+@mock.patch('builtins.open', new_callable=mock.mock_open, read_data=fake_file_info.data.encode())
 @mock.patch('os.access')
 @mock.patch('os.path.exists')
 @mock.patch('os.path.isfile')
@@ -103,14 +103,14 @@ def test_init_upload(mock_path_getsize, mock_path_isfile, mock_path_exists, mock
         }
     )
 
-    oas3 = OARepoS3Client(mock_oarepo.url, mock_oarepo.token, parallel=1, quiet=False)
-    assert isinstance(oas3, OARepoS3Client)
-    assert oas3.url == mock_oarepo.url
-
     mock_os_access.side_effect = lambda fn, mode: fn == test_filename
     mock_path_exists.side_effect = lambda fn: fn == test_filename
     mock_path_isfile.side_effect = lambda fn: fn == test_filename
     mock_path_getsize.side_effect = lambda fn: test_size if fn == test_filename else FileNotFoundError
+    oas3 = OARepoS3Client(mock_oarepo.url, mock_oarepo.token, parallel=1, quiet=False)
+    assert isinstance(oas3, OARepoS3Client)
+    assert oas3.url == mock_oarepo.url
+
     oas3.quiet = True
     oas3.token = mock_oarepo.token
     oas3.set_file(test_filename, mock_oarepo.key)
@@ -157,8 +157,38 @@ def test_init_upload(mock_path_getsize, mock_path_isfile, mock_path_exists, mock
     assert resp['PartNumber'] == 1
     assert resp['status'] == STATUS_OK
     assert resp['ETag'] == mock_oarepo.ETag
+    assert resp['MD5'] == hashlib.md5(fake_file_info.data.encode()).hexdigest()
+
+    oas3.parts = [resp]
+    oas3.set_local_checksum(oas3.get_uploaded_parts())
+    assert oas3.local_checksum == fake_file_info.hash_md5
 
     abort_url = f"{oas3.urlUpload}/abort"
     responses.add(responses.DELETE, abort_url, status=200)
     resp = oas3.abort_upload()
     assert resp.status_code == 200
+
+@responses.activate
+def test_download(mock_oarepo, range_server, tmp_path):
+    files_url = range_server.url.rsplit('/', 1)[0] + '/'
+    responses.add(responses.GET, f"{mock_oarepo.url}/access-tokens/status", status=200,
+        json={'status': 'OK', 'links': {'files': files_url}})
+    responses.add_passthru(files_url)
+    oas3 = OARepoS3Client(mock_oarepo.url, mock_oarepo.token, parallel=4, quiet=True)
+    file = str(tmp_path / 'downloaded.dat')
+    assert oas3.process_click_download('range.dat', file) == (file, STATUS_OK)
+    with open(file, 'rb') as fh:
+        assert fh.read() == range_server.data
+
+def test_check_opaque_etags(mock_oarepo, range_server, tmp_path):
+    files_url = range_server.url.rsplit('/', 1)[0] + '/'
+    file = tmp_path / 'range.dat'
+    file.write_bytes(range_server.data)
+    oas3 = OARepoS3Client(mock_oarepo.url, mock_oarepo.token, parallel=2, quiet=True, urlFiles=files_url,
+                          part_size=MIN_PART_SIZE)
+    oas3.set_file(str(file), 'range.dat')
+    # part ETag not an MD5 (SSE-KMS) - not a remote checksum, remote file read:
+    oas3.parts = [dict(PartNumber=1, ETag='opaque-etag-kms', status=STATUS_OK)]
+    oas3.local_checksum = get_local_hash(str(file), MIN_PART_SIZE)
+    assert oas3.process_click_check() == (True, STATUS_OK)
+    assert len(range_server.ranges) > 0
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Module metrics tests."""
+
+import hashlib, json, os, re
+import requests, responses
+
+from oarepo_s3_cli.constants import *
+from oarepo_s3_cli.lib import OARepoS3Client
+from oarepo_s3_cli.metrics import *
+from oarepo_s3_cli.utils import Stats
+
+
+def samples(text):
+    return dict(line.rsplit(' ', 1) for line in text.splitlines() if not line.startswith('#'))
+
+
+def test_metrics_scrape(tmp_path):
+    metrics = Metrics()
+    metrics.file_started(1000, 100)
+    for secs in (0.2, 0.7, 3):
+        metrics.part(dict(PartNumber=1, Size=300, Secs=secs, Retries=1, Throttled=1, Presigned=secs < 1))
+    metrics.part_failed()
+    metrics.presign(10, 0.03)
+    stats = Stats(10, 4)
+    stats.start(2)
+    metrics.watch(stats)
+    textfile = tmp_path / 'oarepo_s3.prom'
+    exporter = MetricsExporter(metrics, '127.0.0.1:0', str(textfile))
+    try:
+        resp = requests.get(exporter.url)
+        assert resp.status_code == 200 and resp.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+        assert requests.get(exporter.url.replace('/metrics', '/other')).status_code == 404
+    finally:
+        exporter.close()
+    values = samples(resp.text)
+    assert values['oarepo_s3_sent_bytes_total'] == '900' and values['oarepo_s3_upload_done_bytes'] == '1000'
+    assert values['oarepo_s3_parts_total{status="ok"}'] == '3' and values['oarepo_s3_parts_total{status="failed"}'] == '1'
+    assert values['oarepo_s3_parts{state="pending"}'] == '4' and values['oarepo_s3_parts{state="running"}'] == '2'
+    assert values['oarepo_s3_part_retries_total'] == '3' and values['oarepo_s3_part_throttled_total'] == '3'
+    assert values['oarepo_s3_presign_misses_total'] == '1' and values['oarepo_s3_presign_urls_total'] == '10'
+    assert values['oarepo_s3_part_duration_seconds_bucket{le="0.25"}'] == '1'
+    assert values['oarepo_s3_part_duration_seconds_bucket{le="1"}'] == '2'
+    assert values['oarepo_s3_part_duration_seconds_bucket{le="+Inf"}'] == '3'
+    assert values['oarepo_s3_part_duration_seconds_count'] == '3'
+    assert values['oarepo_s3_presign_duration_seconds_bucket{le="0.025"}'] == '0'
+    assert values['oarepo_s3_presign_duration_seconds_bucket{le="0.05"}'] == '1'
+    assert '# TYPE oarepo_s3_part_duration_seconds histogram' in resp.text
+    # textfile written on close:
+    assert samples(textfile.read_text()) == values
+
+
+@responses.activate
+def test_upload_metrics(mock_oarepo, tmp_path):
+    files_url = f'{mock_oarepo.url}/draft/records/1/files/'
+    responses.add(responses.GET, f"{mock_oarepo.url}/access-tokens/status", status=200,
+        json={'status': 'OK', 'links': {'files': files_url}})
+    responses.add(responses.POST, f"{files_url}?multipart=true", status=201,
+        json={'key': 'data.dat', 'uploadId': 'up-1'})
+    responses.add_callback(responses.GET, re.compile(f"{files_url}.*/presigned"),
+        callback=lambda req: (200, {}, json.dumps({'presignedUrls': {
+            pn: f"https://s3.example.org/{pn}" for pn in req.url.split('/')[-2].split(',')}})))
+    responses.add_callback(responses.PUT, re.compile('https://s3.example.org/.*'),
+        callback=lambda req: (200, {'ETag': hashlib.md5(req.body).hexdigest()}, ''))
+    responses.add(responses.POST, re.compile(f"{files_url}.*/complete"), status=200,
+        json={'location': f"{files_url}data.dat"})
+    file = tmp_path / 'data.dat'
+    file.write_bytes(os.urandom(2 * MIN_PART_SIZE + 100))
+
+    metrics = Metrics()
+    oas3 = OARepoS3Client(mock_oarepo.url, mock_oarepo.token, parallel=2, quiet=True, metrics=metrics)
+    oas3.process_click_upload(None, str(file))
+    values = samples(metrics.render())
+    assert values['oarepo_s3_files_finished_total{status="ok"}'] == '1'
+    assert values['oarepo_s3_parts_total{status="ok"}'] == '3'
+    assert values['oarepo_s3_sent_bytes_total'] == str(2 * MIN_PART_SIZE + 100)
+    assert values['oarepo_s3_part_duration_seconds_count'] == '3'
+    assert int(values['oarepo_s3_presign_requests_total']) >= 1
+    assert values['oarepo_s3_presign_urls_total'] == '3'
+    assert values['oarepo_s3_parts{state="running"}'] == '0'
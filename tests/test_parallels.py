@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Module parallels tests."""
+
+import pytest, threading, time
+
+from oarepo_s3_cli.constants import *
+from oarepo_s3_cli.parallels import Parallels, AdaptiveLimit
+
+
+@pytest.mark.parametrize('engine', ['thread', 'async'])
+def test_parallels_engine(engine):
+    def worker(pn, val):
+        if pn == 3: raise Exception(f"Part {pn} upload failed.", STATUS_ERR_MAX_RETRIES)
+        return dict(PartNumber=pn, status=STATUS_OK, ETag=f'etag{pn}')
+    parallels = Parallels(worker, lambda: None, 4, [1, 2, 3, 4], parallel=2, quiet=True, engine=engine)
+    st, results = parallels.main()
+    assert st == STATUS_UPLOAD_UNCOMPLETED
+    assert [r['ETag'] for r in results if isinstance(r, dict)] == ['etag1', 'etag2', 'etag4']
+    assert parallels.stats.finished == 3
+    assert parallels.stats.failed == 1
+
+
+@pytest.mark.parametrize('engine', ['thread', 'async'])
+def test_parallels_killed(engine):
+    def worker(pn, val):
+        if pn == 1: parallels.killed = True
+        time.sleep(0.1)
+        return dict(PartNumber=pn, status=STATUS_OK, ETag=f'etag{pn}')
+    threads = set(threading.enumerate())
+    parallels = Parallels(worker, lambda: None, 20, list(range(1, 21)), parallel=2, quiet=True, engine=engine)
+    st, results = parallels.main()
+    assert st == STATUS_UPLOAD_UNCOMPLETED
+    assert len([r for r in results if isinstance(r, dict)]) < 20
+    # pool terminated and joined (threads of earlier tests may end meanwhile):
+    assert set(threading.enumerate()) <= threads
+
+
+def test_adaptive_limit():
+    limit = AdaptiveLimit(low=2, high=6, start=4)
+    def window(nbytes, throttled=0, errors=0, latency=1e-6, saturated=True):
+        limit.window_start = time.time() - ADAPTIVE_WINDOW
+        limit.window_bytes, limit.window_secs = nbytes, nbytes * latency
+        limit.window_parts, limit.window_throttled, limit.window_errors = limit.limit, throttled, errors
+        limit.saturated = saturated
+        limit.adjust()
+    # saturated, throughput growing - additive increase up to high bound:
+    for nbytes in (1000000, 2000000, 3000000, 4000000, 5000000):
+        window(nbytes)
+    assert limit.limit == 6
+    window(6000000, saturated=False)
+    assert limit.limit == 6
+    # throughput dropped, latency rising without gain - one stream less:
+    window(4000000)
+    assert limit.limit == 5
+    window(4000000, latency=3e-6)
+    assert limit.limit == 4
+    # throttled - multiplicative decrease, not below low bound:
+    window(4000000, throttled=1)
+    assert limit.limit == 2
+    window(4000000, errors=1)
+    assert limit.limit == 2
+    assert [d[4] for d in limit.decisions] == \
+        ['throughput growing'] * 2 + ['throughput dropped', 'latency rising', 'throttled']
+    assert 'final 2' in limit.summary() and 'range 2-6' in limit.summary()
+
+
+def test_adaptive_limit_slots():
+    limit = AdaptiveLimit(low=1, high=4, start=2)
+    with limit.slot(100) as s1, limit.slot(100) as s2:
+        assert limit.active == 2 and limit.saturated
+        s1['outcome'] = 'ok'
+    assert limit.active == 0
+    assert limit.window_parts == 1 and limit.window_errors == 1 and limit.window_bytes == 100
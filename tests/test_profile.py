@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Module profile tests."""
+
+import json, os
+from types import SimpleNamespace
+
+from oarepo_s3_cli.constants import *
+from oarepo_s3_cli.lib import OARepoS3Client
+from oarepo_s3_cli.profile import *
+from oarepo_s3_cli.standin import StandinServer
+
+
+def test_part_spans():
+    spans = PartSpans()
+    body = SimpleNamespace(read_secs=0.5, bandwidth_secs=1.0, read_end=105.0)
+    spans.request(100.0, 106.0, 0.25, body)
+    assert spans.spans == [['connect', 100.0, 0.25], ['read', 100.25, 0.5], ['bandwidth', 100.75, 1.0],
+                           ['send', 101.75, 3.25], ['response', 105.0, 1.0]]
+    # zero spans dropped, body sent at response:
+    spans = PartSpans()
+    spans.request(100.0, 101.0, 0, SimpleNamespace())
+    assert spans.spans == [['send', 100.0, 1.0]]
+
+
+def test_profile_report(tmp_path):
+    profile = Profile(str(tmp_path / 'profile.json'), quiet=True, slowest=2)
+    rec = profile.file_started('data.dat', 'data.dat', 300, 3)
+    rec['start'] = 99.0
+    # two streams, stream 2 finishing last with parts 2 and 3:
+    profile.part(dict(PartNumber=1, Secs=2.0, Pid=1, Tid=1, Spans=[['presign', 100, 0.5], ['send', 100.5, 1.5]]), 'k')
+    profile.part(dict(PartNumber=2, Secs=1.0, Pid=1, Tid=2, Spans=[['send', 100, 1.0]]), 'k')
+    profile.part(dict(PartNumber=3, Secs=3.0, Pid=1, Tid=2, Retries=1,
+                      Spans=[['send', 101.5, 2.0], ['retry', 103.5, 1.0]]), 'k')
+    profile.part(dict(PartNumber=4), 'k')    # no spans - not profiled
+    profile.file_finished(rec, STATUS_OK)
+    rec['end'] = 105.0
+    summary = profile.summary()
+    assert summary['parts'] == 3 and summary['streams'] == 2
+    assert summary['breakdown']['send']['total'] == 4.5 and summary['breakdown']['retry']['share'] == 0.1667
+    assert [part['part'] for part in summary['slowest']] == [3, 1]
+    cp = summary['critical_path']
+    assert cp['stream'] == '1-2' and cp['parts'] == 2 and cp['secs'] == 6.0
+    assert cp['breakdown'] == {'send': 3.0, 'retry': 1.0, 'setup': 1.0, 'finish': 0.5, 'idle': 0.5}
+    lines = profile.report(summary)
+    assert lines[0] == 'Profile: 1 file(s), 3 part(s), 2 stream(s)'
+    assert any(line.startswith('    k #3: 3.00s - send 2.00s, retry 1.00s (1 retries)') for line in lines)
+    profile.close()
+    data = json.loads((tmp_path / 'profile.json').read_text())
+    assert len(data['parts']) == 3 and data['summary']['critical_path'] == cp
+
+
+def test_upload_profile(tmp_path, capsys):
+    file = tmp_path / 'data.dat'
+    file.write_bytes(os.urandom(2 * MIN_PART_SIZE + 100))
+    srv = StandinServer(tls=False, latency=0.01).start()
+    try:
+        profile = Profile(str(tmp_path / 'trace.json'), 'chrome')
+        oas3 = OARepoS3Client(srv.base_url, 'tok', parallel=2, quiet=True, profile=profile,
+                              part_size=MIN_PART_SIZE)
+        oas3.process_click_upload(None, str(file))
+        profile.close()
+    finally:
+        srv.stop()
+    assert 'Profile: 1 file(s), 3 part(s)' in capsys.readouterr().err
+    events = json.loads((tmp_path / 'trace.json').read_text())['traceEvents']
+    names = {event['name'] for event in events}
+    assert {'data.dat', 'data.dat #1', 'data.dat #3', 'presign request', 'complete', 'send', 'response'} <= names
+    assert all(event['dur'] >= 0 for event in events if event['ph'] == 'X')
+    spans = [part['Spans'] for part in profile.parts]
+    assert all(any(name == 'send' for name, start, secs in part) for part in spans)
+    assert sum(secs for part in spans for name, start, secs in part if name == 'connect') > 0
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Module progress tests."""
+
+import hashlib, json, os, re
+import responses
+
+from oarepo_s3_cli.constants import *
+from oarepo_s3_cli.journal import Journal
+from oarepo_s3_cli.lib import OARepoS3Client
+from oarepo_s3_cli.progress import *
+
+
+def read_events(file):
+    with open(file) as fh:
+        return [json.loads(line) for line in fh]
+
+
+def test_progress(tmp_path):
+    assert percentile([], 50) is None
+    assert [percentile(list(range(1, 101)), p) for p in (50, 95, 99, 100)] == [50, 95, 99, 100]
+    stream = ProgressStream(str(tmp_path / 'events.ndjson'), interval=3600)
+    progress = Progress(stream, 'data.dat', 'key', 1000)
+    progress.begin('up-1', 10, 1, 100, part_size=100)
+    for pn in range(2, 10):
+        progress.part(dict(PartNumber=pn, Size=100, Secs=pn / 10, Retries=pn % 2, Presigned=pn != 2))
+    progress.fail()
+    progress.emit_progress()
+    progress.end(STATUS_UPLOAD_UNCOMPLETED, message='Part 10 upload failed')
+    stream.close()
+    start, prog, end = read_events(tmp_path / 'events.ndjson')
+    assert start['event'] == 'start' and start['uploadId'] == 'up-1' and start['parts_done'] == 1
+    assert prog['event'] == 'progress' and prog['bytes_done'] == 900 and prog['bytes_sent'] == 800
+    assert prog['parts_done'] == 9 and prog['parts_failed'] == 1 and prog['parts_total'] == 10
+    assert (prog['latency_p50'], prog['latency_p95'], prog['latency_p99']) == (0.5, 0.9, 0.9)
+    assert prog['retries'] == 4 and prog['presign_hit_rate'] == 0.875
+    assert prog['avg_throughput'] > 0 and prog['eta'] == round(100 / prog['avg_throughput'], 1)
+    assert end['event'] == 'end' and end['status'] == STATUS_UPLOAD_UNCOMPLETED
+    assert end['message'] == 'Part 10 upload failed'
+
+
+@responses.activate
+def test_upload_progress(mock_oarepo, state_dir, tmp_path):
+    files_url = f'{mock_oarepo.url}/draft/records/1/files/'
+    responses.add(responses.GET, f"{mock_oarepo.url}/access-tokens/status", status=200,
+        json={'status': 'OK', 'links': {'files': files_url}})
+    responses.add_callback(responses.GET, re.compile(f"{files_url}.*/presigned"),
+        callback=lambda req: (200, {}, json.dumps({'presignedUrls': {
+            pn: f"https://s3.example.org/{pn}" for pn in req.url.split('/')[-2].split(',')}})))
+    responses.add_callback(responses.PUT, re.compile('https://s3.example.org/.*'),
+        callback=lambda req: (200, {'ETag': hashlib.md5(req.body).hexdigest()}, ''))
+    responses.add(responses.POST, re.compile(f"{files_url}.*/complete"), status=200,
+        json={'location': f"{files_url}data.dat"})
+
+    file = tmp_path / 'data.dat'
+    data = os.urandom(2 * MIN_PART_SIZE + 100)
+    file.write_bytes(data)
+    md5 = hashlib.md5(data[:MIN_PART_SIZE]).hexdigest()
+    journal = Journal(state_dir, files_url, 'data.dat', str(file))
+    journal.start('up-1', dict(part_size=MIN_PART_SIZE), str(file))
+    journal.add_part(dict(PartNumber=1, ETag=md5, MD5=md5))
+
+    stream = ProgressStream(str(tmp_path / 'events.ndjson'))
+    oas3 = OARepoS3Client(mock_oarepo.url, mock_oarepo.token, parallel=2, quiet=True, state_dir=state_dir,
+                          progress=stream)
+    oas3.process_click_upload(None, str(file))
+    stream.close()
+    events = read_events(tmp_path / 'events.ndjson')
+    start, end = events[0], events[-1]
+    assert start['event'] == 'start' and start['parts_total'] == 3 and start['parts_done'] == 1
+    assert start['bytes_done'] == MIN_PART_SIZE and start['size'] == len(data)
+    assert end['event'] == 'end' and end['status'] == STATUS_OK and end['location'] == f"{files_url}data.dat"
+    assert end['parts_done'] == 3 and end['bytes_done'] == len(data) and end['bytes_sent'] == MIN_PART_SIZE + 100
+    assert end['retries'] == 0 and end['latency_p50'] is not None and end['eta'] == 0
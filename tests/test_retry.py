@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Module retry tests."""
+
+import errno, hashlib, pickle, re
+import requests, responses, urllib3
+from unittest import mock
+
+from oarepo_s3_cli.constants import *
+from oarepo_s3_cli.retry import *
+from oarepo_s3_cli.lib import OARepoS3Client
+from oarepo_s3_cli.utils import SharedList
+
+
+def test_classify():
+    policy = RetryPolicy()
+    resp = lambda code, text='': mock.Mock(status_code=code, text=text, headers={})
+    assert policy.classify(resp(200)) == RETRY_OK
+    assert policy.classify(resp(503, '<Code>SlowDown</Code>')) == RETRY_THROTTLED
+    assert policy.classify(resp(500)) == RETRY
+    assert policy.classify(resp(500), idempotent=False) == RETRY_FATAL
+    assert policy.classify(resp(429), idempotent=False) == RETRY_THROTTLED
+    assert policy.classify(resp(400, '<Code>RequestTimeout</Code>')) == RETRY
+    assert policy.classify(resp(403)) == RETRY_FATAL
+    assert policy.classify(resp(403), presigned=True) == RETRY_PRESIGN
+    assert policy.classify(resp(404)) == RETRY_FATAL
+    assert policy.classify(exc=requests.exceptions.ConnectionError()) == RETRY
+    assert policy.classify(exc=requests.exceptions.ReadTimeout(), idempotent=False) == RETRY_FATAL
+    assert policy.classify(exc=requests.exceptions.ConnectTimeout(), idempotent=False) == RETRY
+    assert policy.classify(exc=KeyError('ETag')) == RETRY_FATAL
+    assert policy.classify(exc=urllib3.exceptions.ProtocolError('Connection aborted.')) == RETRY
+    # local I/O errors (disk full, read error) are not retried:
+    assert policy.classify(exc=OSError(errno.ENOSPC, 'No space left on device')) == RETRY_FATAL
+
+
+def test_backoff_and_budget():
+    policy = RetryPolicy(max_retries=3, base=1, cap=5, ratio=0.5, reserve=2)
+    assert all(0 <= policy.delay(attempt) <= min(5, 2 ** attempt) for attempt in range(1, 6) for i in range(20))
+    assert policy.delay(1, mock.Mock(headers={'Retry-After': '3'})) == 3
+    assert policy.delay(1, mock.Mock(headers={'Retry-After': '300'})) == 5
+    assert not policy.allow(4)
+    assert policy.allow(1) and policy.allow(1) and not policy.allow(1)
+    # throttled - backoff only:
+    assert policy.allow(1, RETRY_THROTTLED) and not policy.allow(policy.max_throttled + 1, RETRY_THROTTLED)
+    policy.deposit()
+    assert not policy.allow(1)
+    policy.deposit()
+    assert policy.allow(1)
+    # picklable for worker processes:
+    assert pickle.loads(pickle.dumps(policy)).tokens == policy.tokens
+
+
+@responses.activate
+def test_request():
+    policy = RetryPolicy(base=0)
+    url = 'https://repo.example.org/x'
+    responses.add(responses.GET, url, status=503, body='<Code>SlowDown</Code>')
+    responses.add(responses.GET, url, status=200, json={'ok': True})
+    assert policy.request(requests.get, url).json() == {'ok': True}
+    responses.add(responses.POST, url, status=500)
+    assert policy.request(requests.post, url, idempotent=False).status_code == 500
+    assert len(responses.calls) == 3
+
+
+@responses.activate
+def test_upload_part_retries(mock_oarepo, tmp_path):
+    files_url = f'{mock_oarepo.url}/draft/records/1/files/'
+    responses.add(responses.GET, f"{mock_oarepo.url}/access-tokens/status", status=200,
+        json={'status': 'OK', 'links': {'files': files_url}})
+    responses.add(responses.GET, re.compile(f"{files_url}.*/1/presigned"), status=200,
+        json={'presignedUrls': {'1': 'https://s3.example.org/1?fresh'}})
+    data = b'x' * 1000
+    # throttled, then expired presign, then OK on new URL:
+    responses.add(responses.PUT, 'https://s3.example.org/1?old', status=503, body='<Code>SlowDown</Code>')
+    responses.add(responses.PUT, 'https://s3.example.org/1?old', status=403, body='<Code>AccessDenied</Code>')
+    responses.add(responses.PUT, 'https://s3.example.org/1?fresh', status=200,
+        headers={'ETag': f'"{hashlib.md5(data).hexdigest()}"'})
+    file = tmp_path / 'data.dat'
+    file.write_bytes(data)
+    oas3 = OARepoS3Client(mock_oarepo.url, mock_oarepo.token, quiet=True)
+    oas3.retry = RetryPolicy(base=0)
+    oas3.set_file(str(file), showInfo=False)
+    oas3.set_uploadId('up')
+    oas3.presigns = SharedList(None, [1], 1, 1, shared=False)
+    oas3.presigns.list[1] = 'https://s3.example.org/1?old'
+    assert oas3.upload_part(1, 'val-1')['ETag'] == hashlib.md5(data).hexdigest()
+    # fatal client error - no retry:
+    responses.add(responses.PUT, 'https://s3.example.org/1?bad', status=400, body='<Code>InvalidPart</Code>')
+    oas3.presigns.list[1] = 'https://s3.example.org/1?bad'
+    calls = len(responses.calls)
+    try:
+        oas3.upload_part(1, 'val-1')
+        assert False
+    except Exception as e:
+        assert e.args[1] == STATUS_WRONG_SERVER_RESPONSE
+    assert len(responses.calls) == calls + 1
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 CESNET.
+#
+# OARepo-S3-CLI is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Module standin tests - client against local stand-in server."""
+
+import hashlib, io, os, pytest, requests
+
+from oarepo_s3_cli.constants import *
+from oarepo_s3_cli.lib import OARepoS3Client
+from oarepo_s3_cli.standin import FILES_PATH, StandinServer
+from oarepo_s3_cli.utils import get_multipart_etag
+
+
+@pytest.fixture
+def standin():
+    srv = StandinServer(tls=False, seed=1).start()
+    yield srv
+    srv.stop()
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    file = tmp_path / 'data.dat'
+    file.write_bytes(os.urandom(2 * MIN_PART_SIZE + 1000))
+    return file
+
+
+def md5_parts(data):
+    return [hashlib.md5(data[i:i + MIN_PART_SIZE]).hexdigest() for i in range(0, len(data), MIN_PART_SIZE)]
+
+
+@pytest.mark.parametrize('engine', ['thread', 'process'])
+def test_standin_upload(standin, data_file, engine):
+    oas3 = OARepoS3Client(standin.base_url, 'tok', parallel=2, quiet=True, engine=engine, part_size=MIN_PART_SIZE)
+    location, status = oas3.process_click_upload(None, str(data_file))
+    assert status == STATUS_OK and location == f'{standin.base_url}{FILES_PATH}data.dat'
+    obj = standin.objects['data.dat']
+    assert obj.size == data_file.stat().st_size
+    assert obj.etag == get_multipart_etag(md5_parts(data_file.read_bytes()))
+    assert standin.stats['parts'] == 3 and standin.stats['bytes_in'] >= obj.size
+    assert not standin.uploads
+
+
+def test_standin_check_download(standin, data_file, tmp_path):
+    oas3 = OARepoS3Client(standin.base_url, 'tok', parallel=2, quiet=True, part_size=MIN_PART_SIZE)
+    oas3.process_click_upload(None, str(data_file))
+    check = OARepoS3Client(standin.base_url, 'tok', parallel=2, quiet=True, part_size=MIN_PART_SIZE)
+    assert check.process_click_check('data.dat', str(data_file)) == (True, STATUS_OK)
+    # ranged GET of object (redirect to presigned URL):
+    url = f'{standin.base_url}{FILES_PATH}data.dat'
+    resp = requests.get(url, headers={'Range': 'bytes=10-19'})
+    assert resp.status_code == 206 and resp.content == data_file.read_bytes()[10:20]
+    assert resp.headers['Content-Range'] == f'bytes 10-19/{data_file.stat().st_size}'
+    assert requests.get(url, headers={'Range': 'bytes=999999999-'}).status_code == 416
+    out = tmp_path / 'out.dat'
+    oas3 = OARepoS3Client(standin.base_url, 'tok', parallel=2, quiet=True)
+    assert oas3.process_click_download('data.dat', str(out)) == (str(out), STATUS_OK)
+    assert out.read_bytes() == data_file.read_bytes()
+    assert standin.stats['gets'] > 0
+
+
+def test_standin_faults(data_file):
+    srv = StandinServer(tls=False, errors=0.3, throttle=2, latency=0.01, seed=1).start()
+    try:
+        oas3 = OARepoS3Client(srv.base_url, 'tok', parallel=3, quiet=True, part_size=MIN_PART_SIZE)
+        location, status = oas3.process_click_upload(None, str(data_file))
+        assert status == STATUS_OK
+        assert srv.stats['errors'] + srv.stats['throttled'] > 0 and srv.stats['parts'] == 3
+        assert srv.objects['data.dat'].etag == get_multipart_etag(md5_parts(data_file.read_bytes()))
+    finally:
+        srv.stop()
+
+
+def test_standin_api():
+    srv = StandinServer(tls=False, token='secret', expires=0).start()
+    try:
+        assert requests.get(f'{srv.base_url}/access-tokens/status').status_code == 401
+        headers = {'Authorization': 'Bearer secret'}
+        resp = requests.get(f'{srv.base_url}/access-tokens/status', headers=headers)
+        assert resp.json()['links']['files'] == f'{srv.base_url}{FILES_PATH}'
+        upload = requests.post(f'{srv.base_url}{FILES_PATH}?multipart=true', headers=headers,
+                               json={'key': 'k', 'size': 10, 'multipart_content_type': 'application/octet-stream'}).json()
+        urls = requests.get(f"{srv.base_url}{FILES_PATH}k/{upload['uploadId']}/1/presigned", headers=headers).json()
+        # presigned URL expired:
+        assert requests.put(urls['presignedUrls']['1'], data=b'x' * 10).status_code == 403
+        assert requests.delete(f"{srv.base_url}{FILES_PATH}k/{upload['uploadId']}/abort", headers=headers).ok
+        assert not srv.uploads and srv.stats['expired'] == 1
+    finally:
+        srv.stop()
+
+
+@pytest.mark.parametrize('direct', [True, False])
+def test_standin_small_file(tmp_path, direct):
+    file = tmp_path / 'small.dat'
+    file.write_bytes(os.urandom(64 * 1024))
+    srv = StandinServer(tls=False, direct=direct).start()
+    try:
+        oas3 = OARepoS3Client(srv.base_url, 'tok', parallel=4, quiet=True)
+        location, status = oas3.process_click_upload(None, str(file), nocheck=False)
+        assert status == STATUS_OK and location == f'{srv.base_url}{FILES_PATH}small.dat'
+        assert srv.objects['small.dat'].size == 64 * 1024
+        # one PUT to files API, or one part multipart upload (init, presign, part, complete):
+        assert (srv.stats['direct'], srv.stats['parts']) == ((1, 0) if direct else (0, 1))
+    finally:
+        srv.stop()
+
+
+@pytest.mark.parametrize('size', [1000, 3 * MIN_PART_SIZE + 1000, 2 * MIN_PART_SIZE])
+def test_standin_stream(standin, size):
+    data = os.urandom(size)
+    oas3 = OARepoS3Client(standin.base_url, 'tok', parallel=2, quiet=True, part_size=MIN_PART_SIZE)
+    location, status = oas3.process_click_stream('stream.dat', io.BytesIO(data), nocheck=False)
+    assert status == STATUS_OK and location == f'{standin.base_url}{FILES_PATH}stream.dat'
+    obj = standin.objects['stream.dat']
+    assert obj.size == size and not standin.uploads
+    if size > MIN_PART_SIZE:
+        assert obj.etag == get_multipart_etag(md5_parts(data))
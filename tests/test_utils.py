@@ -6,13 +6,14 @@
 # it under the terms of the MIT License; see LICENSE file for more details.
 
 """Module tests."""
-import pytest, responses
+import hashlib, io, pytest, responses
 from unittest import mock
 
 from oarepo_s3_cli.utils import *
 from oarepo_s3_cli.constants import *
 from tests.conftest import fake_file_info
 from oarepo_s3_cli.lib import OARepoS3Client
+from oarepo_s3_cli.retry import RetryPolicy
 
 def test_get_file_chunk_size():
     """ Test get_file_chunk_size"""
@@ -33,6 +34,51 @@ def test_get_file_chunk_size():
     with pytest.raises(Exception):
         get_file_chunk_size(MIB_5*50*MAX_PARTS+1)
 
+def test_get_file_chunk_size_explicit():
+    assert get_file_chunk_size(1, MIB_5) == (1, 1, 1)
+    assert get_file_chunk_size(MIB_5*3+1, MIB_5) == (4, MIB_5, 1)
+    with pytest.raises(Exception):
+        get_file_chunk_size(MIB_5*3, MIB_5-1)
+    with pytest.raises(Exception):
+        get_file_chunk_size(MIB_5*MAX_PARTS+1, MIB_5)
+
+def test_plan_part_size():
+    GIB = 1024*1024*1024
+    assert plan_part_size(1024, 8) == MIN_PART_SIZE
+    # 1.2 GiB on 8 streams: 4 parts per stream
+    size = plan_part_size(int(1.2*GIB), 8)
+    assert get_file_chunk_size(int(1.2*GIB), size)[0] == 32
+    # 60 GiB on 64 streams: parts for every stream
+    assert get_file_chunk_size(60*GIB, plan_part_size(60*GIB, 64))[0] >= 64*PARTS_PER_STREAM
+    # known throughput: PART_TARGET_SECS per part on each stream
+    assert plan_part_size(100*GIB, 10, throughput=10*MIB_5) == MIB_5*PART_TARGET_SECS
+    # S3 limits
+    assert plan_part_size(40*1024*GIB, 1) * MAX_PARTS >= 40*1024*GIB
+    assert plan_part_size(10*GIB, 8, throughput=1) == MIN_PART_SIZE
+    assert plan_part_size(10*GIB, 8) % PART_SIZE_ALIGN == 0
+
+@mock.patch.dict('oarepo_s3_cli.utils._sessions', clear=True)
+def test_get_session():
+    session = get_session(3)
+    assert session is get_session()
+    adapter = session.get_adapter('https://s3.example.org/bucket')
+    assert adapter._pool_maxsize == 3
+    assert adapter is session.get_adapter('http://127.0.0.1:5555')
+
+@mock.patch.dict('oarepo_s3_cli.utils._sessions', clear=True)
+def test_get_session_grow(range_server):
+    session = get_session(2)
+    adapter = session.get_adapter(range_server.url)
+    assert session.get(range_server.url, headers={'Range': 'bytes=0-9'}).status_code == 206
+    assert len(adapter.poolmanager.pools) == 1
+    # larger pool mounted, connections of replaced one closed:
+    assert get_session(4).get_adapter(range_server.url) is not adapter
+    assert len(adapter.poolmanager.pools) == 0
+
+def test_get_https_verify():
+    assert get_https_verify('https://127.0.0.1:5555/api') is False
+    assert get_https_verify('https://repo.example.org') is True
+
 def test_size_fmt():
     assert size_fmt(999) == '999 B'
     assert size_fmt(1023) == '1023 B'
@@ -45,14 +91,10 @@ def test_size_fmt():
     assert size_fmt(1024*1024*1024*1024) == '1 TiB'
 
 @responses.activate
-@mock.patch('builtins.open', new_callable=mock.mock_open, read_data=fake_file_info.data)
-@mock.patch('os.access')
-@mock.patch('os.path.exists')
-@mock.patch('os.path.isfile')
-@mock.patch('os.path.getsize')
-def test_hash_file(mock_path_getsize, mock_path_isfile, mock_path_exists, mock_os_access, mock_open, mock_oarepo):
-    test_size = fake_file_info.size
-    test_filename = fake_file_info.filename
+def test_hash_file(mock_oarepo, tmp_path):
+    test_filename = str(tmp_path / fake_file_info.filename)
+    with open(test_filename, 'wb') as fh:
+        fh.write(fake_file_info.data.encode())
 
     token_status_url = f"{mock_oarepo.url}/access-tokens/status"
     responses.add(responses.GET, token_status_url, status=200,
@@ -67,18 +109,168 @@ def test_hash_file(mock_path_getsize, mock_path_isfile, mock_path_exists, mock_o
     assert isinstance(oas3, OARepoS3Client)
     assert oas3.url == mock_oarepo.url
 
-    mock_os_access.side_effect = lambda fn, mode: fn == test_filename
-    mock_path_exists.side_effect = lambda fn: fn == test_filename
-    mock_path_isfile.side_effect = lambda fn: fn == test_filename
-    mock_path_getsize.side_effect = lambda fn: test_size if fn == test_filename else FileNotFoundError
     oas3.set_file(test_filename, mock_oarepo.key)
     oas3.urlFiles = oas3.check_token_status(mock_oarepo.token)
     file_url = f"{oas3.urlFiles}{mock_oarepo.key}"
     responses.add(responses.GET, file_url, status=200, body=fake_file_info.data)
-    with mock.patch('builtins.open', new_callable=mock.mock_open, read_data=fake_file_info.data.encode()):
-        local_hash = get_local_hash(fake_file_info.filename)
-        assert local_hash == fake_file_info.hash_md5
-        remote_hash = get_remote_hash(mock_oarepo.token, file_url)
-        assert remote_hash == fake_file_info.hash_md5
-        assert local_hash == remote_hash
-        assert (True, STATUS_OK) == oas3.process_click_check(mock_oarepo.key, test_filename)
+    local_hash = get_local_hash(test_filename)
+    assert local_hash == fake_file_info.hash_md5
+    remote_hash = get_remote_hash(mock_oarepo.token, file_url)
+    assert remote_hash == fake_file_info.hash_md5
+    assert local_hash == remote_hash
+    assert (True, STATUS_OK) == oas3.process_click_check(mock_oarepo.key, test_filename)
+
+def test_local_hash_parallel(tmp_path):
+    fn = tmp_path / 'parts.dat'
+    data = bytes(range(256)) * 40
+    fn.write_bytes(data)
+    parts = [hashlib.md5(data[i:i+1000]).digest() for i in range(0, len(data), 1000)]
+    assert get_local_hash(str(fn), 1000, parallel=4) == get_multipart_etag(parts)
+    assert get_local_hash(str(fn), 1000, parallel=1) == get_multipart_etag(parts)
+
+def test_file_slice(tmp_path):
+    fn = tmp_path / 'slice.dat'
+    fn.write_bytes(bytes(range(256)) * 4)
+    with FileSlice(str(fn), 250, 20) as body:
+        assert len(body) == 20
+        assert body.read(6) == bytes(range(250, 256))
+        assert body.tell() == 6
+        assert body.read() == bytes(range(14))
+        assert body.read() == b''
+        body.seek(0)
+        assert b''.join(body) == bytes(range(250, 256)) + bytes(range(14))
+        assert body.hexdigest() == hashlib.md5(bytes(range(250, 256)) + bytes(range(14))).hexdigest()
+        body.seek(3)
+        assert body.hexdigest() is None
+
+def test_get_multipart_etag():
+    digests = [hashlib.md5(b'a').digest(), hashlib.md5(b'b').digest()]
+    etag = hashlib.md5(b''.join(digests)).hexdigest() + '-2'
+    assert get_multipart_etag(digests) == etag
+    assert get_multipart_etag([d.hex() for d in digests]) == etag
+    assert is_md5(digests[0].hex())
+    assert not is_md5('mockETag')
+
+def test_remote_hash_ranges(range_server):
+    data = range_server.data
+    parts = [hashlib.md5(data[i:i+100000]).digest() for i in range(0, len(data), 100000)]
+    assert get_remote_hash('token', range_server.url, 100000, parallel=4) == get_multipart_etag(parts)
+    # size probe + one aligned range per part:
+    assert len(range_server.ranges) == 1 + len(parts)
+    assert ('100000', '199999') in range_server.ranges
+    assert get_remote_size('token', range_server.url) == len(data)
+
+def test_iter_upload_sources(tmp_path):
+    for rel in ('a.dat', 'sub/b.dat', 'sub/deep/c.txt'):
+        (tmp_path / 'data' / rel).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / 'data' / rel).write_bytes(b'x')
+    data = str(tmp_path / 'data')
+    sources = iter_upload_sources([data], ['pfx'])
+    assert not isinstance(sources, list)
+    assert sorted(key for file, key, ct in sources) == ['pfx/a.dat', 'pfx/sub/b.dat', 'pfx/sub/deep/c.txt']
+    assert sorted(key for file, key, ct in iter_upload_sources([f'{data}/**/*.dat'])) == ['a.dat', 'sub/b.dat']
+    assert list(iter_upload_sources([f'{data}/a.dat'])) == [(f'{data}/a.dat', None, None)]
+
+    manifest = tmp_path / 'files.tsv'
+    manifest.write_text(f"# path key type\n{data}/a.dat\tA\ttext/plain\n\n{data}/sub/b.dat\n")
+    assert list(iter_upload_sources([], manifest=str(manifest))) == \
+           [(f'{data}/a.dat', 'A', 'text/plain'), (f'{data}/sub/b.dat', None, None)]
+    manifest = tmp_path / 'files.jsonl'
+    manifest.write_text('{"path": "data/a.dat", "content_type": "text/plain"}\n{"path": "data/sub/b.dat", "key": "B"}\n')
+    assert list(iter_manifest(str(manifest))) == [('data/a.dat', 'data/a.dat', 'text/plain'), ('data/sub/b.dat', 'B', None)]
+
+def test_get_presign_expiry():
+    assert abs(get_presign_expiry('https://s3/b/k?X-Amz-Date=20210101T000000Z&X-Amz-Expires=600')
+               - time.time() - 600) < 5
+    assert get_presign_expiry('https://s3/b/k?Expires=1609459200&Signature=x') == 1609459200
+    assert abs(get_presign_expiry('https://s3/b/k') - time.time() - PRESIGN_EXPIRES) < 5
+
+def test_presign_prefetcher():
+    calls = []
+    def presign(pnums):
+        calls.append(list(pnums))
+        return {pn: f"https://s3/{pn}?X-Amz-Expires=600" for pn in pnums}
+    presigns = PresignPrefetcher(presign, list(range(1, 301)), 20, 100, low_water=30)
+    try:
+        # wanted out of turn - presigned on demand:
+        assert presigns.pop(200, timeout=5).startswith('https://s3/200?')
+        assert calls[0][0] == 200
+        with ThreadPool(4) as pool:
+            urls = pool.map(lambda pn: presigns.pop(pn, timeout=5), range(1, 251))
+        assert [url.split('?')[0] for url in urls] == [f"https://s3/{pn}" for pn in range(1, 251)]
+        # prefetched in batches, at most maxlen ahead:
+        assert max(len(c) for c in calls) == 20 and len(presigns.list) <= 100
+        # expired URL presigned again, not returned:
+        presigns.pop(260, timeout=5)
+        with presigns.cond:
+            presigns.list[261] = ('https://s3/261-expired', time.time())
+        assert presigns.pop(261, timeout=5) == 'https://s3/261?X-Amz-Expires=600'
+    finally:
+        presigns.close()
+
+def test_presign_prefetcher_error():
+    presign = mock.Mock(side_effect=[Exception('presign failed'), {2: 'https://s3/2', 3: 'https://s3/3'}])
+    presigns = PresignPrefetcher(presign, [1, 2, 3], 2, 100)
+    presigns.backoff = RetryPolicy(base=0.01)
+    try:
+        # awaited part of failed request handed back to worker:
+        assert presigns.pop(1, timeout=5) is None
+        assert presigns.error is not None
+        # prefetch goes on after backoff:
+        assert presigns.pop(2, timeout=5) == 'https://s3/2' and presigns.pop(3, timeout=5) == 'https://s3/3'
+        assert presigns.thread.is_alive() and presigns.errors == 0
+    finally:
+        presigns.close()
+
+def test_part_reader(tmp_path):
+    fn = tmp_path / 'data.dat'
+    data = os.urandom(10 * 1000 + 7)
+    fn.write_bytes(data)
+    get_range = lambda pn: ((pn - 1) * 1000, 1000 if pn < 11 else 7)
+    order = [3, 1, 2, 11] + list(range(4, 11))
+    reader = PartReader(str(fn), order, get_range, max_bytes=2500)
+    try:
+        body = reader.get(3, timeout=5)
+        assert body.read() == data[2000:3000] and body.hexdigest() == hashlib.md5(data[2000:3000]).hexdigest()
+        time.sleep(0.2)
+        # bounded read-ahead - waiting for release:
+        assert reader.used <= 2500 and sorted(reader.sizes) == [1, 3]
+        for pn in order:
+            with reader.get(pn, timeout=5) as body:
+                assert len(body) == get_range(pn)[1]
+                assert body.read(10) + body.read() == data[get_range(pn)[0]:sum(get_range(pn))]
+            reader.release(pn)
+        assert reader.get(12) is None and reader.used == 0
+    finally:
+        reader.close()
+
+def test_stream_reader():
+    data = os.urandom(7 * 1000 + 5)
+    reader = StreamReader(io.BytesIO(data), 1000, max_parts=2, growth=2)
+    assert [reader.get_part_size(pn) for pn in (1, 2, 3, 5)] == [1000, 1000, 2000, 4000]
+    assert reader.read() == 1 and reader.read() == 2
+    # bounded - next part read after release:
+    waiter = threading.Thread(target=reader.read)
+    waiter.start()
+    waiter.join(0.2)
+    assert waiter.is_alive()
+    reader.release(1)
+    waiter.join(5)
+    assert reader.range(3) == (2000, 2000)
+    with reader.get(3) as body:
+        assert body.read() == data[2000:4000] and body.hexdigest() == hashlib.md5(data[2000:4000]).hexdigest()
+    reader.release(2)
+    reader.release(3)
+    assert reader.read() == 4 and reader.range(4) == (4000, 2000) and not reader.eof
+    reader.release(4)
+    assert reader.read() == 5 and reader.range(5) == (6000, 1005) and reader.eof
+    assert reader.read() is None and reader.size == len(data)
+
+def test_remote_hash_retry(range_server):
+    data = range_server.data
+    parts = [hashlib.md5(data[i:i+100000]).digest() for i in range(0, len(data), 100000)]
+    # transient server error and connection broken in body - ranges read again:
+    range_server.faults = [500, 'reset', 'reset']
+    assert get_remote_hash('token', range_server.url, 100000, parallel=4,
+                           retry=RetryPolicy(base=0.01)) == get_multipart_etag(parts)
+    assert range_server.faults == []